@@ -3,14 +3,27 @@ ASGI config for Open_Printer_Management_System project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Requests for ``LIVE_UPDATES_URL`` are sent to the Server-Sent Events stream in app/events.py, which is a plain
+ASGI application so the open streams don't use Django's worker threads. Everything else goes to Django.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Open_Printer_Management_System.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after the apps are loaded by get_asgi_application().
+from app.events import events_application
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == settings.LIVE_UPDATES_URL:
+        await events_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -80,6 +80,18 @@ WSGI_APPLICATION = 'Open_Printer_Management_System.wsgi.application'
 
 DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),}}
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The rendered dashboard is cached (see app/caching.py). A file based cache is used so the web workers and the
+#   poller share it, and a poll in the poller invalidates the dashboard of every web worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -132,3 +144,99 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 
 TIMEDELTA = timedelta(minutes=10)
+
+# Number of printers the updatetonerdata command polls at the same time.
+POLLER_WORKERS = 16
+
+# Sharded pollers (updatetonerdata --worker-id, see app/leases.py). Every worker leases POLLER_LEASE_BATCH printers
+#   at a time from the database, polls them, and gives them back. A lease expires after POLLER_LEASE_DURATION, so the
+#   printers of a worker that died are polled by the others. Printers polled less than POLLER_LEASE_REPOLL_AFTER ago
+#   were already polled by another worker in the same cycle and are skipped.
+POLLER_LEASE_BATCH = 50
+POLLER_LEASE_DURATION = timedelta(minutes=5)
+POLLER_LEASE_REPOLL_AFTER = TIMEDELTA / 2
+
+# Seconds to wait for each SNMP response from a printer and how many times to retry after a timeout.
+POLLER_PRINTER_TIMEOUT = 2
+POLLER_RETRIES = 1
+
+# Longest time a full toner update can take. Printers that haven't answered by then are skipped until the next update.
+POLLER_CYCLE_DEADLINE = TIMEDELTA
+
+# The runpoller daemon polls every printer on its own interval between these bounds, based on how fast its toner
+#   is being used and how low it is (see poll_intervals in app/poller.py). Printers without percentage levels,
+#   or that are off, are polled every TIMEDELTA.
+POLL_INTERVAL_MIN = timedelta(minutes=2)
+POLL_INTERVAL_MAX = timedelta(hours=1)
+
+# Percentage points a module can drop between two polls at its recent rate of use.
+POLL_LEVEL_STEP = 1
+
+# Printers with a module at or below this percentage are polled at least every TIMEDELTA, and more often the closer
+#   to empty it gets, so low toner alerts aren't delayed.
+POLL_LOW_LEVEL = 15
+
+# How far back the toner history is read to find the rate each module is being used at.
+POLL_RATE_WINDOW = timedelta(days=3)
+
+# Circuit breaker for printers that are off. After this many polls in a row without an answer the breaker opens and
+#   the printer isn't polled again until BREAKER_BACKOFF later. Every failed retry doubles the wait, up to
+#   BREAKER_BACKOFF_MAX. A retry first sends a single sysUpTime GET and only polls the supplies if it answers.
+BREAKER_FAILURE_THRESHOLD = 2
+BREAKER_BACKOFF = TIMEDELTA
+BREAKER_BACKOFF_MAX = timedelta(hours=4)
+
+# SNMP communities tried when determining the SNMP settings of a printer.
+SNMP_COMMUNITIES = ['public']
+
+# When a printer stops answering with its saved SNMP version and community, they are determined again,
+#   but not more often than this so printers that are off don't get probed every update.
+SNMP_RECHECK_INTERVAL = timedelta(hours=1)
+
+# SNMP sessions are reused between requests to the same printer (see SessionPool in app/snmp.py).
+# Idle sessions are closed after SNMP_SESSION_IDLE_TIMEOUT, which should be longer than POLL_INTERVAL_MAX so the
+#   poller keeps the session of every printer, and no more than SNMP_SESSION_POOL_SIZE are kept open at a time.
+SNMP_SESSION_IDLE_TIMEOUT = timedelta(hours=2)
+SNMP_SESSION_POOL_SIZE = 500
+# A session that was idle for SNMP_SESSION_CHECK_AFTER or more is checked with a sysUpTime GET before it is reused,
+#   and replaced by a new one if the printer doesn't answer the check.
+SNMP_SESSION_CHECK_AFTER = timedelta(minutes=5)
+
+# Seconds a rendered dashboard is kept in the cache. It is invalidated sooner when the printers or their toner
+#   levels change, so this only limits how old the relative times on it ("5 minutes old") can get.
+DASHBOARD_CACHE_TIMEOUT = 60
+
+# File the pollers add their metrics to (SNMP latencies, timeouts, database writes, see app/metrics.py).
+# It is shared by all the processes, read by the /metrics page, and has to be writable by all of them.
+# It is kept in its own directory, like the cache, with the lock and temporary files used to update it.
+#   The directory is created on the first flush.
+METRICS_FILE = os.path.join(BASE_DIR, 'metrics', 'metrics.json')
+
+# Days-until-empty forecasts (see app/forecasting.py). A level more than FORECAST_SWAP_JUMP points above the
+#   previous one is a new cartridge. A module needs FORECAST_MIN_OBSERVATIONS observations (the first and last
+#   time each level was seen) over at least FORECAST_MIN_SPAN since its cartridge was put in before it gets a
+#   forecast.
+FORECAST_SWAP_JUMP = 10
+FORECAST_MIN_OBSERVATIONS = 3
+FORECAST_MIN_SPAN = timedelta(hours=12)
+
+# Path of the Server-Sent Events stream that updates the open dashboards after every poll (see app/events.py).
+# It is served by the ASGI application in asgi.py, so it only works when the project runs with an ASGI server.
+LIVE_UPDATES_URL = '/events'
+
+# How the toner level history is stored.
+#   'changes': A new TonerLevel row is only written when the level of a module changes. While it stays the same,
+#              the last_seen time of the latest row is extended.
+#   'samples': A new TonerLevel row is written for every module every time the printers are polled.
+TONER_HISTORY_MODE = 'changes'
+
+# The rolluptonerdata command reads the TonerLevel rows last seen after this much time before its previous run
+#   started again. The pollers stamp the rows with the time they started writing, so a row can be committed a while
+#   after that time and would be missed if the next run only read the rows last seen after the previous run started.
+#   Reading a row twice doesn't change the rollups. It has to be longer than the slowest write of the pollers.
+ROLLUP_SAFETY_LAG = timedelta(minutes=15)
+
+# TonerLevel rows last seen longer ago than this are deleted by the rolluptonerdata command once they have been
+#   summarized into the hourly and daily rollups, along with the PollCycle rows recorded before then.
+#   Set it to None to keep all of them.
+TONER_HISTORY_RETENTION = timedelta(days=365)
@@ -1,13 +1,63 @@
 from django.contrib import admin
 
-from .models import Printer, TonerLevel
+from .caching import bump_dashboard_version
+from .models import Printer, TonerLevel, CurrentTonerLevel, PollCycle, TonerLevelRollup, TonerForecast, PollJob, PrinterLease
 
 class PrinterAdmin(admin.ModelAdmin):
-    list_display = ('printer_name', 'printer_model_name', 'printer_location', 'ip_address', 'department_name')
+    list_display = ('printer_name', 'printer_model_name', 'printer_location', 'ip_address', 'department_name', 'poller_site', 'poll_interval', 'breaker_state')
+    list_filter = ('poller_site',)
+
+    # Printers changed from the admin site are shown on the dashboard right away instead of when it expires.
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        bump_dashboard_version()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_dashboard_version()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        bump_dashboard_version()
 
 admin.site.register(Printer, PrinterAdmin)
 
 class TonerLevelAdmin(admin.ModelAdmin):
-    list_display = ('printer_name', 'date_time', 'module_identifier', 'level')
+    list_display = ('printer_name', 'date_time', 'last_seen', 'module_identifier', 'level')
 
 admin.site.register(TonerLevel, TonerLevelAdmin)
+
+
+class CurrentTonerLevelAdmin(admin.ModelAdmin):
+    list_display = ('printer_name', 'date_time', 'module_identifier', 'level')
+
+admin.site.register(CurrentTonerLevel, CurrentTonerLevelAdmin)
+
+class PollCycleAdmin(admin.ModelAdmin):
+    list_display = ('date_time', 'printer_count', 'rows_written')
+
+admin.site.register(PollCycle, PollCycleAdmin)
+
+class TonerLevelRollupAdmin(admin.ModelAdmin):
+    list_display = ('printer_name', 'period', 'period_start', 'module_identifier', 'min_level', 'max_level', 'last_level')
+    list_filter = ('period',)
+
+admin.site.register(TonerLevelRollup, TonerLevelRollupAdmin)
+
+class TonerForecastAdmin(admin.ModelAdmin):
+    list_display = ('printer_name', 'module_identifier', 'last_level', 'last_seen', 'rate', 'days_left', 'empty_date')
+    ordering = ('empty_date',)
+
+admin.site.register(TonerForecast, TonerForecastAdmin)
+
+class PollJobAdmin(admin.ModelAdmin):
+    list_display = ('created', 'status', 'printers_total', 'printers_done', 'printers_failed', 'rows_written', 'finished')
+    list_filter = ('status',)
+
+admin.site.register(PollJob, PollJobAdmin)
+
+class PrinterLeaseAdmin(admin.ModelAdmin):
+    list_display = ('printer_name', 'worker_id', 'expires', 'polled_at')
+    list_filter = ('worker_id',)
+
+admin.site.register(PrinterLease, PrinterLeaseAdmin)
@@ -0,0 +1,417 @@
+import asyncio
+import glob
+import os
+import random
+import re
+import resource
+from bisect import bisect_right
+
+# Simulated SNMP agents used by the ``benchmarkpolling`` command to poll a fleet of printers without a network.
+# Every agent answers SNMP v1/v2c GET, GETNEXT, and GETBULK requests on its own UDP port of the loopback
+#   address from a recorded walk of a printer (the *.snmpwalk files in the snmpwalks directory), with a
+#   configurable latency and packet loss. The farm runs in its own process so it doesn't compete with the
+#   poller for the GIL, and doesn't use Django.
+
+# Directory with the recorded walks, in the format of ``snmpwalk -On`` (one ``.OID = TYPE: value`` per line).
+WALKS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snmpwalks')
+
+# BER tags of the values and PDUs used by SNMP v1 and v2c.
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+COUNTER64 = 0x46
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+
+GET_REQUEST = 0xA0
+GET_NEXT_REQUEST = 0xA1
+GET_RESPONSE = 0xA2
+GET_BULK_REQUEST = 0xA5
+
+# Error status of an SNMP v1 response for an OID that doesn't exist or has nothing after it.
+NO_SUCH_NAME = 2
+
+# Most values put in a single GETBULK response, the same limit most printers have.
+MAX_BULK_VARIABLES = 64
+
+# Types of the snmpwalk output and the BER tag they are sent with.
+WALK_TYPES = {
+    'STRING': OCTET_STRING,
+    'Hex-STRING': OCTET_STRING,
+    'INTEGER': INTEGER,
+    'Gauge32': GAUGE32,
+    'Counter32': COUNTER32,
+    'Counter64': COUNTER64,
+    'Timeticks': TIMETICKS,
+    'OID': OBJECT_IDENTIFIER,
+    'IpAddress': IP_ADDRESS,
+}
+
+WALK_LINE = re.compile(r'^(?P<oid>\.?[\d.]+) = (?:(?P<type>[\w-]+): )?(?P<value>.*)$')
+
+SUPPLY_LEVEL_PREFIX = (1, 3, 6, 1, 2, 1, 43, 11, 1, 1, 9, 1)
+SUPPLY_MAX_CAPACITY_PREFIX = (1, 3, 6, 1, 2, 1, 43, 11, 1, 1, 8, 1)
+
+class MibView:
+    """ Values of a recorded walk, sorted by OID so the next OID of a GETNEXT is found with a binary search.
+
+    The values are encoded once when the walk is loaded, so answering a request only copies bytes.
+
+    Args:
+        values (dict): Encoded BER value (bytes) of every OID (tuple of ints).
+    """
+    def __init__(self, values):
+        self.values = values
+        self.oids = sorted(values)
+
+    @classmethod
+    def from_walk(cls, path):
+        """ Load a walk saved with ``snmpwalk -On -v2c -c public <printer> .1.3.6.1.2.1`` (or ``.1``). """
+        values = dict()
+        with open(path) as walk_file:
+            for line in walk_file:
+                match = WALK_LINE.match(line.strip())
+                if match is None:
+                    # Multi-line strings and "No more variables left" lines.
+                    continue
+                oid = parse_oid(match.group('oid'))
+                values[oid] = encode_walk_value(match.group('type') or 'STRING', match.group('value'))
+        return cls(values)
+
+    def with_random_levels(self, generator):
+        """ Return a copy of the view with random percentages in the supply levels, so every printer is different. """
+        values = dict(self.values)
+        for oid, value in self.values.items():
+            if oid[:len(SUPPLY_LEVEL_PREFIX)] != SUPPLY_LEVEL_PREFIX:
+                continue
+            level = decode_integer(value[2:])
+            max_capacity_value = self.values.get(SUPPLY_MAX_CAPACITY_PREFIX + oid[len(SUPPLY_LEVEL_PREFIX):])
+            max_capacity = decode_integer(max_capacity_value[2:]) if max_capacity_value else 0
+            # -3 (OK) and -2 (Unknown) levels are kept.
+            if level >= 0 and max_capacity > 0:
+                values[oid] = tlv(INTEGER, encode_integer(generator.randint(0, max_capacity)))
+        return MibView(values)
+
+    def get(self, oid):
+        return self.values.get(oid)
+
+    def next(self, oid):
+        """ Return the OID after ``oid`` and its value, or ``(None, None)`` at the end of the MIB. """
+        position = bisect_right(self.oids, oid)
+        if position == len(self.oids):
+            return None, None
+        next_oid = self.oids[position]
+        return next_oid, self.values[next_oid]
+
+class SimulatedAgent(asyncio.DatagramProtocol):
+    """ A single simulated printer answering SNMP requests on a UDP port.
+
+    Args:
+        view (MibView): Values of the printer.
+        versions (set): SNMP versions answered (1 and/or 2). Requests with other versions are ignored, like a real agent.
+        community (str): Community answered, requests with other communities are ignored.
+        latency (float): Seconds before every response is sent.
+        jitter (float): Up to this many seconds are added to the latency of every response at random.
+        loss (float): Fraction (0 to 1) of requests that are dropped without an answer.
+        counters (list): Shared ``[received, dropped]`` counters of the agent (a slice of a ``multiprocessing.Array``).
+        generator (random.Random): Random generator used for the jitter and the packet loss.
+    """
+    def __init__(self, view, versions, community, latency, jitter, loss, counters, generator):
+        self.view = view
+        self.versions = versions
+        self.community = community.encode()
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.counters = counters
+        self.generator = generator
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.counters[0] += 1
+        if self.loss and self.generator.random() < self.loss:
+            self.counters[1] += 1
+            return
+
+        try:
+            response = self.respond(data)
+        except (ValueError, IndexError):
+            # Not a valid SNMP message.
+            return
+        if response is None:
+            return
+
+        delay = self.latency + (self.generator.random() * self.jitter if self.jitter else 0)
+        if delay > 0:
+            asyncio.get_event_loop().call_later(delay, self.transport.sendto, response, address)
+        else:
+            self.transport.sendto(response, address)
+
+    def respond(self, data):
+        """ Return the encoded response to an SNMP request, or ``None`` if it shouldn't be answered. """
+        version, community, pdu_type, request_id, non_repeaters, max_repetitions, oids = decode_request(data)
+        if version + 1 not in self.versions or community != self.community:
+            return None
+
+        error_status = error_index = 0
+        variables = list()
+
+        if pdu_type == GET_REQUEST:
+            for position, oid in enumerate(oids):
+                value = self.view.get(oid)
+                if value is None:
+                    if version == 0:
+                        error_status, error_index = NO_SUCH_NAME, position + 1
+                        break
+                    value = tlv(NO_SUCH_INSTANCE, b'')
+                variables.append((oid, value))
+
+        elif pdu_type == GET_NEXT_REQUEST or (pdu_type == GET_BULK_REQUEST and version == 0):
+            for position, oid in enumerate(oids):
+                next_oid, value = self.view.next(oid)
+                if next_oid is None:
+                    if version == 0:
+                        error_status, error_index = NO_SUCH_NAME, position + 1
+                        break
+                    next_oid, value = oid, tlv(END_OF_MIB_VIEW, b'')
+                variables.append((next_oid, value))
+
+        elif pdu_type == GET_BULK_REQUEST:
+            non_repeaters = max(0, min(non_repeaters, len(oids)))
+            for oid in oids[:non_repeaters]:
+                next_oid, value = self.view.next(oid)
+                variables.append((oid, tlv(END_OF_MIB_VIEW, b'')) if next_oid is None else (next_oid, value))
+
+            # The values are in repetition order: the next value of every column, then the one after that, ...
+            cursors = list(oids[non_repeaters:])
+            for _ in range(max_repetitions):
+                if not cursors or len(variables) + len(cursors) > MAX_BULK_VARIABLES:
+                    break
+                finished = True
+                for position, oid in enumerate(cursors):
+                    next_oid, value = self.view.next(oid)
+                    if next_oid is None:
+                        variables.append((oid, tlv(END_OF_MIB_VIEW, b'')))
+                        continue
+                    finished = False
+                    variables.append((next_oid, value))
+                    cursors[position] = next_oid
+                if finished:
+                    break
+        else:
+            return None
+
+        if error_status:
+            # SNMP v1 errors are sent with the variables of the request.
+            variables = [(oid, tlv(NULL, b'')) for oid in oids]
+
+        return encode_response(version, community, request_id, error_status, error_index, variables)
+
+def run_farm(walk_paths, agent_count, host, base_port, versions, community, latency, jitter, loss, seed, counters,
+             ready, stop):
+    """ Start ``agent_count`` agents on consecutive ports and answer requests until ``stop`` is set.
+
+    This is the target of the farm process (see ``benchmarkpolling``). The agents use the walks one after another,
+      so a fleet of 300 printers with 3 walks has 100 printers of each model.
+
+    Args:
+        walk_paths (list): Paths of the recorded walks.
+        agent_count (int): Number of agents.
+        host (str): Address the agents listen on, ``127.0.0.1``.
+        base_port (int): Port of the first agent, the rest use the next ports.
+        versions (set): SNMP versions answered by the agents.
+        community (str): SNMP community answered by the agents.
+        latency (float): Seconds before every response is sent.
+        jitter (float): Up to this many seconds are added to the latency of every response.
+        loss (float): Fraction of requests that are dropped.
+        seed (int): Seed of the random levels, jitter, and packet loss, so runs can be compared.
+        counters (multiprocessing.Array): ``2 * agent_count`` counters, the requests received and dropped by each agent.
+        ready (multiprocessing.Event): Set when all the agents are listening.
+        stop (multiprocessing.Event): Set by the benchmark to stop the farm.
+    """
+    # Every agent has its own socket, so big fleets need more file descriptors than the usual 1024.
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft_limit != resource.RLIM_INFINITY and soft_limit < agent_count + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+
+    generator = random.Random(seed)
+    views = [MibView.from_walk(path) for path in walk_paths]
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    transports = list()
+    try:
+        for number in range(agent_count):
+            view = views[number % len(views)].with_random_levels(generator)
+            agent = SimulatedAgent(
+                view, versions, community, latency, jitter, loss,
+                _CounterSlice(counters, number * 2), random.Random(seed + number)
+            )
+            transport, _ = loop.run_until_complete(
+                loop.create_datagram_endpoint(lambda agent=agent: agent, local_addr=(host, base_port + number))
+            )
+            transports.append(transport)
+
+        ready.set()
+
+        async def wait_for_stop():
+            while not stop.is_set():
+                await asyncio.sleep(0.1)
+
+        loop.run_until_complete(wait_for_stop())
+    finally:
+        for transport in transports:
+            transport.close()
+        loop.close()
+
+def walk_paths(models=None, directory=WALKS_DIRECTORY):
+    """ Return the paths of the recorded walks whose file name contains one of the ``models`` (all if ``None``). """
+    paths = sorted(glob.glob(os.path.join(directory, '*.snmpwalk')))
+    if models:
+        paths = [path for path in paths if any(model.lower() in os.path.basename(path).lower() for model in models)]
+    return paths
+
+def parse_oid(text):
+    return tuple(int(part) for part in text.strip().strip('.').split('.'))
+
+def encode_walk_value(walk_type, text):
+    """ Encode a value of the snmpwalk output (``STRING: "black"``, ``INTEGER: percent(19)``, ...) as BER. """
+    text = text.strip()
+    tag = WALK_TYPES.get(walk_type, OCTET_STRING)
+
+    if walk_type == 'Hex-STRING':
+        return tlv(tag, bytes.fromhex(text))
+    if tag == OCTET_STRING:
+        if len(text) >= 2 and text[0] == text[-1] == '"':
+            text = text[1:-1]
+        return tlv(tag, text.encode('utf-8'))
+    if tag == OBJECT_IDENTIFIER:
+        return tlv(tag, encode_oid(parse_oid(text)))
+    if tag == IP_ADDRESS:
+        return tlv(tag, bytes(int(part) for part in text.split('.')))
+
+    # Enumerations are shown as "name(value)" and TimeTicks as "(value) 1 day, 2:03:04.05".
+    number = re.search(r'\((-?\d+)\)', text) or re.match(r'-?\d+', text)
+    value = int(number.group(1) if number.re.groups else number.group(0))
+    if tag == INTEGER:
+        return tlv(tag, encode_integer(value))
+    return tlv(tag, encode_unsigned(value))
+
+def decode_request(data):
+    """ Decode an SNMP v1/v2c request.
+
+    Returns:
+        request (tuple): The version (0 is v1, 1 is v2c), community (bytes), PDU type, request id,
+            non-repeaters and max-repetitions (error status and index for PDUs that aren't GETBULK),
+            and the OIDs of the variables (tuples of ints).
+    """
+    tag, message, _ = read_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise ValueError('Not an SNMP message.')
+
+    _, version, position = read_tlv(message, 0)
+    _, community, position = read_tlv(message, position)
+    pdu_type, pdu, _ = read_tlv(message, position)
+
+    _, request_id, position = read_tlv(pdu, 0)
+    _, non_repeaters, position = read_tlv(pdu, position)
+    _, max_repetitions, position = read_tlv(pdu, position)
+    _, variable_list, _ = read_tlv(pdu, position)
+
+    oids = list()
+    position = 0
+    while position < len(variable_list):
+        _, variable, position = read_tlv(variable_list, position)
+        _, oid, _ = read_tlv(variable, 0)
+        oids.append(decode_oid(oid))
+
+    return (
+        decode_integer(version), bytes(community), pdu_type, decode_integer(request_id),
+        decode_integer(non_repeaters), decode_integer(max_repetitions), oids
+    )
+
+def encode_response(version, community, request_id, error_status, error_index, variables):
+    """ Encode an SNMP response with the variables, a list of (OID tuple, encoded value). """
+    variable_list = b''.join(tlv(SEQUENCE, tlv(OBJECT_IDENTIFIER, encode_oid(oid)) + value) for oid, value in variables)
+    pdu = tlv(GET_RESPONSE, b''.join((
+        tlv(INTEGER, encode_integer(request_id)),
+        tlv(INTEGER, encode_integer(error_status)),
+        tlv(INTEGER, encode_integer(error_index)),
+        tlv(SEQUENCE, variable_list),
+    )))
+    return tlv(SEQUENCE, tlv(INTEGER, encode_integer(version)) + tlv(OCTET_STRING, community) + pdu)
+
+def read_tlv(data, position):
+    """ Read the BER tag, length, and value at ``position``. Returns the tag, the value, and the next position. """
+    tag = data[position]
+    length = data[position + 1]
+    position += 2
+    if length & 0x80:
+        length_bytes = length & 0x7F
+        length = int.from_bytes(data[position:position + length_bytes], 'big')
+        position += length_bytes
+    end = position + length
+    if end > len(data):
+        raise ValueError('Truncated BER value.')
+    return tag, data[position:end], end
+
+def tlv(tag, value):
+    length = len(value)
+    if length < 0x80:
+        return bytes((tag, length)) + value
+    length_bytes = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes((tag, 0x80 | len(length_bytes))) + length_bytes + value
+
+def encode_integer(value):
+    return value.to_bytes(max(1, (value + (value < 0)).bit_length() // 8 + 1), 'big', signed=True)
+
+def encode_unsigned(value):
+    # Unsigned types still use two's complement, so values with the high bit set get a leading zero.
+    return value.to_bytes(value.bit_length() // 8 + 1, 'big')
+
+def decode_integer(data):
+    return int.from_bytes(data, 'big', signed=True)
+
+def encode_oid(oid):
+    encoded = bytearray((oid[0] * 40 + oid[1],))
+    for number in oid[2:]:
+        chunk = bytearray((number & 0x7F,))
+        number >>= 7
+        while number:
+            chunk.insert(0, 0x80 | (number & 0x7F))
+            number >>= 7
+        encoded += chunk
+    return bytes(encoded)
+
+def decode_oid(data):
+    first, second = divmod(data[0], 40) if data[0] < 80 else (2, data[0] - 80)
+    oid = [first, second]
+    number = 0
+    for byte in data[1:]:
+        number = (number << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            oid.append(number)
+            number = 0
+    return tuple(oid)
+
+class _CounterSlice:
+    """ The two counters of an agent in the shared array of the farm. """
+    def __init__(self, array, offset):
+        self.array = array
+        self.offset = offset
+
+    def __getitem__(self, index):
+        return self.array[self.offset + index]
+
+    def __setitem__(self, index, value):
+        self.array[self.offset + index] = value
@@ -0,0 +1,354 @@
+import base64
+import binascii
+import hashlib
+from functools import wraps
+
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+
+from .caching import dashboard_version
+from .history import HISTORY_RANGES, HISTORY_CHART_BUCKETS, DEFAULT_HISTORY_RANGE, downsample_history, history_range
+from .models import Printer, TonerLevel, CurrentTonerLevel, TonerForecast
+from .views import breaker_state
+
+# Number of results in a page when the request doesn't have a ``limit``, and the most that can be asked for.
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+def api_etag(request, *args, **kwargs):
+    """ Return the ETag of an API response.
+
+    The data only changes when the printers are polled (a new :model:`app.PollCycle`) or the printers are changed,
+      which both change the dashboard version (see caching.py), so an unchanged request costs one query by primary
+      key and a cache read, and is answered with a 304 without running the view.
+    """
+    key = f'{request.get_full_path()}:{dashboard_version()}'
+    return hashlib.md5(key.encode()).hexdigest()
+
+def api_view(view):
+    """ Decorator used by every API view: GET only, ETag/``If-None-Match`` handling, no caching without checking,
+    and ``ApiError`` turned into a 400 response.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+
+    return require_GET(cache_control(private=True, no_cache=True)(condition(etag_func=api_etag)(wrapper)))
+
+@api_view
+def printers(request):
+    """
+    Return the printers that finished being added, ordered by id.
+
+    **Query parameters**
+        ``department``
+            Only return the printers of this department.
+
+        ``cursor`` and ``limit``
+            See ``paginate``.
+
+    **Response**
+        {
+            'results': [
+                {
+                    'id': 4, 'name': 'IT Copier', 'model': 'Canon iR-ADV C5535', 'location': 'Room 101',
+                    'ip_address': '10.20.3.4', 'department': 'IT', 'snmp_version': 2,
+                    'breaker_state': 'closed', 'poll_interval': 600.0
+                },
+                ...
+            ],
+            'next_cursor': 'NA' or None
+        }
+    """
+    queryset = Printer.objects.filter(probe_state=Printer.READY)
+    department = request.GET.get('department')
+    if department is not None:
+        queryset = queryset.filter(department_name=department)
+
+    page, next_cursor = paginate(request, queryset)
+
+    now = timezone.now()
+    return JsonResponse({
+        'results': [{
+            'id': printer.pk,
+            'name': printer.printer_name,
+            'model': printer.printer_model_name,
+            'location': printer.printer_location,
+            'ip_address': printer.ip_address,
+            'department': printer.department_name,
+            'snmp_version': printer.snmp_version,
+            'breaker_state': breaker_state(printer, now),
+            'poll_interval': printer.poll_interval.total_seconds() if printer.poll_interval else None,
+        } for printer in page],
+        'next_cursor': next_cursor,
+    })
+
+@api_view
+def current_levels(request):
+    """
+    Return the current toner level of every printer module, ordered by id.
+
+    **Query parameters**
+        ``department``
+            Only return the levels of the printers of this department.
+
+        ``printer``
+            Only return the levels of the printer with this id.
+
+        ``cursor`` and ``limit``
+            See ``paginate``.
+
+    **Response**
+        {
+            'results': [
+                {'printer': 4, 'module': 'Black', 'level': '45', 'date_time': '2021-05-12T10:40:00Z'},
+                ...
+            ],
+            'next_cursor': 'NA' or None
+        }
+    """
+    queryset = CurrentTonerLevel.objects.all()
+    department = request.GET.get('department')
+    if department is not None:
+        queryset = queryset.filter(printer_name__department_name=department)
+    printer_id = request.GET.get('printer')
+    if printer_id is not None:
+        if not printer_id.isdigit():
+            raise ApiError('printer must be a printer id.')
+        queryset = queryset.filter(printer_name_id=printer_id)
+
+    page, next_cursor = paginate(request, queryset)
+
+    return JsonResponse({
+        'results': [{
+            'printer': toner_level.printer_name_id,
+            'module': toner_level.module_identifier,
+            'level': toner_level.level,
+            'date_time': toner_level.date_time,
+        } for toner_level in page],
+        'next_cursor': next_cursor,
+    })
+
+@api_view
+def forecasts(request):
+    """
+    Return the days until empty of every printer module, ordered by id (see forecasting.py).
+
+    The forecasts are updated after every poll, so this only reads the stored rows. ``rate`` is in percentage
+    points per day, and ``rate``, ``days_left``, and ``empty_date`` are ``null`` while a cartridge doesn't have
+    enough levels to be forecast.
+
+    **Query parameters**
+        ``department``
+            Only return the forecasts of the printers of this department.
+
+        ``printer``
+            Only return the forecasts of the printer with this id.
+
+        ``empty_before``
+            Only return the modules forecast to be empty before this ISO 8601 date and time.
+
+        ``cursor`` and ``limit``
+            See ``paginate``.
+
+    **Response**
+        {
+            'results': [
+                {
+                    'printer': 4, 'module': 'Black', 'level': 45, 'last_seen': '...', 'cartridge_start': '...',
+                    'rate': 1.52, 'days_left': 29.6, 'empty_date': '...'
+                },
+                ...
+            ],
+            'next_cursor': 'NA' or None
+        }
+    """
+    queryset = TonerForecast.objects.all()
+    department = request.GET.get('department')
+    if department is not None:
+        queryset = queryset.filter(printer_name__department_name=department)
+    printer_id = request.GET.get('printer')
+    if printer_id is not None:
+        if not printer_id.isdigit():
+            raise ApiError('printer must be a printer id.')
+        queryset = queryset.filter(printer_name_id=printer_id)
+    empty_before = request.GET.get('empty_before')
+    if empty_before is not None:
+        empty_before_date_time = _parse_datetime(empty_before)
+        if empty_before_date_time is None:
+            raise ApiError('empty_before must be an ISO 8601 date and time.')
+        queryset = queryset.filter(empty_date__lt=empty_before_date_time)
+
+    page, next_cursor = paginate(request, queryset)
+
+    return JsonResponse({
+        'results': [{
+            'printer': forecast.printer_name_id,
+            'module': forecast.module_identifier,
+            'level': forecast.last_level,
+            'last_seen': forecast.last_seen,
+            'cartridge_start': forecast.cartridge_start,
+            'rate': forecast.rate,
+            'days_left': forecast.days_left,
+            'empty_date': forecast.empty_date,
+        } for forecast in page],
+        'next_cursor': next_cursor,
+    })
+
+@api_view
+def printer_history(request, printer_id):
+    """
+    Return the toner level history of a printer, oldest first.
+
+    Every row is a level the module had from ``date_time`` until ``last_seen``
+    (see ``TONER_HISTORY_MODE`` in settings.py).
+
+    **Query parameters**
+        ``module``
+            Only return the history of this module (``Black``, ``Cyan``, ...).
+
+        ``since``
+            Only return the rows last seen at or after this ISO 8601 date and time.
+
+        ``cursor`` and ``limit``
+            See ``paginate``.
+
+    **Response**
+        {
+            'printer': 4,
+            'results': [
+                {'module': 'Black', 'level': '46', 'date_time': '...', 'last_seen': '...'},
+                ...
+            ],
+            'next_cursor': 'NA' or None
+        }
+    """
+    printer = get_object_or_404(Printer, pk=printer_id)
+    queryset = TonerLevel.objects.filter(printer_name=printer)
+
+    module = request.GET.get('module')
+    if module is not None:
+        queryset = queryset.filter(module_identifier=module)
+    since = request.GET.get('since')
+    if since is not None:
+        since_date_time = _parse_datetime(since)
+        if since_date_time is None:
+            raise ApiError('since must be an ISO 8601 date and time.')
+        queryset = queryset.filter(last_seen__gte=since_date_time)
+
+    page, next_cursor = paginate(request, queryset)
+
+    return JsonResponse({
+        'printer': printer.pk,
+        'results': [{
+            'module': toner_level.module_identifier,
+            'level': toner_level.level,
+            'date_time': toner_level.date_time,
+            'last_seen': toner_level.last_seen,
+        } for toner_level in page],
+        'next_cursor': next_cursor,
+    })
+
+@api_view
+def printer_history_chart(request, printer_id):
+    """
+    Return the toner level history of a printer downsampled for a chart (see ``downsample_history`` in history.py).
+
+    **Query parameters**
+        ``range``
+            One of ``HISTORY_RANGES`` (``1d``, ``7d``, ``30d``, ``90d``, ``1y``, ``3y``), ending now.
+            Defaults to ``DEFAULT_HISTORY_RANGE``.
+
+    **Response**
+        {
+            'printer': 4,
+            'range': '30d',
+            'start': '...',
+            'end': '...',
+            'bucket_seconds': 12960.0,
+            'modules': {
+                'Black': [{'start': '...', 'min': 41, 'max': 45}, ...],
+                ...
+            }
+        }
+    """
+    printer = get_object_or_404(Printer, pk=printer_id)
+
+    range_key = request.GET.get('range', DEFAULT_HISTORY_RANGE)
+    if range_key not in HISTORY_RANGES:
+        raise ApiError(f"range must be one of {', '.join(HISTORY_RANGES)}.")
+    start, end = history_range(range_key)
+
+    return JsonResponse({
+        'printer': printer.pk,
+        'range': range_key,
+        'start': start,
+        'end': end,
+        'bucket_seconds': (end - start).total_seconds() / HISTORY_CHART_BUCKETS,
+        'modules': downsample_history(printer.pk, start, end),
+    })
+
+def paginate(request, queryset):
+    """
+    Return a page of the QuerySet ordered by primary key, using the ``cursor`` and ``limit`` query parameters.
+
+    The cursor is the id of the last row of the previous page, so every page is read through the primary key
+    index no matter how far into the results it is (an offset would read and skip all the rows before it).
+    Rows added while paging show up on the later pages.
+
+    Returns:
+        page (list): The rows of the page.
+        next_cursor (str): The ``cursor`` of the next page, ``None`` on the last page.
+
+    Raises:
+        ApiError: The limit or the cursor is invalid.
+    """
+    try:
+        limit = int(request.GET.get('limit', API_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= API_MAX_PAGE_SIZE:
+        raise ApiError(f'limit must be a number from 1 to {API_MAX_PAGE_SIZE}.')
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        last_id = _decode_cursor(cursor)
+        if last_id is None:
+            raise ApiError('Invalid cursor.')
+        queryset = queryset.filter(pk__gt=last_id)
+
+    # One more row than the limit is read to know if there is a next page.
+    page = list(queryset.order_by('pk')[:limit + 1])
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, _encode_cursor(page[-1].pk)
+
+def _encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor):
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    return int(decoded) if decoded.isdigit() else None
+
+def _parse_datetime(value):
+    try:
+        date_time = parse_datetime(value)
+    except ValueError:
+        return None
+    if date_time is not None and timezone.is_naive(date_time):
+        date_time = timezone.make_aware(date_time)
+    return date_time
+
+class ApiError(Exception):
+    pass
@@ -0,0 +1,55 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import PollCycle
+
+# Cache key of the token of the printer changes made outside of a poll. Every cached dashboard is saved under a key
+#   with the dashboard version in it, so changing the token invalidates all of them at once.
+DASHBOARD_TOKEN_KEY = 'dashboard-token'
+
+def dashboard_version(last_poll_id=None):
+    """ Return the current version of the dashboard.
+
+    The version is the id of the latest :model:`app.PollCycle`, which is created in the same transaction as the
+      toner levels of every poll, and the token that ``bump_dashboard_version`` replaces when the printers change
+      outside of a poll. Neither is a counter, so concurrent polls and changes can't lose an update.
+
+    Args:
+        last_poll_id (int): Id of the latest :model:`app.PollCycle` if the caller already read it. If ``None``,
+            it is read from the database.
+    """
+    if last_poll_id is None:
+        last_poll_id = PollCycle.objects.order_by('-pk').values_list('pk', flat=True).first()
+
+    token = cache.get(DASHBOARD_TOKEN_KEY)
+    if token is None:
+        cache.add(DASHBOARD_TOKEN_KEY, uuid.uuid4().hex, timeout=None)
+        token = cache.get(DASHBOARD_TOKEN_KEY)
+    return f'{last_poll_id}-{token}'
+
+def bump_dashboard_version():
+    """ Invalidate the cached dashboards. Called every time the printers change outside of ``update_database``.
+
+    The token is replaced instead of incremented, because ``incr`` isn't atomic in the file based cache and two
+      bumps at the same time could leave the same version. The cache is shared by the web workers and the poller
+      (see ``CACHES`` in settings.py), so a change in the poller process invalidates the dashboards of every worker.
+    """
+    cache.set(DASHBOARD_TOKEN_KEY, uuid.uuid4().hex, timeout=None)
+
+def dashboard_cache_key(version):
+    """ Return the cache key of the dashboard rendered for the version. """
+    return f'dashboard-{version}'
+
+def dashboard_etag(version, *extra):
+    """ Return the ETag of a page showing the dashboard.
+
+    The dashboard shows relative times ("5 minutes old", "next check in 19 minutes"), so the ETag also changes
+      every ``DASHBOARD_CACHE_TIMEOUT`` seconds, the same as the cached dashboard, even if nothing was polled.
+    """
+    time_bucket = int(time.time() // settings.DASHBOARD_CACHE_TIMEOUT)
+    key = ':'.join(str(part) for part in (version, *extra, time_bucket))
+    return '"%s"' % hashlib.md5(key.encode()).hexdigest()
@@ -0,0 +1,224 @@
+import ipaddress
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.utils import timezone
+
+from .caching import bump_dashboard_version
+from .models import Printer, IN_QUERY_CHUNK_SIZE
+from .snmp import determine_snmp_version, determine_printer_model, describe_device, snmp_attempt_count
+
+# Fields of :model:`app.Printer` compared between the database and the discovered printers.
+COMPARED_FIELDS = ['printer_model_name', 'snmp_version', 'snmp_community']
+
+def scan_networks(networks, window=256, timeout=1, retries=0, communities=None, progress=None, deadline=None):
+    """ Probe every host address of the networks for printers, ``window`` addresses at a time.
+
+    Every address is probed with ``determine_snmp_version`` (all the versions and communities at the same time),
+      then the devices that answer are checked for the Printer-MIB with ``describe_device`` and their model is read
+      with ``determine_printer_model``. Addresses are only taken from the networks as the probes finish, so a
+      /16 doesn't queue 65,534 probes at once. An address without a printer costs a single timeout.
+
+    The version and community attempts of all the addresses run in one executor for the whole scan, sized for
+      ``window`` addresses. Attempts still waiting for a timeout after their address was decided keep their thread
+      until then, so the scan never has more than that many threads. At the deadline, the addresses that haven't
+      started are cancelled, the ones running stop before their next step, and the printers found so far are returned.
+
+    Args:
+        networks (list): ``ipaddress.IPv4Network`` instances to scan.
+        window (int): Number of addresses probed at the same time.
+        timeout (float): Seconds to wait for each SNMP response.
+        retries (int): Number of times a request is retried after a timeout.
+        communities (list): SNMP communities to try. If ``None``, then ``SNMP_COMMUNITIES`` from ``settings.py`` is used.
+        progress (callable): Optional function called with the number of addresses probed so far.
+        deadline (float): Seconds the whole scan can take. If ``None``, the scan takes as long as it needs.
+
+    Returns:
+        found_printers (list): Dictionaries with the data of every printer that answered, in address order.
+        LIST STRUCTURE:
+            [
+                {
+                    'ip_address': '10.20.3.4',
+                    'printer_model_name': 'HP LaserJet M402dn',
+                    'snmp_version': 2,
+                    'snmp_community': 'public',
+                    'name': 'NPI1A2B3C',
+                    'location': 'Building 8 Room 45'
+                },
+                ...
+            ]
+    """
+    if communities is None:
+        communities = settings.SNMP_COMMUNITIES
+
+    addresses = (str(address) for network in networks for address in network.hosts())
+    found_printers = list()
+    probed = 0
+    deadline_at = None if deadline is None else time.monotonic() + deadline
+
+    def remaining():
+        return None if deadline_at is None else max(deadline_at - time.monotonic(), 0)
+
+    executor = ThreadPoolExecutor(max_workers=window)
+    attempt_executor = ThreadPoolExecutor(max_workers=window * snmp_attempt_count(communities))
+    pending = set()
+    try:
+        def collect(done):
+            nonlocal probed
+            for future in done:
+                probed += 1
+                if future.result() is not None:
+                    found_printers.append(future.result())
+            if progress is not None:
+                progress(probed)
+
+        for address in addresses:
+            if len(pending) >= window:
+                done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+                collect(done)
+            if remaining() == 0:
+                break
+            pending.add(executor.submit(
+                probe_address, address, timeout, retries, communities, attempt_executor, deadline_at
+            ))
+
+        done, pending = wait(pending, timeout=remaining())
+        collect(done)
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+        attempt_executor.shutdown(wait=False)
+
+    return sorted(found_printers, key=lambda printer: ipaddress.ip_address(printer['ip_address']))
+
+def probe_address(ip_address, timeout, retries, communities, attempt_executor=None, deadline_at=None):
+    """ Return the data of the printer at the address (see ``scan_networks``), or ``None`` if there isn't one.
+
+    ``None`` is also returned when the ``time.monotonic()`` deadline of the scan passes between two steps.
+    """
+    def past_deadline():
+        return deadline_at is not None and time.monotonic() >= deadline_at
+
+    version, community = determine_snmp_version(
+        ip_address, communities, timeout=timeout, retries=retries, executor=attempt_executor
+    )
+    if version < 0 or past_deadline():
+        return None
+
+    device = describe_device(ip_address, version, community, timeout=timeout, retries=retries)
+    if device is None or not device['is_printer'] or past_deadline():
+        return None
+
+    try:
+        printer_model_name = determine_printer_model(ip_address, version, community, timeout=timeout, retries=retries)
+    except Exception:
+        printer_model_name = -2
+    if not isinstance(printer_model_name, str):
+        # Old printers without the model in the Host Resources MIB usually have it in the system description.
+        printer_model_name = device['description']
+
+    return {
+        'ip_address': ip_address,
+        'printer_model_name': printer_model_name[:75],
+        'snmp_version': version,
+        'snmp_community': community,
+        'name': device['name'],
+        'location': device['location'],
+    }
+
+def diff_printers(found_printers, networks):
+    """ Compare the discovered printers with the printers of the same networks in the database.
+
+    Args:
+        found_printers (list): Printers returned by ``scan_networks``.
+        networks (list): The networks that were scanned.
+
+    Returns:
+        diff (dict): Dictionary with the differences.
+        DICTIONARY STRUCTURE:
+            {
+                'new': [{discovered printer}, ...],
+                'changed': [(<Printer>, {'snmp_version': (1, 2), ...}), ...],
+                'missing': [<Printer>, ...],   (in the networks, but didn't answer)
+                'unchanged': [<Printer>, ...]
+            }
+    """
+    existing_printers = [
+        printer for printer in Printer.objects.order_by('ip_address')
+        if _in_networks(printer.ip_address, networks)
+    ]
+    existing_by_ip = {printer.ip_address: printer for printer in existing_printers}
+    found_ips = {found['ip_address'] for found in found_printers}
+
+    diff = {'new': [], 'changed': [], 'missing': [], 'unchanged': []}
+
+    for found in found_printers:
+        printer = existing_by_ip.get(found['ip_address'])
+        if printer is None:
+            diff['new'].append(found)
+            continue
+
+        changes = {
+            field: (getattr(printer, field), found[field])
+            for field in COMPARED_FIELDS if getattr(printer, field) != found[field]
+        }
+        if changes:
+            diff['changed'].append((printer, changes))
+        else:
+            diff['unchanged'].append(printer)
+
+    diff['missing'] = [printer for printer in existing_printers if printer.ip_address not in found_ips]
+    return diff
+
+def save_diff(diff, department_name):
+    """ Add the new printers and update the changed ones in bulk.
+
+    New printers are named after their sysName (or their IP address when it is empty or already used) and
+      are polled from the next poll on.
+
+    Returns:
+        created (int): Number of printers added.
+        updated (int): Number of printers updated.
+    """
+    now = timezone.now()
+    taken_names = set(Printer.objects.values_list('printer_name', flat=True))
+
+    new_printers = list()
+    for found in diff['new']:
+        printer_name = (found['name'] or found['ip_address'])[:75]
+        if printer_name in taken_names:
+            printer_name = found['ip_address']
+        taken_names.add(printer_name)
+
+        new_printers.append(Printer(
+            printer_name=printer_name,
+            printer_model_name=found['printer_model_name'],
+            printer_location=(found['location'] or 'Unknown')[:50],
+            ip_address=found['ip_address'],
+            department_name=department_name,
+            snmp_version=found['snmp_version'],
+            snmp_community=found['snmp_community'],
+            snmp_checked=now,
+        ))
+
+    changed_printers = list()
+    for printer, changes in diff['changed']:
+        for field, (_, new_value) in changes.items():
+            setattr(printer, field, new_value)
+        printer.snmp_checked = now
+        changed_printers.append(printer)
+
+    Printer.objects.bulk_create(new_printers, batch_size=IN_QUERY_CHUNK_SIZE)
+    Printer.objects.bulk_update(changed_printers, COMPARED_FIELDS + ['snmp_checked'], batch_size=IN_QUERY_CHUNK_SIZE)
+    bump_dashboard_version()
+
+    return len(new_printers), len(changed_printers)
+
+def _in_networks(ip_address, networks):
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
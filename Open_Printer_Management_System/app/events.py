@@ -0,0 +1,183 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.template.loader import render_to_string
+from django.utils import formats, timezone
+
+from .caching import dashboard_version
+from .views import dashboard_querysets, group_dashboard
+
+# Seconds between checks of the dashboard version. There is a single check per process, no matter how many
+#   dashboards are open, and it only reads the latest poll id and the cache. The dashboard is only queried when
+#   the version changes.
+EVENTS_CHECK_INTERVAL = 2
+
+# Seconds between comments sent to idle streams, so proxies (nginx closes them after 60 seconds) keep them open.
+EVENTS_KEEPALIVE_INTERVAL = 15
+
+# Events kept for a client that isn't reading them. A client that falls further behind is told to reload.
+EVENTS_QUEUE_SIZE = 20
+
+class DashboardBroadcaster:
+    """ Watch the dashboard version and send what changed to every open dashboard as Server-Sent Events.
+
+    Events:
+        ``levels``: The printers whose card changed (new toner levels, circuit breaker, probe state).
+            DATA STRUCTURE:
+                {
+                    'printers': {
+                        '4': {'levels': {'Black': '45', ...}, 'html': '<div class="col-md-4" ...>...</div>'},
+                        ...
+                    },
+                    'last_updated': 'May 12, 2021, 10:40 a.m.'
+                }
+        ``reload``: Printers were added, deleted, or moved to another department, so the page has to be reloaded.
+
+    The cards are rendered once per change in this process and the same data is sent to all the clients.
+    """
+    def __init__(self):
+        self.subscribers = set()
+        self.task = None
+        self.version = None
+        self.snapshot = None
+
+    def subscribe(self):
+        """ Return a queue that receives the events, starting the watcher if this is the first client. """
+        queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    async def run(self):
+        """ Check the dashboard version while there are clients and publish the changes. """
+        try:
+            while self.subscribers:
+                version = await sync_to_async(dashboard_version)()
+                if version != self.version:
+                    snapshot = await sync_to_async(dashboard_snapshot)()
+                    if self.snapshot is not None:
+                        self.publish_changes(self.snapshot, snapshot)
+                    self.version, self.snapshot = version, snapshot
+                await asyncio.sleep(EVENTS_CHECK_INTERVAL)
+        finally:
+            # The next client starts from a new snapshot, the old one may be out of date by then.
+            self.version = self.snapshot = None
+
+    def publish_changes(self, old, new):
+        if old['layout'] != new['layout']:
+            self.publish(format_event('reload', {}))
+            return
+
+        changed = {
+            str(printer_id): card for printer_id, card in new['printers'].items()
+            if old['printers'].get(printer_id) != card
+        }
+        if changed or old['last_updated'] != new['last_updated']:
+            self.publish(format_event('levels', {'printers': changed, 'last_updated': new['last_updated']}))
+
+    def publish(self, message):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # The client missed too much, it is quicker to load the page again than to catch up.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(format_event('reload', {}))
+
+BROADCASTER = DashboardBroadcaster()
+
+def dashboard_snapshot():
+    """ Return the printer cards of the dashboard, used by ``DashboardBroadcaster`` to find what changed.
+
+    Returns:
+        snapshot (dict): Dictionary with the dashboard data.
+        DICTIONARY STRUCTURE:
+            {
+                'layout': [('IT', 4), ('IT', 7), ...],   (department and id of every printer, in order)
+                'printers': {4: {'levels': {'Black': '45', ...}, 'html': '...'}, ...},
+                'last_updated': 'May 12, 2021, 10:40 a.m.' or ''
+            }
+    """
+    close_old_connections()
+    try:
+        querysets = dashboard_querysets()
+        time_threshold = timezone.now() - settings.TIMEDELTA
+        departments = group_dashboard(
+            querysets['printers'], querysets['toner_levels'], time_threshold, forecasts=querysets['forecasts']
+        )
+        last_poll = next(iter(querysets['last_poll']), None)
+    finally:
+        close_old_connections()
+
+    snapshot = {'layout': [], 'printers': dict(), 'last_updated': ''}
+    for department in departments:
+        for entry in department['printers']:
+            printer = entry['printer']
+            snapshot['layout'].append((department['department_name'], printer.pk))
+            snapshot['printers'][printer.pk] = {
+                'levels': {supply['module_identifier']: supply['level'] for supply in entry['supplies']},
+                'html': render_to_string('app/printer_card.html', {'entry': entry}),
+            }
+
+    if last_poll is not None:
+        snapshot['last_updated'] = formats.date_format(timezone.localtime(last_poll.date_time), 'DATETIME_FORMAT')
+    return snapshot
+
+def format_event(name, data):
+    """ Return a Server-Sent Event with the data as JSON. """
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+async def events_application(scope, receive, send):
+    """ ASGI application that streams the dashboard events (see ``DashboardBroadcaster``) to a browser.
+
+    It is called directly by the ASGI router in asgi.py instead of going through Django, so an open stream doesn't
+      hold a worker thread.
+    """
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # Stops nginx from buffering the events.
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    # How long the browser waits before connecting again when the stream is closed.
+    await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+
+    queue = BROADCASTER.subscribe()
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        while True:
+            next_event = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {next_event, disconnected}, timeout=EVENTS_KEEPALIVE_INTERVAL, return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected in done:
+                next_event.cancel()
+                break
+
+            if next_event in done:
+                message = next_event.result()
+            else:
+                next_event.cancel()
+                message = ': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+    finally:
+        BROADCASTER.unsubscribe(queue)
+        disconnected.cancel()
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
@@ -0,0 +1,275 @@
+import io
+import math
+from datetime import timedelta
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .caching import bump_dashboard_version
+from .models import Printer, TonerLevel, CurrentTonerLevel, PollCycle, IN_QUERY_CHUNK_SIZE, _chunks
+
+# Names of the generated printers start with this, so they can be told apart from the real ones and deleted.
+GENERATED_PREFIX = 'GEN_'
+
+# Models of the generated printers and their modules. Every module has how fast it is used compared to the black
+#   toner of the same printer, or None if the printer only reports OK for it.
+FLEET_MODELS = [
+    ('HP LaserJet m402dn', [('Black', 1.0)]),
+    ('HP Color LaserJet M553', [('Black', 1.0), ('Cyan', 0.6), ('Magenta', 0.6), ('Yellow', 0.6), ('Fuser Kit', 0.1)]),
+    ('Canon imageRUNNER ADVANCE C5535', [
+        ('Black', 1.0), ('Cyan', 0.5), ('Magenta', 0.5), ('Yellow', 0.5), ('Waste Toner Box', None)
+    ]),
+    ('Konica Minolta bizhub C458', [
+        ('Black', 1.0), ('Cyan', 0.7), ('Magenta', 0.7), ('Yellow', 0.7), ('Drum Unit', 0.15),
+        ('Transfer Belt', 0.05), ('Waste Toner Box', None)
+    ]),
+]
+
+# Percentage points of black toner an average printer uses per day. Every printer gets a random multiple of it,
+#   so a few of them are used a lot more than the rest.
+BLACK_POINTS_PER_DAY = 1.5
+
+SECONDS_PER_DAY = 86400
+
+def poll_times(days, interval, end=None):
+    """ Return the times the generated fleet was polled, every ``interval`` for ``days`` days up to ``end``. """
+    if end is None:
+        end = timezone.now()
+    end = end.replace(second=0, microsecond=0)
+    steps = max(int(timedelta(days=days) / interval), 1)
+    return [end - interval * (steps - 1 - step) for step in range(steps)]
+
+def usage_weights(times):
+    """ Return how much of the day's toner is used at each poll. Printers are mostly used on weekday office hours.
+
+    The weights have a mean of 1 so the rate of every module stays its points per day.
+    """
+    local_times = [timezone.localtime(observed_at) for observed_at in times]
+    weights = np.array([
+        1.0 if observed_at.weekday() < 5 and 8 <= observed_at.hour < 18 else 0.05 for observed_at in local_times
+    ])
+    return weights / weights.mean()
+
+def module_levels(generator, steps, points_per_step):
+    """ Simulate the percentage levels of a module, polled ``steps`` times.
+
+    The module starts at a random level and goes down by a random amount after every poll. When it reaches the
+      level the printer asks for a new cartridge at (0 to 3%), the cartridge is replaced and it starts again from 100.
+
+    Args:
+        generator (numpy.random.Generator): Random generator of the fleet.
+        steps (int): Number of polls.
+        points_per_step (numpy.ndarray): Average percentage points used between each poll and the one before it.
+
+    Returns:
+        levels (numpy.ndarray): The integer level at every poll.
+    """
+    empty_at = generator.integers(0, 4)
+    capacity = 100 - empty_at
+    used = np.cumsum(points_per_step * generator.gamma(2.0, 0.5, steps)) + generator.uniform(0, capacity)
+    return np.ceil(100 - used % capacity).astype(int).clip(0, 100)
+
+def history_rows(levels, only_changes):
+    """ Return the ``(first poll, last poll, level)`` of the :model:`app.TonerLevel` rows of a module.
+
+    With ``only_changes`` (``TONER_HISTORY_MODE = 'changes'``) there is one row for every run of polls with the same
+      level, otherwise one for every poll.
+    """
+    if not only_changes:
+        return [(step, step, level) for step, level in enumerate(levels.tolist())]
+
+    starts = np.flatnonzero(np.append(True, levels[1:] != levels[:-1]))
+    ends = np.append(starts[1:] - 1, len(levels) - 1)
+    return list(zip(starts.tolist(), ends.tolist(), levels[starts].tolist()))
+
+def create_fleet_printers(printer_count, department_count, generator):
+    """ Create the generated printers and return them with the model of each one (an item of ``FLEET_MODELS``). """
+    printers = list()
+    models = list()
+
+    for number in range(1, printer_count + 1):
+        model = FLEET_MODELS[generator.integers(len(FLEET_MODELS))]
+        models.append(model)
+        # 198.18.0.0/15 is reserved for benchmarks, so the addresses can't be the ones of real printers.
+        printers.append(Printer(
+            printer_name=f'{GENERATED_PREFIX}{number:05d}',
+            printer_model_name=model[0],
+            printer_location=f'Building {number % 40} Room {number % 300}',
+            ip_address=f'198.{18 + number // 65536}.{number // 256 % 256}.{number % 256}',
+            department_name=f'Department {number % department_count:03d}',
+            snmp_version=2,
+        ))
+
+    Printer.objects.bulk_create(printers, batch_size=IN_QUERY_CHUNK_SIZE)
+    printer_ids = dict(
+        Printer.objects.filter(printer_name__startswith=GENERATED_PREFIX).values_list('printer_name', 'id')
+    )
+    for printer in printers:
+        printer.pk = printer_ids[printer.printer_name]
+
+    return list(zip(printers, models))
+
+def generate_fleet(printer_count, days, interval, only_changes, department_count=20, seed=1, batch_size=100000,
+                   progress=None):
+    """ Bulk-load a fleet of generated printers with ``days`` of toner history, as if they had been polled every
+    ``interval``.
+
+    The levels go down at a random rate per printer, mostly in office hours, and cartridges are replaced when they
+      run out. The :model:`app.TonerLevel` rows are written with ``insert_toner_levels``, ``batch_size`` at a time,
+      and the :model:`app.CurrentTonerLevel` rows and a :model:`app.PollCycle` are created for the last poll, so the
+      dashboard looks the same as after a real poll.
+
+    Args:
+        printer_count (int): Number of printers.
+        days (float): Days of history.
+        interval (timedelta): Time between polls.
+        only_changes (bool): Write the history like ``TONER_HISTORY_MODE = 'changes'`` instead of ``'samples'``.
+        department_count (int): Number of departments the printers are split into.
+        seed (int): Seed of the random generator, the same seed generates the same fleet.
+        batch_size (int): Number of rows inserted per transaction.
+        progress (callable): Called with the number of printers done and the rows written after every batch.
+
+    Returns:
+        rows_written (int): Number of :model:`app.TonerLevel` rows written.
+    """
+    generator = np.random.default_rng(seed)
+    times = poll_times(days, interval)
+    interval_days = interval.total_seconds() / SECONDS_PER_DAY
+    weights = usage_weights(times)
+
+    fleet = create_fleet_printers(printer_count, department_count, generator)
+
+    rows = list()
+    rows_written = 0
+    last_poll_rows = 0
+    current_levels = dict()
+
+    for printers_done, (printer, (_, modules)) in enumerate(fleet, start=1):
+        black_points_per_day = BLACK_POINTS_PER_DAY * generator.lognormal(0, 0.6)
+
+        for module_identifier, relative_use in modules:
+            if relative_use is None:
+                module_rows = history_rows(np.zeros(len(times), dtype=int), only_changes)
+                module_rows = [(first_step, last_step, 'OK') for first_step, last_step, _ in module_rows]
+            else:
+                points_per_step = weights * black_points_per_day * relative_use * interval_days
+                module_rows = [
+                    (first_step, last_step, str(level))
+                    for first_step, last_step, level in history_rows(module_levels(generator, len(times), points_per_step), only_changes)
+                ]
+
+            rows.extend((printer.pk, module_identifier, first_step, last_step, level) for first_step, last_step, level in module_rows)
+            current_levels[(printer.pk, module_identifier)] = module_rows[-1][2]
+            if module_rows[-1][0] == len(times) - 1:
+                last_poll_rows += 1
+
+        if len(rows) >= batch_size or printers_done == len(fleet):
+            insert_toner_levels(rows, times)
+            rows_written += len(rows)
+            rows = list()
+            if progress is not None:
+                progress(printers_done, rows_written)
+
+    create_current_levels([printer.pk for printer, _ in fleet], current_levels, times[-1])
+    PollCycle.objects.create(date_time=times[-1], printer_count=len(fleet), rows_written=last_poll_rows)
+    bump_dashboard_version()
+
+    return rows_written
+
+def insert_toner_levels(rows, times):
+    """ Insert :model:`app.TonerLevel` rows in one transaction.
+
+    There can be tens of millions of rows, so they are written without creating model instances: PostgreSQL reads
+      them with ``COPY`` and the rest of the databases with ``executemany``, which SQLite runs as a single prepared
+      INSERT.
+
+    Args:
+        rows (list): ``(printer id, module identifier, first poll, last poll, level)`` tuples, where the polls are
+            indexes of ``times``.
+        times (list): Times of the polls.
+    """
+    table = connection.ops.quote_name(TonerLevel._meta.db_table)
+    columns = ', '.join(
+        connection.ops.quote_name(TonerLevel._meta.get_field(name).column)
+        for name in ('printer_name', 'module_identifier', 'date_time', 'last_seen', 'level')
+    )
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            values = [observed_at.isoformat() for observed_at in times]
+            data = io.StringIO(''.join(
+                f'{printer_id}\t{module_identifier}\t{values[first_step]}\t{values[last_step]}\t{level}\n'
+                for printer_id, module_identifier, first_step, last_step, level in rows
+            ))
+            cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN', data)
+        else:
+            values = [connection.ops.adapt_datetimefield_value(observed_at) for observed_at in times]
+            cursor.executemany(
+                f'INSERT INTO {table} ({columns}) VALUES (%s, %s, %s, %s, %s)',
+                [
+                    (printer_id, module_identifier, values[first_step], values[last_step], level)
+                    for printer_id, module_identifier, first_step, last_step, level in rows
+                ]
+            )
+
+def create_current_levels(printer_ids, current_levels, last_poll):
+    """ Create the :model:`app.CurrentTonerLevel` rows pointing to the latest history row of every module.
+
+    The rows of every module are inserted in time order, so the latest one has the highest id.
+    """
+    levels_to_create = list()
+
+    for printer_ids_chunk in _chunks(printer_ids, IN_QUERY_CHUNK_SIZE):
+        latest_rows = TonerLevel.objects.filter(printer_name_id__in=printer_ids_chunk).values(
+            'printer_name_id', 'module_identifier'
+        ).annotate(latest_id=Max('id')).order_by()
+
+        for row in latest_rows:
+            key = (row['printer_name_id'], row['module_identifier'])
+            levels_to_create.append(CurrentTonerLevel(
+                printer_name_id=key[0], module_identifier=key[1], level=current_levels[key], date_time=last_poll,
+                toner_level_id=row['latest_id']
+            ))
+
+    CurrentTonerLevel.objects.bulk_create(levels_to_create, batch_size=IN_QUERY_CHUNK_SIZE)
+
+def delete_generated_fleet():
+    """ Delete the generated printers and everything that belongs to them.
+
+    Deleting the printers would make Django load every :model:`app.TonerLevel` row to set the
+      :model:`app.CurrentTonerLevel` rows pointing to them to NULL, so the current levels are deleted first and the
+      history is deleted with plain DELETE statements.
+
+    Returns:
+        printers_deleted (int): Number of printers deleted.
+    """
+    printer_ids = list(Printer.objects.filter(printer_name__startswith=GENERATED_PREFIX).values_list('pk', flat=True))
+    table = connection.ops.quote_name(TonerLevel._meta.db_table)
+    column = connection.ops.quote_name(TonerLevel._meta.get_field('printer_name').column)
+
+    for printer_ids_chunk in _chunks(printer_ids, IN_QUERY_CHUNK_SIZE):
+        with transaction.atomic(), connection.cursor() as cursor:
+            CurrentTonerLevel.objects.filter(printer_name_id__in=printer_ids_chunk).delete()
+            placeholders = ', '.join(['%s'] * len(printer_ids_chunk))
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders})', printer_ids_chunk)
+            Printer.objects.filter(pk__in=printer_ids_chunk).delete()
+
+    if printer_ids:
+        bump_dashboard_version()
+    return len(printer_ids)
+
+def estimated_rows(printer_count, days, interval, only_changes):
+    """ Return about how many :model:`app.TonerLevel` rows ``generate_fleet`` writes. """
+    polls = max(int(timedelta(days=days) / interval), 1)
+    modules = sum(len(modules) for _, modules in FLEET_MODELS) / len(FLEET_MODELS)
+    if not only_changes:
+        return int(printer_count * modules * polls)
+
+    # A module with a percentage level gets about one row per point it goes down, the rest just one.
+    # exp(0.18) is the mean of the random multiple of BLACK_POINTS_PER_DAY of every printer.
+    points_per_day = sum(
+        BLACK_POINTS_PER_DAY * (relative_use or 0) for _, modules in FLEET_MODELS for _, relative_use in modules
+    ) / len(FLEET_MODELS)
+    return int(printer_count * (modules + points_per_day * days * math.exp(0.18)))
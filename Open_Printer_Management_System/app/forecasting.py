@@ -0,0 +1,282 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import TonerForecast, TonerLevel, Printer, IN_QUERY_CHUNK_SIZE, _chunks
+
+# Forecasts further away than this many days aren't shown, the module is barely being used.
+MAX_FORECAST_DAYS = 3650
+
+# Fields of :model:`app.TonerForecast` written by ``update_forecasts`` and ``refit_forecasts``.
+FORECAST_FIELDS = [
+    'cartridge_start', 'last_level', 'last_seen', 'run_start', 'observations', 'sum_t', 'sum_level', 'sum_tt',
+    'sum_t_level', 'rate', 'days_left', 'empty_date'
+]
+
+SECONDS_PER_DAY = 86400
+
+def update_forecasts(reported_levels, now):
+    """ Add the levels of a poll to the :model:`app.TonerForecast` rows of the modules and fit them again.
+
+    This is called by ``update_database`` in the same transaction as the new levels. Only the sums of each
+      module are updated, so the cost doesn't depend on how much history there is. Levels that aren't
+      percentages (OK, Unknown, "Not on", ...) are skipped.
+
+    Every run of polls with the same level counts as two observations, the first and the last time the level was
+      seen, the same as a :model:`app.TonerLevel` row in ``'changes'`` mode. A poll with the same level as the
+      last one moves the last observation of the run to this poll instead of adding one, so the fit doesn't depend
+      on how often the printer is polled and ``refit_forecasts`` gets the same result from the history.
+
+    Args:
+        reported_levels (list): ``(printer id, module identifier, level)`` tuples with the new levels.
+        now (datetime): Time of the poll.
+    """
+    percentages = dict()
+    for printer_id, module_identifier, level in reported_levels:
+        try:
+            percentages[(printer_id, module_identifier)] = int(level)
+        except ValueError:
+            continue
+
+    if not percentages:
+        return
+
+    forecasts = dict()
+    printer_ids = sorted({printer_id for printer_id, _ in percentages})
+    for printer_ids_chunk in _chunks(printer_ids, IN_QUERY_CHUNK_SIZE):
+        for forecast in TonerForecast.objects.filter(printer_name_id__in=printer_ids_chunk):
+            forecasts[(forecast.printer_name_id, forecast.module_identifier)] = forecast
+
+    forecasts_to_create = list()
+    forecasts_to_update = list()
+
+    for (printer_id, module_identifier), level in percentages.items():
+        forecast = forecasts.get((printer_id, module_identifier))
+        if forecast is None:
+            forecast = TonerForecast(printer_name_id=printer_id, module_identifier=module_identifier)
+            _start_cartridge(forecast, now)
+            forecasts_to_create.append(forecast)
+        else:
+            if level > forecast.last_level + settings.FORECAST_SWAP_JUMP:
+                _start_cartridge(forecast, now)
+            forecasts_to_update.append(forecast)
+
+        if forecast.observations and level == forecast.last_level:
+            # A run that already has its last observation: it moves to this poll.
+            if forecast.last_seen > (forecast.run_start or forecast.last_seen):
+                _add_observation(forecast, forecast.last_seen, level, -1)
+        else:
+            forecast.run_start = now
+        _add_observation(forecast, now, level)
+        forecast.last_level = level
+        forecast.last_seen = now
+
+    _apply_fits(forecasts_to_create + forecasts_to_update)
+
+    # ignore_conflicts in case another process created the forecast of the same module at the same time.
+    TonerForecast.objects.bulk_create(forecasts_to_create, batch_size=IN_QUERY_CHUNK_SIZE, ignore_conflicts=True)
+    TonerForecast.objects.bulk_update(forecasts_to_update, FORECAST_FIELDS, batch_size=IN_QUERY_CHUNK_SIZE)
+
+def refit_forecasts(printer_ids=None, chunk_size=50):
+    """ Calculate the forecasts of the printers again from their :model:`app.TonerLevel` history.
+
+    The forecasts are normally kept up to date by ``update_forecasts``. This is used to build them the first time,
+      after changing ``FORECAST_SWAP_JUMP``, or after editing the history. The history of ``chunk_size`` printers
+      is read with one query and the cartridge swaps and sums of all their modules are found with NumPy at once
+      (see ``history_sums``). Consecutive rows with the same level (``'samples'`` mode, or a printer that was off
+      in between) are one run, and only its first and last time are observations, like in ``update_forecasts``.
+
+    Args:
+        printer_ids (list): Ids of the printers to refit. If ``None``, all the printers are refit.
+        chunk_size (int): Number of printers read with each query.
+
+    Returns:
+        forecasts_written (int): Number of :model:`app.TonerForecast` rows written.
+    """
+    if printer_ids is None:
+        printer_ids = list(Printer.objects.order_by('pk').values_list('pk', flat=True))
+
+    forecasts_written = 0
+    for printer_ids_chunk in _chunks(list(printer_ids), chunk_size):
+        rows = TonerLevel.objects.filter(printer_name_id__in=printer_ids_chunk).order_by(
+            'printer_name_id', 'module_identifier', 'date_time'
+        ).values_list('printer_name_id', 'module_identifier', 'date_time', 'last_seen', 'level')
+
+        keys = list()
+        run_starts = list()
+        groups = list()
+        times = list()
+        levels = list()
+        # If the last observation is the end of a run (the run has two).
+        run_has_end = False
+
+        for printer_id, module_identifier, first_seen, last_seen, level in rows.iterator():
+            try:
+                percentage = int(level)
+            except ValueError:
+                continue
+
+            if not keys or keys[-1] != (printer_id, module_identifier):
+                keys.append((printer_id, module_identifier))
+                run_starts.append(None)
+            elif percentage == levels[-1]:
+                # The run of the previous row goes on until the last_seen of this one.
+                if run_has_end:
+                    times[-1] = last_seen.timestamp()
+                else:
+                    groups.append(len(keys) - 1)
+                    times.append(last_seen.timestamp())
+                    levels.append(percentage)
+                    run_has_end = True
+                continue
+
+            # In 'changes' mode a row is a level that was seen from date_time until last_seen.
+            run_starts[-1] = first_seen
+            run_has_end = last_seen != first_seen
+            for observed_at in ((first_seen, last_seen) if run_has_end else (first_seen,)):
+                groups.append(len(keys) - 1)
+                times.append(observed_at.timestamp())
+                levels.append(percentage)
+
+        forecasts = list()
+        if keys:
+            sums = history_sums(np.array(groups), np.array(times), np.array(levels, dtype=float))
+            for index, (printer_id, module_identifier) in enumerate(keys):
+                forecasts.append(TonerForecast(
+                    printer_name_id=printer_id,
+                    module_identifier=module_identifier,
+                    cartridge_start=_from_timestamp(sums['cartridge_start'][index]),
+                    last_level=int(sums['last_level'][index]),
+                    last_seen=_from_timestamp(sums['last_seen'][index]),
+                    run_start=run_starts[index],
+                    observations=int(sums['observations'][index]),
+                    sum_t=sums['sum_t'][index],
+                    sum_level=sums['sum_level'][index],
+                    sum_tt=sums['sum_tt'][index],
+                    sum_t_level=sums['sum_t_level'][index],
+                ))
+            _apply_fits(forecasts)
+
+        with transaction.atomic():
+            TonerForecast.objects.filter(printer_name_id__in=printer_ids_chunk).delete()
+            TonerForecast.objects.bulk_create(forecasts, batch_size=IN_QUERY_CHUNK_SIZE)
+        forecasts_written += len(forecasts)
+
+    return forecasts_written
+
+def history_sums(groups, times, levels):
+    """ Find the current cartridge of every module and the least squares sums of its levels.
+
+    Args:
+        groups (numpy.ndarray): Module of every observation (0, 1, ...). The observations of a module are together
+            and in time order.
+        times (numpy.ndarray): POSIX timestamp of every observation.
+        levels (numpy.ndarray): Percentage level of every observation.
+
+    Returns:
+        sums (dict): Arrays with a value for each module: ``cartridge_start`` and ``last_seen`` (timestamps),
+            ``last_level``, ``observations``, ``sum_t``, ``sum_level``, ``sum_tt``, and ``sum_t_level``
+            (see :model:`app.TonerForecast`).
+    """
+    module_count = groups.max() + 1
+
+    new_module = np.ones(len(groups), dtype=bool)
+    new_module[1:] = groups[1:] != groups[:-1]
+    # A level that jumps up is a new cartridge.
+    swap = np.zeros(len(groups), dtype=bool)
+    swap[1:] = levels[1:] > levels[:-1] + settings.FORECAST_SWAP_JUMP
+
+    # Every observation is numbered with the cartridge (segment) it belongs to.
+    segment_start = new_module | swap
+    segments = np.cumsum(segment_start) - 1
+    segment_first = np.flatnonzero(segment_start)
+
+    module_last = np.flatnonzero(np.append(new_module[1:], True))
+    current_segment = segments[module_last]
+
+    # Only the observations of the current cartridge of each module are added.
+    weights = (segments == current_segment[groups]).astype(float)
+    t = (times - times[segment_first][segments]) / SECONDS_PER_DAY
+
+    def total(values):
+        return np.bincount(groups, weights=values * weights, minlength=module_count)
+
+    return {
+        'cartridge_start': times[segment_first[current_segment]],
+        'last_seen': times[module_last],
+        'last_level': levels[module_last],
+        'observations': total(np.ones(len(groups))),
+        'sum_t': total(t),
+        'sum_level': total(levels),
+        'sum_tt': total(t * t),
+        'sum_t_level': total(t * levels),
+    }
+
+def fit_rates(observations, sum_t, sum_level, sum_tt, sum_t_level, span_days, last_level):
+    """ Fit the least squares line of many modules at once from their sums.
+
+    Returns:
+        rate (numpy.ndarray): Percentage points used per day, ``nan`` if there isn't enough data.
+        days_left (numpy.ndarray): Days until ``last_level`` reaches 0 at that rate, ``nan`` if the module doesn't
+            have enough data, isn't going down, or would take longer than ``MAX_FORECAST_DAYS``.
+    """
+    n = np.asarray(observations, dtype=float)
+    sum_t = np.asarray(sum_t, dtype=float)
+    sum_tt = np.asarray(sum_tt, dtype=float)
+
+    denominator = n * sum_tt - sum_t * sum_t
+    min_span_days = settings.FORECAST_MIN_SPAN.total_seconds() / SECONDS_PER_DAY
+    enough_data = (
+        (n >= settings.FORECAST_MIN_OBSERVATIONS) & (np.asarray(span_days) >= min_span_days)
+        & (denominator > 1e-9 * np.maximum(n * sum_tt, 1))
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * np.asarray(sum_t_level) - sum_t * np.asarray(sum_level)) / denominator
+        rate = np.where(enough_data, -slope, np.nan)
+        days_left = np.asarray(last_level, dtype=float) / rate
+
+    days_left = np.where((rate > 0) & (days_left <= MAX_FORECAST_DAYS), days_left, np.nan)
+    return rate, days_left
+
+def _apply_fits(forecasts):
+    """ Set the rate, days left, and empty date of the forecasts from their sums. """
+    if not forecasts:
+        return
+
+    rate, days_left = fit_rates(
+        [forecast.observations for forecast in forecasts],
+        [forecast.sum_t for forecast in forecasts],
+        [forecast.sum_level for forecast in forecasts],
+        [forecast.sum_tt for forecast in forecasts],
+        [forecast.sum_t_level for forecast in forecasts],
+        [(forecast.last_seen - forecast.cartridge_start).total_seconds() / SECONDS_PER_DAY for forecast in forecasts],
+        [forecast.last_level for forecast in forecasts],
+    )
+
+    for forecast, forecast_rate, forecast_days_left in zip(forecasts, rate.tolist(), days_left.tolist()):
+        forecast.rate = None if np.isnan(forecast_rate) else forecast_rate
+        if np.isnan(forecast_days_left):
+            forecast.days_left = forecast.empty_date = None
+        else:
+            forecast.days_left = forecast_days_left
+            forecast.empty_date = forecast.last_seen + timedelta(days=forecast_days_left)
+
+def _add_observation(forecast, observed_at, level, sign=1):
+    """ Add a level seen at ``observed_at`` to the sums of the forecast, or take it out of them with ``sign=-1``. """
+    t = (observed_at - forecast.cartridge_start).total_seconds() / SECONDS_PER_DAY
+    forecast.observations += sign
+    forecast.sum_t += sign * t
+    forecast.sum_level += sign * level
+    forecast.sum_tt += sign * t * t
+    forecast.sum_t_level += sign * t * level
+
+def _start_cartridge(forecast, now):
+    forecast.cartridge_start = now
+    forecast.observations = 0
+    forecast.sum_t = forecast.sum_level = forecast.sum_tt = forecast.sum_t_level = 0.0
+
+def _from_timestamp(timestamp):
+    return datetime.fromtimestamp(float(timestamp), tz=dt_timezone.utc)
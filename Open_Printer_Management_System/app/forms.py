@@ -16,12 +16,15 @@ class AddPrinterForm(forms.ModelForm):
         fields = ['printer_name', 'printer_location', 'ip_address', 'department_name']
 
 class SiteToggles(forms.Form):
+    """ Switches to show/hide data from the printer cards. They are handled in the browser (see toggles.js),
+    the initial values are the ones used until the user changes them.
+    """
     ip_address = forms.BooleanField(required=False, initial=True, label="Show IP Address",
         widget=forms.CheckboxInput(
             attrs={
                 'class': 'custom-control-input',
                 'id': 'ip_address',
-                'onChange': 'submit()'
+                'data-hides': 'printer-ip'
             }
         )
     )
@@ -31,7 +34,7 @@ class SiteToggles(forms.Form):
             attrs={
                 'class': 'custom-control-input',
                 'id': 'location',
-                'onChange': 'submit()'
+                'data-hides': 'printer-location'
             }
         )
     )
@@ -41,7 +44,7 @@ class SiteToggles(forms.Form):
             attrs={
                 'class': 'custom-control-input',
                 'id': 'printer_model',
-                'onChange': 'submit()'
+                'data-hides': 'printer-model'
             }
         )
     )
\ No newline at end of file
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import TonerLevel, TonerLevelRollup, RollupWatermark
+from .rollups import period_start
+
+# Ranges that can be charted, by the value of the ``range`` query parameter.
+HISTORY_RANGES = OrderedDict([
+    ('1d', timedelta(days=1)),
+    ('7d', timedelta(days=7)),
+    ('30d', timedelta(days=30)),
+    ('90d', timedelta(days=90)),
+    ('1y', timedelta(days=365)),
+    ('3y', timedelta(days=3 * 365)),
+])
+DEFAULT_HISTORY_RANGE = '30d'
+
+# Number of buckets the range is split into. Every bucket has the min and max level of each module in it,
+#   so a module never has more than twice this many points no matter how long the range is.
+HISTORY_CHART_BUCKETS = 200
+
+# Width of the chart in the SVG coordinates. The height is 100, one unit per percentage point.
+CHART_WIDTH = 600
+
+# Color of the line of each module in the chart, the rest of the modules use CHART_DEFAULT_COLOR.
+CHART_COLORS = {
+    'Black': '#343a40',
+    'Cyan': '#17a2b8',
+    'Magenta': '#e83e8c',
+    'Yellow': '#ffc107',
+}
+CHART_DEFAULT_COLOR = '#6c757d'
+
+def downsample_history(printer_id, start, end, buckets=HISTORY_CHART_BUCKETS):
+    """ Return the min and max level of every module of a printer in each of ``buckets`` parts of the range.
+
+    The rows are read from the smallest source that still has more detail than a bucket:
+        Buckets of a day or longer: the daily :model:`app.TonerLevelRollup` rows.
+        Buckets of an hour or longer: the hourly :model:`app.TonerLevelRollup` rows.
+        Shorter buckets: the :model:`app.TonerLevel` rows.
+    The rollups only go up to the last run of ``rolluptonerdata``, so the :model:`app.TonerLevel` rows are always
+      used after that. Only the columns needed are read (``values_list``) and every row is added to its bucket in
+      a single pass, so a 3 year range reads about a thousand rollups per module instead of the full history.
+    Levels that aren't percentages (OK, Unknown, ...) aren't charted.
+
+    Args:
+        printer_id (int): Id of the :model:`app.Printer`.
+        start (datetime): Start of the range.
+        end (datetime): End of the range.
+        buckets (int): Number of parts the range is split into.
+
+    Returns:
+        history (dict): Dictionary with the buckets that have levels of each module, oldest first.
+        DICTIONARY STRUCTURE:
+            {
+                'Black': [
+                    {'start': datetime, 'min': 41, 'max': 45},
+                    ...
+                ],
+                ...
+            }
+    """
+    bucket_width = (end - start) / buckets
+    levels = dict()
+
+    def add(module_identifier, observed_at, low, high):
+        index = min(max(int((observed_at - start) / bucket_width), 0), buckets - 1)
+        module_buckets = levels.setdefault(module_identifier, dict())
+        bucket = module_buckets.get(index)
+        if bucket is None:
+            module_buckets[index] = [low, high]
+        else:
+            bucket[0] = min(bucket[0], low)
+            bucket[1] = max(bucket[1], high)
+
+    if bucket_width >= timedelta(days=1):
+        period = TonerLevelRollup.DAY
+    elif bucket_width >= timedelta(hours=1):
+        period = TonerLevelRollup.HOUR
+    else:
+        period = None
+
+    watermark = RollupWatermark.objects.first()
+    raw_start = start
+
+    if period is not None and watermark is not None and watermark.processed_until > start:
+        rollups = TonerLevelRollup.objects.filter(
+            printer_name_id=printer_id, period=period, period_start__gte=period_start(start, period),
+            period_start__lt=min(end, watermark.processed_until), min_level__isnull=False
+        ).values_list('module_identifier', 'period_start', 'min_level', 'max_level')
+
+        for module_identifier, rollup_start, min_level, max_level in rollups.iterator():
+            add(module_identifier, rollup_start, min_level, max_level)
+        raw_start = watermark.processed_until
+
+    if raw_start < end:
+        rows = TonerLevel.objects.filter(
+            printer_name_id=printer_id, last_seen__gte=raw_start, date_time__lt=end
+        ).values_list('module_identifier', 'date_time', 'last_seen', 'level')
+
+        for module_identifier, first_seen, last_seen, level in rows.iterator():
+            try:
+                percentage = int(level)
+            except ValueError:
+                continue
+            # In 'changes' mode a row is a level that was seen from date_time until last_seen.
+            add(module_identifier, max(first_seen, raw_start), percentage, percentage)
+            add(module_identifier, min(last_seen, end), percentage, percentage)
+
+    return {
+        module_identifier: [
+            {'start': start + bucket_width * index, 'min': low, 'max': high}
+            for index, (low, high) in sorted(module_buckets.items())
+        ]
+        for module_identifier, module_buckets in sorted(levels.items())
+    }
+
+def history_range(range_key, now=None):
+    """ Return the start and end of one of the ``HISTORY_RANGES``, ending now. ``None`` if the key isn't valid. """
+    if range_key not in HISTORY_RANGES:
+        return None
+    if now is None:
+        now = timezone.now()
+    return now - HISTORY_RANGES[range_key], now
+
+def chart_series(history, start, end):
+    """ Turn the buckets returned by ``downsample_history`` into SVG coordinates for the history chart.
+
+    Every module is drawn as a band from its min to its max level: the max levels left to right and then the min
+    levels right to left make the outline of a single polygon. A bucket where the level didn't change is a line.
+
+    Returns:
+        series (list): The modules to draw.
+        LIST STRUCTURE:
+            [
+                {'module_identifier': 'Black', 'color': '#343a40', 'points': '0.0,55 3.0,55 ... 3.0,59 0.0,59'},
+                ...
+            ]
+    """
+    seconds = (end - start).total_seconds()
+    series = list()
+
+    for module_identifier, buckets in history.items():
+        top = list()
+        bottom = list()
+        for bucket in buckets:
+            x = round((bucket['start'] - start).total_seconds() / seconds * CHART_WIDTH, 1)
+            top.append(f"{x},{100 - _clamp(bucket['max'])}")
+            bottom.append(f"{x},{100 - _clamp(bucket['min'])}")
+
+        series.append({
+            'module_identifier': module_identifier,
+            'color': CHART_COLORS.get(module_identifier, CHART_DEFAULT_COLOR),
+            'points': ' '.join(top + bottom[::-1]),
+        })
+
+    return series
+
+def _clamp(level):
+    return min(max(level, 0), 100)
@@ -0,0 +1,285 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .caching import bump_dashboard_version
+from .metrics import METRICS
+from .models import Printer, PollJob, update_database
+from .poller import poll_printer, poll_printers
+from .snmp import determine_snmp_version, determine_printer_model
+
+logger = logging.getLogger(__name__)
+
+# Value of ``PollJob.active_key`` while a refresh of all the printers is queued or running.
+REFRESH_JOB_KEY = 'refresh'
+
+# Times a refresh is started again when the active job of another request ended while it was being read.
+START_JOB_ATTEMPTS = 3
+
+# Seconds between saves of the progress of a running job.
+PROGRESS_SAVE_INTERVAL = 1
+
+# A job that hasn't been updated for longer than the poll deadline plus this is considered abandoned
+#   (the web worker running it was restarted), so it doesn't block new refreshes forever.
+ABANDONED_JOB_MARGIN = timedelta(minutes=1)
+
+# A printer still being probed after this long is considered abandoned (the web worker running the probe was
+#   restarted) and fails, so it doesn't stay half added forever.
+ABANDONED_PROBE_TIMEOUT = timedelta(minutes=15)
+
+# Printers that couldn't be added are shown on the homepage with the reason for this long, then deleted. The
+#   session that added them is told and deletes them earlier, this is for the ones added by a closed tab.
+FAILED_PROBE_RETENTION = timedelta(days=1)
+
+def start_refresh_job():
+    """ Start updating the toner levels of all the printers in a background thread.
+
+    Only one refresh can be active at a time. If there is already one queued or running, that one is returned
+      instead of starting another, so clicking refresh twice doesn't poll the printers twice at the same time.
+
+    Returns:
+        job (PollJob): Instance of :model:`app.PollJob` that is refreshing the toner levels.
+    """
+    fail_abandoned_jobs()
+
+    # The unique active_key makes the insert of a second request starting a refresh at the same time fail, and
+    #   get_or_create reads the job of the request that won instead. If that job ended before it was read, there is
+    #   no active job anymore and it tries again.
+    for attempt in range(START_JOB_ATTEMPTS):
+        try:
+            job, created = PollJob.objects.get_or_create(active_key=REFRESH_JOB_KEY)
+            break
+        except IntegrityError:
+            if attempt == START_JOB_ATTEMPTS - 1:
+                raise
+    if not created:
+        return job
+
+    thread = threading.Thread(target=run_refresh_job, args=(job.pk,), name=f'refresh-job-{job.pk}', daemon=True)
+    transaction.on_commit(thread.start)
+    return job
+
+def run_refresh_job(job_id):
+    """ Poll all the printers and save their toner levels, keeping the progress of the job up to date.
+
+    This runs in the background thread started by ``start_refresh_job``.
+    """
+    job = PollJob.objects.get(pk=job_id)
+
+    try:
+        printers = list(Printer.objects.filter(probe_state=Printer.READY))
+
+        job.status = PollJob.RUNNING
+        job.printers_total = len(printers)
+        _save_progress(job)
+
+        last_save = time.monotonic()
+
+        def progress(printer, levels_dict):
+            nonlocal last_save
+            job.printers_done += 1
+            if printer.consecutive_failures:
+                job.printers_failed += 1
+
+            if time.monotonic() - last_save >= PROGRESS_SAVE_INTERVAL:
+                _save_progress(job)
+                last_save = time.monotonic()
+
+        printer_levels_dict, unfinished_printers = poll_printers(printers, progress=progress)
+
+        job.printers_failed += len(unfinished_printers)
+        job.rows_written = update_database(printer_levels_dict)
+        job.status = PollJob.FINISHED
+    except Exception as error:
+        job.status = PollJob.FAILED
+        job.error = repr(error)
+    finally:
+        job.active_key = None
+        job.finished = timezone.now()
+        _save_progress(job)
+        # The thread has its own database connection that would otherwise stay open.
+        connection.close()
+        METRICS.flush()
+
+def fail_abandoned_jobs():
+    """ Mark the active jobs that stopped being updated as failed so a new refresh can start. """
+    cutoff = timezone.now() - settings.POLLER_CYCLE_DEADLINE - ABANDONED_JOB_MARGIN
+    PollJob.objects.filter(active_key__isnull=False, updated__lt=cutoff).update(
+        status=PollJob.FAILED, active_key=None, finished=timezone.now(), error='The job stopped without finishing.'
+    )
+
+def start_printer_probe(printer):
+    """ Determine the SNMP settings and model of a printer added from the web interface in a background thread.
+
+    The printer has to be saved with ``probe_state`` set to ``'probing'``, see ``run_printer_probe``.
+    """
+    thread = threading.Thread(
+        target=run_printer_probe, args=(printer.pk,), name=f'printer-probe-{printer.pk}', daemon=True
+    )
+    transaction.on_commit(thread.start)
+
+def run_printer_probe(printer_id):
+    """ Finish adding a printer: get its SNMP version, community, and model, then poll it for the first time.
+
+    This runs in the background thread started by ``start_printer_probe``. When it works, the printer becomes
+      ``'ready'`` and is polled from then on, even if its first poll fails (that is only logged). Otherwise it becomes ``'failed'`` and the reason is saved in
+      ``probe_error``, which is shown to the user on the next page load (see :view:`app.homepage`) and on the
+      printer card until ``clean_up_printer_probes`` deletes it.
+    """
+    try:
+        printer = Printer.objects.get(pk=printer_id)
+    except Printer.DoesNotExist:
+        # Deleted before the probe started.
+        connection.close()
+        return
+
+    try:
+        discover_printer(printer)
+    except PrinterOffException:
+        _fail_probe(printer, (
+            'Printer not added. Make sure you have the correct IP address for the printer and the printer is on.'
+        ))
+    except NoSNMPDataException:
+        _fail_probe(printer, (
+            "ERROR: Could not add printer. The printer doesn't have usable SNMP data. "
+            "Printer may be too old or firmware may need to be updated."
+        ))
+    except Exception:
+        logger.exception('Adding %s (%s) failed.', printer.printer_name, printer.ip_address)
+        _fail_probe(printer, 'UNEXPECTED ERROR: Could not add printer.')
+    else:
+        # Poll the printer that was just added to have toner data saved on the database.
+        # The printer was added even if this fails, the pollers get its levels later.
+        try:
+            levels_dict = poll_printer(printer)
+            if levels_dict is not None:
+                update_database({printer.printer_name: levels_dict})
+        except Exception:
+            logger.exception('The first poll of %s (%s) failed.', printer.printer_name, printer.ip_address)
+
+        printer.probe_state = Printer.READY
+        printer.save(update_fields=['probe_state'])
+    finally:
+        bump_dashboard_version()
+        connection.close()
+
+def clean_up_printer_probes(now=None):
+    """ Fail the probes that were abandoned and delete the printers that failed more than ``FAILED_PROBE_RETENTION`` ago.
+
+    The failed printers are normally deleted by ``report_printer_probes`` in views.py when the session that added them
+      loads a page, this deletes the ones nobody came back for. It only reads the database when there is nothing to
+      clean up, so it can run on every page load.
+
+    Returns:
+        printers_deleted (int): Number of :model:`app.Printer` instances deleted.
+    """
+    if now is None:
+        now = timezone.now()
+
+    abandoned_ids = list(Printer.objects.filter(
+        probe_state=Printer.PROBING, probe_updated__lt=now - ABANDONED_PROBE_TIMEOUT
+    ).values_list('pk', flat=True))
+    if abandoned_ids:
+        Printer.objects.filter(pk__in=abandoned_ids, probe_state=Printer.PROBING).update(
+            probe_state=Printer.FAILED, probe_updated=now,
+            probe_error='ERROR: Could not add printer. Checking its SNMP settings stopped without finishing.'
+        )
+
+    # Printer.delete() collects the related rows first, so nothing is written when there is nothing to delete.
+    printers_deleted = Printer.objects.filter(
+        probe_state=Printer.FAILED, probe_updated__lt=now - FAILED_PROBE_RETENTION
+    ).delete()[1].get(Printer._meta.label, 0)
+
+    if abandoned_ids or printers_deleted:
+        bump_dashboard_version()
+    return printers_deleted
+
+def discover_printer(printer):
+    """ Set the SNMP version, community, and model of the printer from its SNMP data and save them.
+
+    Raises:
+        PrinterOffException: The printer didn't answer any SNMP version (wrong IP address or the printer is off).
+        PrinterNotAddedException: Unexpected error.
+        NoSNMPDataException: The printer doesn't have usable SNMP data (printer too old or firmware needs updating).
+    """
+    # Get the SNMP version and community through brute-force
+    # If the function returns -1 that means that either the IP address is wrong or
+    #   the printer is off and the exception is raised.
+    # If the function returns -2 the some unexpected error occurred and the exception is raised.
+    # SNMP versions are either 1, 2, or 3.
+    version, community = determine_snmp_version(printer.ip_address)
+    if version == -1:
+        raise PrinterOffException
+    elif version == -2:
+        raise PrinterNotAddedException
+
+    # Get the printer models through the SNMP data
+    # If the function return is -2 then some unexpected error occurred and the exception is raised.
+    # If the function return is -3 then that means that the printer doesn't have usable SNMP data
+    #   so either the printer is too old or the firmware needs to be updated.
+    printer_model_name = determine_printer_model(printer.ip_address, version, community)
+    if printer_model_name == -2:
+        raise PrinterNotAddedException
+    elif printer_model_name == -3:
+        raise NoSNMPDataException
+
+    printer.printer_model_name = printer_model_name
+    printer.snmp_version = version
+    printer.snmp_community = community
+    printer.snmp_checked = timezone.now()
+    printer.save(update_fields=['printer_model_name', 'snmp_version', 'snmp_community', 'snmp_checked'])
+
+def job_progress(job):
+    """ Return the progress of a job as a dictionary that can be sent as JSON.
+
+    Returns:
+        progress (dict): Dictionary with the status and counts of the job.
+        DICTIONARY STRUCTURE:
+            {
+                'id': 12,
+                'status': 'running',
+                'active': True,
+                'printers_total': 40,
+                'printers_done': 25,
+                'printers_failed': 2,
+                'rows_written': 0,
+                'error': ''
+            }
+    """
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'active': job.active_key is not None,
+        'printers_total': job.printers_total,
+        'printers_done': job.printers_done,
+        'printers_failed': job.printers_failed,
+        'rows_written': job.rows_written,
+        'error': job.error,
+    }
+
+def _fail_probe(printer, error):
+    printer.probe_state = Printer.FAILED
+    printer.probe_error = error
+    printer.probe_updated = timezone.now()
+    printer.save(update_fields=['probe_state', 'probe_error', 'probe_updated'])
+
+def _save_progress(job):
+    job.updated = timezone.now()
+    job.save(update_fields=[
+        'status', 'active_key', 'updated', 'finished', 'printers_total', 'printers_done', 'printers_failed',
+        'rows_written', 'error'
+    ])
+
+class PrinterOffException(Exception):
+    pass
+
+class PrinterNotAddedException(Exception):
+    pass
+
+class NoSNMPDataException(Exception):
+    pass
@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Printer, PrinterLease, IN_QUERY_CHUNK_SIZE, _chunks
+
+def ensure_leases():
+    """ Create the :model:`app.PrinterLease` rows of the printers that don't have one yet, like new printers.
+
+    ``ignore_conflicts`` in case another worker creates the same rows at the same time.
+    """
+    printer_ids = list(Printer.objects.filter(lease__isnull=True).values_list('pk', flat=True))
+    PrinterLease.objects.bulk_create(
+        [PrinterLease(printer_name_id=printer_id) for printer_id in printer_ids],
+        batch_size=IN_QUERY_CHUNK_SIZE, ignore_conflicts=True
+    )
+
+def lease_printers(worker_id, batch_size, polled_before, sites=None, departments=None, now=None):
+    """ Lease up to ``batch_size`` printers that are due to be polled, least recently polled first.
+
+    A printer can be leased if nobody holds its lease (or the lease expired) and it wasn't polled since
+      ``polled_before``. The lease lasts ``POLLER_LEASE_DURATION`` from ``settings.py``.
+
+    Databases with ``SELECT ... FOR UPDATE SKIP LOCKED`` (PostgreSQL) lock the lease rows while they are being
+      taken, and skip the ones other workers are taking at the same time. SQLite doesn't have row locks, but it
+      only runs one write at a time: the candidates are read first and the UPDATE only takes the ones that are still
+      free (compare and swap). The rows this worker got are the ones with its ``worker_id`` and lease expiry.
+
+    Args:
+        worker_id (str): Id of the worker, unique among the running workers.
+        batch_size (int): Most printers leased.
+        polled_before (datetime): Printers polled after this are left for the next cycle.
+        sites (list): Only lease the printers with one of these ``poller_site``. An empty site is the printers that
+            aren't tied to a site. If ``None``, any printer is leased.
+        departments (list): Only lease the printers of these departments. If empty or ``None``, any department.
+        now (datetime): Current time, ``timezone.now()`` if ``None``.
+
+    Returns:
+        printers (list): The :model:`app.Printer` instances leased, possibly none.
+    """
+    if now is None:
+        now = timezone.now()
+    expires = now + settings.POLLER_LEASE_DURATION
+
+    candidates = PrinterLease.objects.filter(
+        Q(expires__isnull=True) | Q(expires__lt=now),
+        Q(polled_at__isnull=True) | Q(polled_at__lt=polled_before),
+        printer_name__probe_state=Printer.READY,
+    )
+    if sites is not None:
+        candidates = candidates.filter(printer_name__poller_site__in=sites)
+    if departments:
+        candidates = candidates.filter(printer_name__department_name__in=departments)
+
+    next_printer_ids = candidates.order_by(F('polled_at').asc(nulls_first=True), 'pk').values_list('pk', flat=True)
+
+    if connection.features.has_select_for_update_skip_locked and connection.features.has_select_for_update_of:
+        with transaction.atomic():
+            # Only the lease rows are locked, not the printers they are joined with.
+            printer_ids = list(next_printer_ids.select_for_update(skip_locked=True, of=('self',))[:batch_size])
+            PrinterLease.objects.filter(pk__in=printer_ids).update(worker_id=worker_id, expires=expires)
+    else:
+        candidate_ids = list(next_printer_ids[:batch_size])
+        candidates.filter(pk__in=candidate_ids).order_by().update(worker_id=worker_id, expires=expires)
+        printer_ids = list(PrinterLease.objects.filter(
+            pk__in=candidate_ids, worker_id=worker_id, expires=expires
+        ).values_list('pk', flat=True))
+
+    return list(Printer.objects.filter(pk__in=printer_ids).order_by('pk'))
+
+def held_printer_ids(worker_id, printer_ids, now=None):
+    """ Renew the leases this worker still holds on the printers and return the ids of those printers.
+
+    The levels of a printer are only written if the lease didn't expire and go to another worker in the meantime.
+      Call it first in the transaction that writes them: the UPDATE locks the lease rows until the transaction ends
+      on PostgreSQL, and on SQLite it takes the write lock before anything is read. A transaction that starts with
+      a read fails with "database is locked" instead of waiting when another worker is writing.
+    """
+    if now is None:
+        now = timezone.now()
+
+    held_ids = set()
+    for printer_ids_chunk in _chunks(list(printer_ids), IN_QUERY_CHUNK_SIZE):
+        held_leases = PrinterLease.objects.filter(pk__in=printer_ids_chunk, worker_id=worker_id, expires__gt=now)
+        if held_leases.update(expires=now + settings.POLLER_LEASE_DURATION):
+            held_ids.update(held_leases.values_list('pk', flat=True))
+    return held_ids
+
+def release_printers(worker_id, printer_ids, polled_at=None):
+    """ Give back the leases this worker holds on the printers.
+
+    Args:
+        worker_id (str): Id of the worker.
+        printer_ids (iterable): Ids of the printers. The leases that went to another worker aren't changed.
+        polled_at (datetime): Time the printers were polled. If ``None``, they weren't (the poll didn't finish),
+            so another worker can lease them again in the same cycle.
+
+    Returns:
+        released (int): Number of leases given back.
+    """
+    values = {'worker_id': '', 'expires': None}
+    if polled_at is not None:
+        values['polled_at'] = polled_at
+
+    released = 0
+    for printer_ids_chunk in _chunks(list(printer_ids), IN_QUERY_CHUNK_SIZE):
+        released += PrinterLease.objects.filter(pk__in=printer_ids_chunk, worker_id=worker_id).update(**values)
+    return released
@@ -0,0 +1,136 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.template.loader import get_template
+from django.utils import timezone
+
+from app.models import Printer, CurrentTonerLevel
+from app.views import group_dashboard
+
+MODULE_NAMES = ['Black', 'Cyan', 'Magenta', 'Yellow', 'Drum Unit', 'Waste Toner Box', 'Fuser Kit', 'Transfer Belt']
+
+# The printer cards loop used before the context was grouped in views.py, kept here to compare the render times.
+# Every department loops over every printer, and every printer loops over every toner level.
+LEGACY_PRINTER_CARDS_TEMPLATE = """
+{% for department in all_departments %}
+  <div class="row"><h2>{{ department.department_name }}</h2></div>
+  <div class="row">
+    {% for printer in all_printers %}
+      {% if printer.department_name == department.department_name %}
+        <div class="col-md-4"><div class="card mb-4 box-shadow"><div class="card-body">
+          <h3 class="card-title">{{ printer.printer_name }}</h3>
+          {% for printer_levels in all_toner_levels %}
+            {% if printer.printer_name == printer_levels.printer_name|stringformat:"s" %}
+              <p class="card-text"><strong>{{ printer_levels.module_identifier }}</strong><br>
+                {% if printer_levels.level == "OK" %}
+                  {{ printer_levels.level }}
+                {% elif printer_levels.level == "Unknown" %}
+                  {{ printer_levels.level }}
+                {% elif printer_levels.level == "Not on" %}
+                {% else %}
+                  <div class="progress position-relative" style="height: 18px;">
+                    {% if printer_levels.level|add:"0" >= 50 %}
+                      <div class="progress-bar bg-success" style="width: {{ printer_levels.level }}%;">{{ printer_levels.level }}%</div>
+                    {% elif printer_levels.level|add:"0" < 50 and printer_levels.level|add:"0" > 10 %}
+                      <div class="progress-bar bg-warning" style="width: {{ printer_levels.level }}%;">{{ printer_levels.level }}%</div>
+                    {% else %}
+                      <div class="progress-bar bg-danger" style="width: {{ printer_levels.level }}%;">{{ printer_levels.level }}%</div>
+                    {% endif %}
+                  </div>
+                {% endif %}
+              </p>
+            {% endif %}
+          {% endfor %}
+        </div></div></div>
+      {% endif %}
+    {% endfor %}
+  </div>
+{% endfor %}
+"""
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks rendering the homepage printer cards for a synthetic fleet, comparing the pre-grouped '
+        'context with the old nested template loops. The fleet is built in memory, the database is not used.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--printers', dest='printers', type=int, default=1000, help='Number of printers in the fleet.')
+        parser.add_argument('-s', '--supplies', dest='supplies', type=int, default=5, help='Toner levels per printer.')
+        parser.add_argument('--departments', dest='departments', type=int, default=20, help='Number of departments.')
+        parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3, help='Renders per variant, the best time is shown.')
+        parser.add_argument('--skip-legacy', dest='skip_legacy', action='store_true', help="Don't render the old nested loops (slow for big fleets).")
+
+    def handle(self, *args, **options):
+        if options['printers'] < 1 or options['departments'] < 1 or options['repeat'] < 1:
+            raise CommandError('The number of printers, departments and repeats must be at least 1.')
+        if not 1 <= options['supplies'] <= len(MODULE_NAMES):
+            raise CommandError(f'The number of supplies must be between 1 and {len(MODULE_NAMES)}.')
+
+        printers, toner_levels = synthetic_fleet(options['printers'], options['supplies'], options['departments'])
+        self.stdout.write(f"Fleet: {len(printers)} printers, {len(toner_levels)} toner levels, {options['departments']} departments.")
+
+        display_context = {'show_location': True, 'show_ip': True, 'show_printer_model': False}
+        time_threshold = timezone.now()
+
+        def render_grouped():
+            departments = group_dashboard(printers, toner_levels, time_threshold)
+            return get_template('app/printer_cards.html').render({'departments': departments, **display_context})
+
+        grouped_seconds = best_time(render_grouped, options['repeat'])
+        self.stdout.write(f"Grouped context: {grouped_seconds * 1000:.1f} ms")
+
+        if options['skip_legacy']:
+            return
+
+        legacy_template = engines['django'].from_string(LEGACY_PRINTER_CARDS_TEMPLATE)
+        all_departments = [{'department_name': name} for name in sorted({printer.department_name for printer in printers})]
+
+        def render_legacy():
+            return legacy_template.render({
+                'all_departments': all_departments, 'all_printers': printers, 'all_toner_levels': toner_levels,
+                **display_context
+            })
+
+        legacy_seconds = best_time(render_legacy, options['repeat'])
+        self.stdout.write(f"Nested loops:    {legacy_seconds * 1000:.1f} ms")
+        self.stdout.write(f"Speedup:         {legacy_seconds / grouped_seconds:.1f}x")
+
+def synthetic_fleet(printer_count, supplies_per_printer, department_count):
+    """ Create unsaved printers and current toner levels, ordered the same way as the homepage queries. """
+    generator = random.Random(printer_count)
+    now = timezone.now()
+
+    printers = sorted(
+        (
+            Printer(
+                pk=number,
+                printer_name=f'PRN_{number:05d}',
+                printer_model_name='HP LaserJet m402dn',
+                printer_location=f'Building {number % 40} Room {number % 300}',
+                ip_address=f'10.{number // 65536}.{number // 256 % 256}.{number % 256}',
+                department_name=f'Department {number % department_count:03d}',
+            )
+            for number in range(1, printer_count + 1)
+        ),
+        key=lambda printer: (printer.department_name, printer.printer_name)
+    )
+
+    toner_levels = list()
+    for printer in sorted(printers, key=lambda printer: printer.pk):
+        for module_name in sorted(MODULE_NAMES[:supplies_per_printer]):
+            level = generator.choice(['OK', 'Unknown', str(generator.randint(0, 100)), str(generator.randint(0, 100))])
+            toner_levels.append(CurrentTonerLevel(printer_name=printer, module_identifier=module_name, level=level, date_time=now))
+
+    return printers, toner_levels
+
+def best_time(function, repeat):
+    """ Run the function ``repeat`` times and return the fastest time in seconds. """
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
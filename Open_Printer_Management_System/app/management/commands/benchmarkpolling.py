@@ -0,0 +1,169 @@
+import io
+import multiprocessing
+import os
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from app.agentfarm import run_farm, walk_paths
+from app.models import Printer
+from app.snmp import SESSION_POOL
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the updatetonerdata command against a farm of simulated printers on loopback UDP ports, '
+        'answering from the recorded walks in app/snmpwalks with the given latency and packet loss. Shows the '
+        'time of every cycle, the SNMP requests per printer, and the peak memory. A temporary test database is '
+        'used, so the real printers and their history are not touched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--printers', dest='printers', type=int, default=100, help='Number of simulated printers.')
+        parser.add_argument(
+            '--models', dest='models', default='',
+            help='Comma separated walks to use (hp, canon, konica, ...). Defaults to all the walks, one after another.'
+        )
+        parser.add_argument('--snmp-version', dest='snmp_version', type=int, choices=(1, 2), default=2, help='SNMP version of the printers.')
+        parser.add_argument('--latency', dest='latency', type=float, default=5, help='Milliseconds before each response.')
+        parser.add_argument('--jitter', dest='jitter', type=float, default=0, help='Up to this many milliseconds are added to each response.')
+        parser.add_argument('--loss', dest='loss', type=float, default=0, help='Fraction of requests dropped (0 to 1).')
+        parser.add_argument('-c', '--cycles', dest='cycles', type=int, default=3, help='Number of timed poll cycles.')
+        parser.add_argument(
+            '-w', '--workers', dest='workers', type=int, default=settings.POLLER_WORKERS,
+            help='Number of printers polled at the same time.'
+        )
+        parser.add_argument(
+            '-t', '--timeout', dest='timeout', type=float, default=settings.POLLER_PRINTER_TIMEOUT,
+            help='Seconds to wait for each SNMP response.'
+        )
+        parser.add_argument('--host', dest='host', default='127.0.0.1', help='Address the simulated printers listen on.')
+        parser.add_argument('--base-port', dest='base_port', type=int, default=20000, help='UDP port of the first simulated printer.')
+        parser.add_argument('--seed', dest='seed', type=int, default=1, help='Seed of the levels, jitter, and packet loss.')
+        parser.add_argument(
+            '--skip-memory', dest='skip_memory', action='store_true',
+            help="Don't run the extra cycle traced with tracemalloc to measure the peak memory."
+        )
+
+    def handle(self, *args, **options):
+        if options['printers'] < 1 or options['cycles'] < 1 or options['workers'] < 1:
+            raise CommandError('The number of printers, cycles, and workers must be at least 1.')
+        if not 0 <= options['loss'] < 1:
+            raise CommandError('The packet loss must be between 0 and 1.')
+        if not 1024 <= options['base_port'] <= 65535 - options['printers']:
+            raise CommandError('The ports of the simulated printers must be between 1024 and 65535.')
+
+        models = [model.strip() for model in options['models'].split(',') if model.strip()]
+        paths = walk_paths(models)
+        if not paths:
+            raise CommandError(f"No recorded walks match {options['models']!r}.")
+
+        farm, counters, stop = self.start_farm(paths, options)
+        old_database_name = connection.settings_dict['NAME']
+        try:
+            # The farm is polled with a throwaway database, cache, and metrics file.
+            with tempfile.TemporaryDirectory() as directory, override_settings(
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                METRICS_FILE=os.path.join(directory, 'metrics.json'),
+            ):
+                connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                self.create_printers(paths, options)
+                self.run_cycles(counters, options)
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            stop.set()
+            farm.join(timeout=10)
+            SESSION_POOL.clear()
+
+    def start_farm(self, paths, options):
+        """ Start the simulated printers in their own process and wait until all of them are listening. """
+        counters = multiprocessing.Array('q', options['printers'] * 2, lock=False)
+        ready = multiprocessing.Event()
+        stop = multiprocessing.Event()
+
+        farm = multiprocessing.Process(target=run_farm, daemon=True, args=(
+            paths, options['printers'], options['host'], options['base_port'], {options['snmp_version']}, 'public',
+            options['latency'] / 1000, options['jitter'] / 1000, options['loss'], options['seed'], counters, ready, stop
+        ))
+        farm.start()
+        if not ready.wait(timeout=60):
+            stop.set()
+            raise CommandError('The simulated printers did not start, check that the ports are free.')
+
+        self.stdout.write(
+            f"Started {options['printers']} simulated printers ({', '.join(os.path.basename(path) for path in paths)}) "
+            f"on {options['host']}:{options['base_port']}-{options['base_port'] + options['printers'] - 1}, "
+            f"SNMP v{options['snmp_version']}, latency {options['latency']:g}+{options['jitter']:g} ms, "
+            f"loss {options['loss']:.0%}."
+        )
+        return farm, counters, stop
+
+    def create_printers(self, paths, options):
+        # The address includes the port of the simulated printer, Net-SNMP (and easysnmp) accept "host:port".
+        Printer.objects.bulk_create([
+            Printer(
+                printer_name=f'SIM_{number:05d}',
+                printer_model_name=os.path.splitext(os.path.basename(paths[number % len(paths)]))[0],
+                printer_location='Simulated',
+                ip_address=f"{options['host']}:{options['base_port'] + number}",
+                department_name=f'Department {number % 20:02d}',
+                snmp_version=options['snmp_version'],
+            )
+            for number in range(options['printers'])
+        ])
+
+    def run_cycles(self, counters, options):
+        """ Run ``updatetonerdata`` ``cycles`` times, and once more with tracemalloc unless ``skip_memory`` is set. """
+        cycle_options = {'workers': options['workers'], 'timeout': options['timeout'], 'stdout': io.StringIO()}
+        printer_count = options['printers']
+        cycle_seconds = list()
+
+        for cycle in range(1, options['cycles'] + 1):
+            received_before, dropped_before = _totals(counters)
+            pool_misses_before = SESSION_POOL.misses
+
+            start = time.perf_counter()
+            call_command('updatetonerdata', **cycle_options)
+            seconds = time.perf_counter() - start
+            cycle_seconds.append(seconds)
+
+            received, dropped = _totals(counters)
+            requests = received - received_before
+            answered = Printer.objects.filter(consecutive_failures=0).count()
+            self.stdout.write(
+                f"Cycle {cycle}: {seconds:.2f}s, {requests / printer_count:.1f} requests per printer "
+                f"({dropped - dropped_before} dropped), {answered}/{printer_count} printers answered, "
+                f"{SESSION_POOL.misses - pool_misses_before} new SNMP sessions."
+            )
+
+        self.stdout.write(
+            f"Cycle time: min {min(cycle_seconds):.2f}s, median {statistics.median(cycle_seconds):.2f}s, "
+            f"max {max(cycle_seconds):.2f}s ({printer_count / statistics.median(cycle_seconds):.0f} printers/s)."
+        )
+
+        if options['skip_memory']:
+            return
+
+        # tracemalloc slows Python down, so the memory is measured in a cycle that isn't timed.
+        tracemalloc.start()
+        call_command('updatetonerdata', **cycle_options)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # ru_maxrss is in kilobytes on Linux.
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(
+            f"Peak memory: {peak / 1024 / 1024:.1f} MB allocated by Python during a cycle, "
+            f"{max_rss / 1024:.1f} MB max RSS of the process (includes Net-SNMP)."
+        )
+
+def _totals(counters):
+    """ Return the requests received and dropped by all the simulated printers. """
+    return sum(counters[0::2]), sum(counters[1::2])
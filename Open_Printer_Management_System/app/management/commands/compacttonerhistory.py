@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.rollups import compact_history
+
+class Command(BaseCommand):
+    help = (
+        "Merges the consecutive toner level rows of every printer module that have the same level into runs, the "
+        "way they are written when TONER_HISTORY_MODE is 'changes'. Run it once after upgrading a database with "
+        "history from before the runs, or after switching from 'samples' to 'changes'."
+    )
+
+    def handle(self, *args, **options):
+        if settings.TONER_HISTORY_MODE != 'changes':
+            raise CommandError("TONER_HISTORY_MODE in settings.py is 'samples', the history is kept with every poll.")
+
+        rows_deleted = compact_history()
+        self.stdout.write(f"Merged {rows_deleted} toner level rows into the runs before them.")
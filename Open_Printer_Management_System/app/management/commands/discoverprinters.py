@@ -0,0 +1,107 @@
+import ipaddress
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.discovery import scan_networks, diff_printers, save_diff
+
+class Command(BaseCommand):
+    help = (
+        'Scans IPv4 networks for printers and shows the new and changed printers compared with the database. '
+        'Use --commit to add and update them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('networks', nargs='+', help='Networks to scan in CIDR notation. Example: 10.20.0.0/16')
+        parser.add_argument(
+            '-w', '--window', dest='window', type=int, default=256,
+            help='Number of addresses probed at the same time.'
+        )
+        parser.add_argument(
+            '-t', '--timeout', dest='timeout', type=float, default=1,
+            help='Seconds to wait for each SNMP response.'
+        )
+        parser.add_argument(
+            '-r', '--retries', dest='retries', type=int, default=0,
+            help='Number of times a request is retried after a timeout.'
+        )
+        parser.add_argument(
+            '--deadline', dest='deadline', type=float, default=None,
+            help='Seconds the whole scan can take. The addresses not probed by then are skipped.'
+        )
+        parser.add_argument(
+            '-c', '--community', dest='communities', action='append',
+            help='SNMP community to try, can be used more than once. Defaults to SNMP_COMMUNITIES from settings.py.'
+        )
+        parser.add_argument(
+            '--department', dest='department', default='Discovered',
+            help='Department of the printers that are added.'
+        )
+        parser.add_argument('--commit', dest='commit', action='store_true', help='Add the new printers and update the changed ones.')
+
+    def handle(self, *args, **options):
+        try:
+            networks = [ipaddress.IPv4Network(network, strict=False) for network in options['networks']]
+        except ValueError as error:
+            raise CommandError(f'Invalid network: {error}')
+
+        if options['window'] < 1:
+            raise CommandError('The window must be at least 1.')
+        if options['deadline'] is not None and options['deadline'] <= 0:
+            raise CommandError('The deadline must be more than 0 seconds.')
+
+        communities = options['communities'] or settings.SNMP_COMMUNITIES
+        address_count = sum(max(network.num_addresses - 2, 1) for network in networks)
+        self.stdout.write(f"Scanning {address_count} addresses, {options['window']} at a time...")
+
+        report_every = max(address_count // 20, options['window'])
+        next_report = report_every
+        probed_count = 0
+
+        def progress(probed):
+            nonlocal next_report, probed_count
+            probed_count = probed
+            if probed >= next_report:
+                self.stdout.write(f"  {probed}/{address_count} addresses probed ({time.perf_counter() - start:.0f}s)")
+                next_report += report_every
+
+        start = time.perf_counter()
+        found_printers = scan_networks(
+            networks, window=options['window'], timeout=options['timeout'], retries=options['retries'],
+            communities=communities, progress=progress, deadline=options['deadline']
+        )
+        self.stdout.write(
+            f"Scanned {address_count} addresses in {time.perf_counter() - start:.1f}s, {len(found_printers)} printers answered.\n"
+        )
+        if probed_count < address_count:
+            self.stdout.write(self.style.WARNING(
+                f"The deadline passed after {probed_count} addresses were probed, the printers at the other "
+                "addresses are shown as not answering.\n"
+            ))
+
+        diff = diff_printers(found_printers, networks)
+
+        for found in diff['new']:
+            self.stdout.write(self.style.SUCCESS(
+                f"+ {found['ip_address']:<15} {found['printer_model_name']} "
+                f"(SNMP v{found['snmp_version']}, {found['snmp_community']}) {found['name']}"
+            ))
+        for printer, changes in diff['changed']:
+            change_text = ', '.join(f'{field}: {old!r} -> {new!r}' for field, (old, new) in changes.items())
+            self.stdout.write(self.style.WARNING(f"~ {printer.ip_address:<15} {printer.printer_name}: {change_text}"))
+        for printer in diff['missing']:
+            self.stdout.write(self.style.ERROR(f"? {printer.ip_address:<15} {printer.printer_name}: didn't answer"))
+
+        self.stdout.write(
+            f"\n{len(diff['new'])} new, {len(diff['changed'])} changed, {len(diff['missing'])} not answering, "
+            f"{len(diff['unchanged'])} unchanged."
+        )
+
+        if not options['commit']:
+            if diff['new'] or diff['changed']:
+                self.stdout.write('Run again with --commit to add the new printers and update the changed ones.')
+            return
+
+        created, updated = save_diff(diff, options['department'])
+        self.stdout.write(f"Added {created} printers and updated {updated}.")
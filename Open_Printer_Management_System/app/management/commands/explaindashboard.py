@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from app.models import TonerLevel
+from app.views import dashboard_querysets
+
+class Command(BaseCommand):
+    help = (
+        'Prints the query plans (EXPLAIN) of the homepage queries and the TonerLevel history queries, '
+        'to check that they use the indexes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', dest='analyze', action='store_true',
+            help='Run the queries and show the real row counts and times (PostgreSQL only).'
+        )
+
+    def handle(self, *args, **options):
+        explain_options = dict()
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                self.stderr.write('--analyze is only supported on PostgreSQL, showing the plans without it.')
+            else:
+                explain_options['analyze'] = True
+
+        querysets = dict(dashboard_querysets())
+
+        # Use a real printer module when there is one so the plans match the data.
+        sample = TonerLevel.objects.values('printer_name', 'module_identifier').order_by('-pk').first()
+        printer_id = sample['printer_name'] if sample else 0
+        module_identifier = sample['module_identifier'] if sample else ''
+
+        querysets['module_history'] = TonerLevel.objects.filter(
+            printer_name_id=printer_id, module_identifier=module_identifier
+        ).order_by('-date_time')
+        querysets['rows_of_a_poll'] = TonerLevel.objects.filter(date_time=timezone.now())
+        querysets['printer_history'] = TonerLevel.objects.filter(printer_name_id=printer_id).order_by('module_identifier', 'date_time')
+
+        for name, queryset in querysets.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
@@ -0,0 +1,87 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.fleetdata import GENERATED_PREFIX, generate_fleet, delete_generated_fleet, estimated_rows
+from app.forecasting import refit_forecasts
+from app.models import Printer
+
+class Command(BaseCommand):
+    help = (
+        f'Bulk-loads a fleet of generated printers ({GENERATED_PREFIX}00001, ...) with realistic toner history into '
+        'the database, to measure the dashboard and the pollers with runbenchmarks before a release. The real '
+        'printers are not touched. Use a copy of the database, the history can be tens of millions of rows '
+        '(for example, 1000 printers, --mode samples, and --days 70 write about 50 million).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--printers', dest='printers', type=int, default=1000, help='Number of printers.')
+        parser.add_argument('-d', '--days', dest='days', type=float, default=30, help='Days of toner history.')
+        parser.add_argument(
+            '--interval', dest='interval', type=float, default=settings.TIMEDELTA.total_seconds() / 60,
+            help='Minutes between polls. Defaults to TIMEDELTA in settings.py.'
+        )
+        parser.add_argument(
+            '--mode', dest='mode', choices=('changes', 'samples'), default=settings.TONER_HISTORY_MODE,
+            help='How the history is written (see TONER_HISTORY_MODE in settings.py).'
+        )
+        parser.add_argument('--departments', dest='departments', type=int, default=20, help='Number of departments.')
+        parser.add_argument('--seed', dest='seed', type=int, default=1, help='Seed of the levels, the same seed generates the same fleet.')
+        parser.add_argument(
+            '--batch-size', dest='batch_size', type=int, default=100000, help='Number of history rows inserted per transaction.'
+        )
+        parser.add_argument(
+            '--clear', dest='clear', action='store_true', help='Delete the printers generated before first.'
+        )
+        parser.add_argument(
+            '--skip-forecasts', dest='skip_forecasts', action='store_true',
+            help="Don't calculate the forecasts of the generated printers from their history."
+        )
+
+    def handle(self, *args, **options):
+        if options['printers'] < 1 or options['departments'] < 1 or options['batch_size'] < 1:
+            raise CommandError('The number of printers, departments, and the batch size must be at least 1.')
+        # The printers get the addresses of 198.18.0.0/15.
+        if options['printers'] >= 2 * 65536:
+            raise CommandError('There can be at most 131071 generated printers.')
+        if options['days'] <= 0 or options['interval'] <= 0:
+            raise CommandError('The days of history and the minutes between polls must be more than 0.')
+
+        if options['clear']:
+            printers_deleted = delete_generated_fleet()
+            self.stdout.write(f"Deleted {printers_deleted} generated printers and their history.")
+        elif Printer.objects.filter(printer_name__startswith=GENERATED_PREFIX).exists():
+            raise CommandError('There are generated printers in the database already, use --clear to replace them.')
+
+        interval = timedelta(minutes=options['interval'])
+        only_changes = options['mode'] == 'changes'
+        self.stdout.write(
+            f"Generating {options['printers']} printers with {options['days']:g} days of history polled every "
+            f"{options['interval']:g} minutes ('{options['mode']}' mode, about "
+            f"{estimated_rows(options['printers'], options['days'], interval, only_changes):,} rows)."
+        )
+
+        start = time.perf_counter()
+
+        def progress(printers_done, rows_written):
+            seconds = time.perf_counter() - start
+            self.stdout.write(
+                f"  {printers_done}/{options['printers']} printers, {rows_written:,} rows "
+                f"({rows_written / seconds:,.0f} rows/s)."
+            )
+
+        rows_written = generate_fleet(
+            options['printers'], options['days'], interval, only_changes, department_count=options['departments'],
+            seed=options['seed'], batch_size=options['batch_size'], progress=progress
+        )
+        self.stdout.write(f"Wrote {rows_written:,} toner level rows in {time.perf_counter() - start:.1f}s.")
+
+        if not options['skip_forecasts']:
+            start = time.perf_counter()
+            printer_ids = Printer.objects.filter(printer_name__startswith=GENERATED_PREFIX).values_list('pk', flat=True)
+            forecasts_written = refit_forecasts(list(printer_ids))
+            self.stdout.write(f"Wrote {forecasts_written} forecasts in {time.perf_counter() - start:.1f}s.")
+
+        self.stdout.write('Run rolluptonerdata --keep-all to summarize the history into the hourly and daily rollups.')
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.forecasting import refit_forecasts
+
+class Command(BaseCommand):
+    help = (
+        'Calculates the days until empty of every printer module again from the full toner level history. '
+        'The forecasts are already updated after every poll, this is only needed to build them the first time '
+        'or after changing FORECAST_SWAP_JUMP in settings.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--printer', dest='printer_ids', type=int, action='append',
+            help='Id of a printer to refit. Can be used more than once. Defaults to all the printers.'
+        )
+        parser.add_argument(
+            '--chunk-size', dest='chunk_size', type=int, default=50,
+            help='Number of printers whose history is read per query.'
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('The chunk size must be at least 1.')
+
+        forecasts_written = refit_forecasts(options['printer_ids'], chunk_size=options['chunk_size'])
+        self.stdout.write(f"Wrote {forecasts_written} forecasts.")
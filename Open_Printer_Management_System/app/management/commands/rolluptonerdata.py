@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app.models import IN_QUERY_CHUNK_SIZE
+from app.rollups import rollup_history, delete_old_history, delete_old_poll_cycles
+
+class Command(BaseCommand):
+    help = (
+        'Summarizes the toner level history seen since the last run into hourly and daily rollups, '
+        'then deletes the history and the poll cycles older than the retention period.'
+    )
+
+    def add_arguments(self, parser):
+        default_retention = settings.TONER_HISTORY_RETENTION.days if settings.TONER_HISTORY_RETENTION else None
+        parser.add_argument(
+            '--retention-days', dest='retention_days', type=int, default=default_retention,
+            help='Delete history last seen more than this many days ago. Defaults to TONER_HISTORY_RETENTION in settings.py.'
+        )
+        parser.add_argument(
+            '--keep-all', dest='keep_all', action='store_true', help="Only create the rollups, don't delete any history."
+        )
+        parser.add_argument(
+            '--chunk-size', dest='chunk_size', type=int, default=IN_QUERY_CHUNK_SIZE,
+            help='Number of rows deleted per transaction.'
+        )
+        parser.add_argument(
+            '--pause', dest='pause', type=float, default=0.1, help='Seconds to wait between deleted chunks.'
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('The chunk size must be at least 1.')
+
+        rollups_written = rollup_history()
+        self.stdout.write(f"Wrote {rollups_written} rollup rows.")
+
+        if options['keep_all'] or options['retention_days'] is None:
+            return
+
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+        rows_deleted = delete_old_history(cutoff, chunk_size=options['chunk_size'], pause=options['pause'])
+        self.stdout.write(f"Deleted {rows_deleted} toner level rows last seen before {cutoff:%Y-%m-%d %H:%M}.")
+
+        cycles_deleted = delete_old_poll_cycles(cutoff)
+        self.stdout.write(f"Deleted {cycles_deleted} poll cycles recorded before {cutoff:%Y-%m-%d %H:%M}.")
@@ -0,0 +1,266 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from app.history import HISTORY_RANGES
+from app.models import Printer, TonerLevel, CurrentTonerLevel, TonerLevelRollup, update_database
+from app.views import toner_level_cleanup
+
+SCENARIOS = ['homepage', 'homepage_cached', 'printer_history', 'toner_level_cleanup', 'update_database']
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the dashboard and the database writes of the pollers against the data in the database '
+        '(load a fleet with generatefleet first). Shows the time, number of queries, query time, and peak memory '
+        'of every scenario, and can save them to a JSON file to compare them with the results of another commit. '
+        'The writes of update_database are rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-s', '--scenario', dest='scenarios', action='append', choices=SCENARIOS,
+            help='Scenario to run. Can be used more than once. Defaults to all of them.'
+        )
+        parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=5, help='Timed runs of every scenario.')
+        parser.add_argument(
+            '--history-range', dest='history_range', choices=list(HISTORY_RANGES), default='30d',
+            help='Range of the printer history chart.'
+        )
+        parser.add_argument('-o', '--output', dest='output', help='Save the results to this JSON file.')
+        parser.add_argument('--compare', dest='compare', help='JSON file saved by an earlier run to compare the results with.')
+        parser.add_argument(
+            '--skip-memory', dest='skip_memory', action='store_true',
+            help="Don't run every scenario once more with tracemalloc to measure its peak memory."
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('The number of runs must be at least 1.')
+
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as results_file:
+                    previous = json.load(results_file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Couldn't read {options['compare']}: {error}")
+
+        scenario_names = options['scenarios'] or SCENARIOS
+
+        # The dashboard is cached in a cache of this process only, so clearing it doesn't affect the running site.
+        with override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver'],
+        ):
+            dataset = dataset_counts()
+            self.stdout.write(
+                f"Database: {connection.vendor} {database_version()}, {dataset['printers']} printers, "
+                f"{dataset['toner_levels']:,} toner levels, {dataset['rollups']:,} rollups."
+            )
+
+            results = dict()
+            for name in scenario_names:
+                function = getattr(self, f'scenario_{name}')(options)
+                if function is None:
+                    self.stdout.write(f"{name}: skipped, there are no printers.")
+                    continue
+                results[name] = measure(function, options['repeat'], not options['skip_memory'])
+                self.stdout.write(format_result(name, results[name], previous and previous['results'].get(name)))
+
+        if options['output']:
+            with open(options['output'], 'w') as results_file:
+                json.dump({
+                    **environment(), 'dataset': dataset, 'repeat': options['repeat'],
+                    'history_range': options['history_range'], 'results': results
+                }, results_file, indent=2)
+            self.stdout.write(f"Saved the results to {options['output']}.")
+
+    def scenario_homepage(self, options):
+        """ The homepage with an empty cache, so the dashboard is rendered from the database. """
+        client = Client()
+
+        def run():
+            cache.clear()
+            _check_response(client.get(reverse('homepage')))
+        return run
+
+    def scenario_homepage_cached(self, options):
+        """ The homepage with the dashboard already in the cache. """
+        client = Client()
+
+        def run():
+            _check_response(client.get(reverse('homepage')))
+        return run
+
+    def scenario_printer_history(self, options):
+        """ The history chart of the first printer. """
+        printer = Printer.objects.order_by('pk').first()
+        if printer is None:
+            return None
+        client = Client()
+        url = f"{reverse('printer-history', args=[printer.pk])}?range={options['history_range']}"
+
+        def run():
+            _check_response(client.get(url))
+        return run
+
+    def scenario_toner_level_cleanup(self, options):
+        """ ``toner_level_cleanup`` over the levels written in the last ``TIMEDELTA``, like the old homepage did. """
+        def run():
+            all_toner_levels = TonerLevel.objects.filter(
+                date_time__gte=timezone.now() - settings.TIMEDELTA
+            ).order_by('printer_name', 'module_identifier')
+            toner_level_cleanup(all_toner_levels)
+        return run
+
+    def scenario_update_database(self, options):
+        """ ``update_database`` with a poll of every printer where half the percentage levels went down a point.
+
+        The writes are rolled back, so every run starts from the same data.
+        """
+        printer_levels_dict = dict()
+        current_levels = CurrentTonerLevel.objects.order_by('pk').values_list(
+            'printer_name__printer_name', 'module_identifier', 'level'
+        )
+        for number, (printer_name, module_identifier, level) in enumerate(current_levels):
+            if level.isdigit() and number % 2:
+                level = str(max(int(level) - 1, 0))
+            printer_levels_dict.setdefault(printer_name, dict())[module_identifier] = level
+
+        def run():
+            with transaction.atomic():
+                update_database(printer_levels_dict)
+                transaction.set_rollback(True)
+        return run
+
+def measure(function, repeat, trace_memory):
+    """ Run a scenario once to warm up, ``repeat`` more times recording the queries, and once with tracemalloc.
+
+    Returns:
+        result (dict): Dictionary with the median time of the runs and how it is split.
+        DICTIONARY STRUCTURE:
+            {
+                'seconds': 0.153,         # Median time of a run.
+                'min_seconds': 0.149,
+                'queries': 7,             # Queries of the last run.
+                'query_seconds': 0.041,   # Median time spent in the database.
+                'python_seconds': 0.112,  # Median time spent in Python (rendering, building the objects, ...).
+                'peak_memory_mb': 12.5    # Peak memory allocated by Python, None with --skip-memory.
+            }
+    """
+    function()
+
+    seconds = list()
+    query_seconds = list()
+    for _ in range(repeat):
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            start = time.perf_counter()
+            function()
+            seconds.append(time.perf_counter() - start)
+        query_seconds.append(timer.seconds)
+
+    peak_memory_mb = None
+    if trace_memory:
+        # tracemalloc slows Python down, so the memory is measured in a run that isn't timed.
+        tracemalloc.start()
+        function()
+        peak_memory_mb = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        tracemalloc.stop()
+
+    return {
+        'seconds': round(statistics.median(seconds), 6),
+        'min_seconds': round(min(seconds), 6),
+        'queries': timer.queries,
+        'query_seconds': round(statistics.median(query_seconds), 6),
+        'python_seconds': round(statistics.median(total - spent for total, spent in zip(seconds, query_seconds)), 6),
+        'peak_memory_mb': peak_memory_mb,
+    }
+
+class QueryTimer:
+    """ Database execute wrapper (see ``connection.execute_wrapper``) that counts the queries and adds up their time.
+
+    Django only records the queries with ``DEBUG`` on, to the millisecond, and clears them at the start of every
+      request, so they are timed here instead. Only the execution is timed, the rows fetched after it count as
+      Python time.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+def format_result(name, result, previous=None):
+    """ Return a line with the result of a scenario, and how it changed since ``previous`` if there is one. """
+    memory = 'n/a' if result['peak_memory_mb'] is None else f"{result['peak_memory_mb']:.1f} MB"
+    line = (
+        f"{name}: {result['seconds'] * 1000:.1f} ms (min {result['min_seconds'] * 1000:.1f} ms), "
+        f"{result['queries']} queries taking {result['query_seconds'] * 1000:.1f} ms, "
+        f"{result['python_seconds'] * 1000:.1f} ms in Python, peak memory {memory}"
+    )
+    if previous:
+        change = (result['seconds'] - previous['seconds']) / previous['seconds'] if previous['seconds'] else 0
+        line += f" [{change:+.0%} time, {result['queries'] - previous['queries']:+d} queries]"
+    return line
+
+def dataset_counts():
+    """ Return the number of rows in the tables the scenarios read, saved with the results. """
+    return {
+        'printers': Printer.objects.count(),
+        'toner_levels': TonerLevel.objects.count(),
+        'current_toner_levels': CurrentTonerLevel.objects.count(),
+        'rollups': TonerLevelRollup.objects.count(),
+    }
+
+def database_version():
+    if connection.vendor == 'postgresql':
+        connection.ensure_connection()
+        return str(connection.pg_version)
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version
+    return ''
+
+def environment():
+    """ Return the commit, database, and versions the benchmarks ran with, so results can be compared. """
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'uncommitted_changes': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'date': timezone.now().isoformat(),
+        'database': {'vendor': connection.vendor, 'version': database_version()},
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+    }
+
+def _git(*arguments):
+    """ Return the output of a git command run in the project, or ``None`` if git isn't there. """
+    try:
+        output = subprocess.run(
+            ['git', *arguments], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.strip()
+
+def _check_response(response):
+    if response.status_code != 200:
+        raise CommandError(f'The page returned HTTP {response.status_code}.')
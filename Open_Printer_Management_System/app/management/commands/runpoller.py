@@ -0,0 +1,205 @@
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from app.metrics import METRICS
+from app.models import Printer, update_database
+from app.poller import (
+    PollSchedule, poll_intervals, save_poll_intervals, save_poll_state, _poll_printer, _record_poll_error
+)
+from app.snmp import PRINTER_OFF_LEVELS
+
+class Command(BaseCommand):
+    help = (
+        'Runs the toner poller as a long-running process. Every printer is polled on its own interval, chosen '
+        'from how fast its toner is being used, a printer is never polled twice at the same time, and SIGTERM '
+        'stops it cleanly.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-w', '--workers', dest='workers', type=int, default=settings.POLLER_WORKERS,
+            help='Number of printers polled at the same time.'
+        )
+        parser.add_argument(
+            '-t', '--timeout', dest='timeout', type=float, default=settings.POLLER_PRINTER_TIMEOUT,
+            help='Seconds to wait for each SNMP response from a printer.'
+        )
+        parser.add_argument(
+            '--interval', dest='interval', type=float, default=settings.TIMEDELTA.total_seconds(),
+            help='Seconds between two polls of a printer until it has its own interval.'
+        )
+        parser.add_argument(
+            '--refresh', dest='refresh', type=float, default=60,
+            help='Seconds between reloads of the printer list, to pick up added, changed, and deleted printers.'
+        )
+        parser.add_argument(
+            '--tick', dest='tick', type=float, default=1,
+            help='Seconds between checks for printers that are due and polls that finished.'
+        )
+        parser.add_argument(
+            '--write-interval', dest='write_interval', type=float, default=5,
+            help='Seconds between database writes. The polls that finished in between are written together.'
+        )
+        parser.add_argument(
+            '--shutdown-timeout', dest='shutdown_timeout', type=float, default=30,
+            help='Seconds to wait for the running polls to finish when stopping.'
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('The number of workers must be at least 1.')
+        if min(options['interval'], options['refresh'], options['tick'], options['write_interval']) <= 0:
+            raise CommandError('The interval, refresh, tick, and write interval must be more than 0 seconds.')
+
+        self.timeout = options['timeout']
+        self.stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        schedule = self.schedule = PollSchedule(options['interval'])
+        executor = ThreadPoolExecutor(max_workers=options['workers'])
+
+        # Future -> printer, for the polls that are running and the ones that finished but weren't written yet.
+        in_flight = dict()
+        finished = dict()
+        printers = dict()
+        next_refresh = 0
+        next_write = time.monotonic() + options['write_interval']
+        # Totals of the current cycle, logged every ``interval`` seconds.
+        self.cycle = self.new_cycle()
+        next_cycle_log = time.monotonic() + options['interval']
+
+        self.log(f"Poller started with {options['workers']} workers, default interval {options['interval']:.0f}s.")
+
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+
+            if now >= next_refresh:
+                # The database connection may have been closed by the server while the daemon was idle.
+                close_old_connections()
+                printers = {printer.pk: printer for printer in Printer.objects.filter(probe_state=Printer.READY)}
+                schedule.sync(printers, now)
+                for printer in printers.values():
+                    if printer.poll_interval is not None:
+                        schedule.set_interval(printer.pk, printer.poll_interval.total_seconds())
+                next_refresh = now + options['refresh']
+
+            busy = {printer.pk for printer in in_flight.values()}
+            for printer_id in schedule.due(now, busy):
+                printer = printers[printer_id]
+                schedule.started(printer_id, now)
+                in_flight[executor.submit(timed_poll, printer, self.timeout)] = printer
+
+            for future in [future for future in in_flight if future.done()]:
+                finished[future] = in_flight.pop(future)
+
+            if now >= next_write:
+                if finished:
+                    self.save_results(finished)
+                    finished = dict()
+                next_write = now + options['write_interval']
+
+            if now >= next_cycle_log:
+                self.log_cycle(options['interval'], len(printers), len(in_flight))
+                next_cycle_log = now + options['interval']
+
+            self.stop_event.wait(options['tick'])
+
+        # Let the polls that already started finish so their results aren't lost.
+        self.log(f"Stopping, waiting for {len(in_flight)} poll(s) to finish.")
+        done, _ = wait(in_flight, timeout=options['shutdown_timeout'])
+        finished.update({future: in_flight[future] for future in done})
+        if finished:
+            self.save_results(finished)
+
+        executor.shutdown(wait=False)
+        self.log("Poller stopped.")
+
+    def stop(self, signum, frame):
+        self.stop_event.set()
+
+    def save_results(self, finished):
+        """ Write the levels of the polls that finished to the database and add them to the cycle totals. """
+        printer_levels_dict = dict()
+        changed_printers = list()
+
+        for future, printer in finished.items():
+            try:
+                levels_dict, changed, duration = future.result()
+            except Exception:
+                # Counted as a poll without an answer, like in poll_printers, so its breaker opens if it keeps failing.
+                self.cycle['errors'] += 1
+                _record_poll_error(printer)
+                changed_printers.append(printer)
+                continue
+
+            if levels_dict is not None:
+                printer_levels_dict[printer.printer_name] = levels_dict
+            if changed:
+                changed_printers.append(printer)
+
+            self.cycle['polled'] += 1
+            self.cycle['poll_seconds'] += duration
+            if printer.breaker_state == Printer.BREAKER_OPEN:
+                self.cycle['breaker_open'] += 1
+            elif printer.consecutive_failures:
+                self.cycle['off'] += 1
+            if duration > self.cycle['slowest'][1]:
+                self.cycle['slowest'] = (printer.printer_name, duration)
+
+        write_start = time.perf_counter()
+        close_old_connections()
+        save_poll_state(changed_printers)
+        if printer_levels_dict:
+            self.cycle['rows_written'] += update_database(printer_levels_dict)
+
+        # Printers that are off keep the default interval instead of the one from their old levels.
+        polled_printers = [printer for printer in finished.values() if printer.printer_name in printer_levels_dict]
+        intervals = poll_intervals(
+            printer.pk for printer in polled_printers if printer_levels_dict[printer.printer_name] != PRINTER_OFF_LEVELS
+        )
+        for printer in polled_printers:
+            interval = intervals.get(printer.pk)
+            self.schedule.set_interval(printer.pk, interval.total_seconds() if interval else self.schedule.interval)
+        save_poll_intervals(polled_printers, intervals)
+        self.cycle['write_seconds'] += time.perf_counter() - write_start
+
+        # The metrics of the polls are added to METRICS_FILE with every write, so /metrics is never far behind.
+        METRICS.flush()
+
+    def log_cycle(self, interval, printer_count, in_flight_count):
+        cycle = self.cycle
+        if cycle['polled']:
+            average = cycle['poll_seconds'] / cycle['polled']
+            slowest_name, slowest_seconds = cycle['slowest']
+            self.log(
+                f"Last {interval:.0f}s: {cycle['polled']} polls of {printer_count} printers "
+                f"(average {average:.2f}s, slowest {slowest_name} {slowest_seconds:.2f}s, {cycle['off']} not answering, {cycle['breaker_open']} breaker open, "
+                f"{cycle['errors']} failed), {in_flight_count} in flight. "
+                f"Wrote {cycle['rows_written']} rows in {cycle['write_seconds']:.2f}s."
+            )
+        else:
+            self.log(f"Last {interval:.0f}s: no printers polled, {in_flight_count} in flight.")
+        self.cycle = self.new_cycle()
+
+    def new_cycle(self):
+        return {
+            'polled': 0, 'off': 0, 'breaker_open': 0, 'errors': 0, 'poll_seconds': 0.0, 'slowest': (None, 0.0),
+            'rows_written': 0, 'write_seconds': 0.0,
+        }
+
+    def log(self, message):
+        self.stdout.write(f"[{timezone.localtime():%Y-%m-%d %H:%M:%S}] {message}")
+
+def timed_poll(printer, timeout):
+    """ Run ``_poll_printer`` in a worker thread and add the seconds it took to its result. """
+    start = time.perf_counter()
+    levels_dict, changed = _poll_printer(printer, timeout)
+    return levels_dict, changed, time.perf_counter() - start
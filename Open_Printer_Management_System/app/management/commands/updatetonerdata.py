@@ -1,7 +1,14 @@
+import time
+
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
 
-from app.snmp import SNMP
+from app.leases import ensure_leases, lease_printers, held_printer_ids, release_printers
+from app.metrics import METRICS
 from app.models import Printer, update_database
+from app.poller import poll_printer, poll_printers
 
 class Command(BaseCommand):
     help = 'Updates the database with the newest toner data.'
@@ -9,29 +16,151 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('-i', '--ip', dest='ip')
         parser.add_argument('-n', '--name', dest='name')
+        parser.add_argument(
+            '-w', '--workers', dest='workers', type=int, default=settings.POLLER_WORKERS,
+            help='Number of printers polled at the same time. Use 1 to poll the printers one after another.'
+        )
+        parser.add_argument(
+            '-t', '--timeout', dest='timeout', type=float, default=settings.POLLER_PRINTER_TIMEOUT,
+            help='Seconds to wait for each SNMP response from a printer.'
+        )
+        parser.add_argument(
+            '-d', '--deadline', dest='deadline', type=float, default=settings.POLLER_CYCLE_DEADLINE.total_seconds(),
+            help='Seconds the whole update can take. Printers that have not answered by then are skipped.'
+        )
+        parser.add_argument(
+            '--worker-id', dest='worker_id',
+            help='Share the printers with the other workers running with a --worker-id, leasing batches of them from '
+                 'the database. Every worker needs its own id, for example the host name.'
+        )
+        parser.add_argument(
+            '--site', dest='sites', action='append',
+            help='With --worker-id, only poll the printers of this poller site. Can be used more than once. '
+                 'Use "" for the printers without a site. Defaults to every printer.'
+        )
+        parser.add_argument(
+            '--department', dest='departments', action='append',
+            help='With --worker-id, only poll the printers of this department. Can be used more than once.'
+        )
+        parser.add_argument(
+            '--batch-size', dest='batch_size', type=int, default=settings.POLLER_LEASE_BATCH,
+            help='With --worker-id, number of printers leased at a time.'
+        )
 
     def handle(self, *args, **options):
         ip = options['ip']
         name = options['name']
 
+        if options['workers'] < 1:
+            raise CommandError('The number of workers must be at least 1.')
+        if (options['sites'] is not None or options['departments']) and not options['worker_id']:
+            raise CommandError('--site and --department can only be used with --worker-id.')
+        if options['batch_size'] < 1:
+            raise CommandError('The batch size must be at least 1.')
+
         printer_levels_dict = dict()
 
         if ip and name:
-            version = Printer.objects.get(ip_address=ip).snmp_version
+            printer = Printer.objects.get(ip_address=ip)
+
+            levels_dict = poll_printer(printer, options['timeout'])
+            if levels_dict is not None:
+                printer_levels_dict[name] = levels_dict
+            rows_written = update_database(printer_levels_dict)
+            self.stdout.write(f"Wrote {rows_written} toner level rows.")
+            METRICS.flush()
+            return
 
-            levels_dict = SNMP(ip, version).get_consumable_levels()
-            printer_levels_dict[name] = levels_dict
-            update_database(printer_levels_dict)
+        if options['worker_id']:
+            self.poll_leased_printers(options)
+            METRICS.flush()
             return
 
-        all_printers_object = Printer.objects.all()
+        # Printers still being added from the web interface (or that couldn't be added) aren't polled.
+        all_printers_object = list(Printer.objects.filter(probe_state=Printer.READY))
+
+        poll_start = time.perf_counter()
+        printer_levels_dict, unfinished_printers = poll_printers(
+            all_printers_object, workers=options['workers'], timeout=options['timeout'], deadline=options['deadline']
+        )
+        poll_seconds = time.perf_counter() - poll_start
+
+        skipped_printers = [printer.printer_name for printer in unfinished_printers]
+        if skipped_printers:
+            self.stderr.write(
+                f"{len(skipped_printers)} printer(s) didn't finish before the deadline: {', '.join(skipped_printers)}"
+            )
+
+        write_start = time.perf_counter()
+        rows_written = update_database(printer_levels_dict)
+        write_seconds = time.perf_counter() - write_start
+        self.stdout.write(
+            f"Polled {len(all_printers_object)} printers in {poll_seconds:.2f}s. "
+            f"Wrote {rows_written} toner level rows for {len(printer_levels_dict)} printers in {write_seconds:.2f}s."
+        )
+        METRICS.flush()
+
+    def poll_leased_printers(self, options):
+        """ Poll the printers in batches leased from the database until there are none left that are due.
+
+        Every batch is written as soon as it is polled, and only if this worker still holds the leases. It is polled
+          for at most half of ``POLLER_LEASE_DURATION``, so the leases don't expire while the levels are written.
+        """
+        worker_id = options['worker_id']
+        cycle_start = time.monotonic()
+        # Printers polled since then were polled by another worker in this cycle.
+        polled_before = timezone.now() - settings.POLLER_LEASE_REPOLL_AFTER
+        batch_deadline = settings.POLLER_LEASE_DURATION.total_seconds() / 2
+
+        ensure_leases()
+
+        batches = printers_polled = rows_written = 0
+        unfinished_printers = dict()
+
+        while True:
+            remaining = options['deadline'] - (time.monotonic() - cycle_start)
+            if remaining <= 0:
+                break
+
+            printers = lease_printers(
+                worker_id, options['batch_size'], polled_before, sites=options['sites'],
+                departments=options['departments']
+            )
+            if not printers:
+                break
+
+            try:
+                printer_levels_dict, unfinished = poll_printers(
+                    printers, workers=options['workers'], timeout=options['timeout'],
+                    deadline=min(remaining, batch_deadline)
+                )
+                finished_ids = {printer.pk for printer in printers} - {printer.pk for printer in unfinished}
 
-        printer_dict = {printer.printer_name: printer.ip_address for printer in all_printers_object}
+                with transaction.atomic():
+                    held_ids = held_printer_ids(worker_id, finished_ids)
+                    held_levels = {
+                        printer.printer_name: printer_levels_dict[printer.printer_name] for printer in printers
+                        if printer.pk in held_ids and printer.printer_name in printer_levels_dict
+                    }
+                    if held_levels:
+                        rows_written += update_database(held_levels)
+                    release_printers(worker_id, held_ids, polled_at=timezone.now())
+            finally:
+                # The printers that didn't finish (or all of them, if something failed) can be leased again.
+                release_printers(worker_id, [printer.pk for printer in printers])
 
-        for printer_name, ip_address in printer_dict.items():
-            version = Printer.objects.get(ip_address=ip_address).snmp_version
+            batches += 1
+            printers_polled += len(held_ids)
+            unfinished_printers.update({printer.pk: printer for printer in unfinished})
+            for printer_id in held_ids:
+                unfinished_printers.pop(printer_id, None)
 
-            levels_dict = SNMP(ip_address, version).get_consumable_levels()
-            printer_levels_dict[printer_name] = levels_dict
-        
-        update_database(printer_levels_dict)
+        if unfinished_printers:
+            self.stderr.write(
+                f"{len(unfinished_printers)} printer(s) didn't finish before the deadline: "
+                f"{', '.join(printer.printer_name for printer in unfinished_printers.values())}"
+            )
+        self.stdout.write(
+            f"Worker {worker_id} polled {printers_polled} printers in {batches} batches in "
+            f"{time.monotonic() - cycle_start:.2f}s. Wrote {rows_written} toner level rows."
+        )
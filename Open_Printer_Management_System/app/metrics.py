@@ -0,0 +1,222 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Upper bounds of the histogram buckets in seconds, from a quick SNMP answer to a long poll cycle.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Type and description of every metric, used for the "# TYPE" and "# HELP" lines of the /metrics page.
+METRIC_DEFINITIONS = {
+    'snmp_request_seconds': (
+        'histogram', 'Seconds an SNMP request took by operation and column. A request that reads several columns '
+        'is counted for each of them.'
+    ),
+    'snmp_timeouts_total': ('counter', 'SNMP requests that timed out, by operation and column.'),
+    'snmp_nosuchname_total': ('counter', 'SNMP v1 requests answered with a NoSuchName error, by operation and column.'),
+    'poller_printer_seconds': ('histogram', 'Seconds it took to poll each printer, including retries and rechecks.'),
+    'poller_printer_failures_total': ('counter', 'Polls of each printer without an answer.'),
+    'poll_cycle_seconds': ('histogram', 'Seconds it took to poll all the printers (updatetonerdata and refresh jobs).'),
+    'poll_cycle_printers_total': ('counter', 'Printers polled in the poll cycles.'),
+    'poll_cycle_unfinished_total': ('counter', "Printers that didn't finish before the deadline of their poll cycle."),
+    'poll_cycle_last_timestamp_seconds': ('gauge', 'Unix time the last poll cycle finished.'),
+    'db_write_seconds': ('histogram', 'Seconds the database writes of the pollers took, by operation.'),
+    'db_rows_written_total': ('counter', 'Toner level rows written.'),
+}
+
+class MetricsRegistry:
+    """ Counters, histograms, and gauges recorded by this process and added to ``METRICS_FILE`` by ``flush``.
+
+    The pollers (``runpoller``, ``updatetonerdata``, and the refresh jobs of the web workers) are different
+      processes, so every process keeps what it recorded since its last flush in memory and adds it to the file
+      shared by all of them. The file is locked while it is updated, and :view:`app.metrics` reads it.
+
+    Recording a value only takes a lock and updates a dictionary, so it can be done for every SNMP request.
+
+    Counters and histograms are added to the values in the file, gauges replace them.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = _empty_metrics()
+
+    def inc(self, name, amount=1, **labels):
+        """ Add ``amount`` to a counter. """
+        series = _label_string(labels)
+        with self._lock:
+            counter = self._data['counters'].setdefault(name, dict())
+            counter[series] = counter.get(series, 0) + amount
+
+    def set(self, name, value, **labels):
+        """ Set the value of a gauge. """
+        series = _label_string(labels)
+        with self._lock:
+            self._data['gauges'].setdefault(name, dict())[series] = value
+
+    def observe(self, name, value, **labels):
+        """ Add a value (in seconds) to a histogram. """
+        self.observe_many(name, value, [labels])
+
+    def observe_many(self, name, value, label_sets):
+        """ Add the same value to the histogram of every set of labels, taking the lock once. """
+        bucket = bisect_left(LATENCY_BUCKETS, value)
+        series_list = [_label_string(labels) for labels in label_sets]
+        with self._lock:
+            histograms = self._data['histograms'].setdefault(name, dict())
+            for series in series_list:
+                histogram = histograms.get(series)
+                if histogram is None:
+                    histogram = histograms[series] = _empty_histogram()
+                histogram['buckets'][bucket] += 1
+                histogram['sum'] += value
+                histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """ Context manager that adds the seconds the with block took to a histogram. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def flush(self, path=None):
+        """ Add the metrics recorded since the last flush to the metrics file.
+
+        If the file can't be written, the metrics are kept in memory and added on the next flush.
+
+        Args:
+            path (str): Path of the file. If ``None``, then ``METRICS_FILE`` from ``settings.py`` is used.
+
+        Returns:
+            bool: ``True`` if the file was updated, ``False`` if there was nothing to add or it couldn't be written.
+        """
+        if path is None:
+            path = settings.METRICS_FILE
+
+        with self._lock:
+            pending, self._data = self._data, _empty_metrics()
+        if not any(pending.values()):
+            return False
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # The lock is taken on a separate file because the metrics file is replaced on every flush.
+            with open(path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                data = read_metrics(path)
+                merge_metrics(data, pending)
+
+                temporary_path = f'{path}.{os.getpid()}.tmp'
+                with open(temporary_path, 'w') as temporary_file:
+                    json.dump(data, temporary_file)
+                # Readers see the old or the new file, never a partly written one.
+                os.replace(temporary_path, path)
+        except OSError:
+            with self._lock:
+                merge_metrics(self._data, pending)
+            return False
+        return True
+
+def read_metrics(path=None):
+    """ Return the metrics in the metrics file, or no metrics if the file doesn't exist yet or can't be read.
+
+    Returns:
+        metrics (dict): Dictionary with every series of each metric by its labels.
+        DICTIONARY STRUCTURE:
+            {
+                'counters': {'snmp_timeouts_total': {'oid=".1.3.6.1.2.1.1.3.0",operation="get"': 4, ...}, ...},
+                'histograms': {
+                    'poller_printer_seconds': {
+                        'printer="IT Copier"': {'buckets': [0, 3, ...], 'sum': 1.52, 'count': 12},
+                        ...
+                    },
+                    ...
+                },
+                'gauges': {'poll_cycle_last_timestamp_seconds': {'': 1620816000.0}, ...}
+            }
+    """
+    if path is None:
+        path = settings.METRICS_FILE
+    try:
+        with open(path) as metrics_file:
+            return json.load(metrics_file)
+    except (OSError, ValueError):
+        return _empty_metrics()
+
+def merge_metrics(data, new):
+    """ Add the metrics in ``new`` to ``data`` (see ``read_metrics`` for the structure). """
+    for name, series in new['counters'].items():
+        counter = data['counters'].setdefault(name, dict())
+        for labels, value in series.items():
+            counter[labels] = counter.get(labels, 0) + value
+
+    for name, series in new['gauges'].items():
+        data['gauges'].setdefault(name, dict()).update(series)
+
+    for name, series in new['histograms'].items():
+        histograms = data['histograms'].setdefault(name, dict())
+        for labels, histogram in series.items():
+            existing = histograms.get(labels)
+            # Histograms written with different LATENCY_BUCKETS can't be added, the new one replaces them.
+            if existing is None or len(existing['buckets']) != len(histogram['buckets']):
+                histograms[labels] = {
+                    'buckets': list(histogram['buckets']), 'sum': histogram['sum'], 'count': histogram['count']
+                }
+                continue
+            existing['buckets'] = [old + added for old, added in zip(existing['buckets'], histogram['buckets'])]
+            existing['sum'] += histogram['sum']
+            existing['count'] += histogram['count']
+
+def render_prometheus(data):
+    """ Return the metrics in the Prometheus text format (version 0.0.4).
+
+    Only the metrics in ``METRIC_DEFINITIONS`` are included.
+    """
+    lines = list()
+
+    for name, (metric_type, help_text) in METRIC_DEFINITIONS.items():
+        series = data[metric_type + 's'].get(name)
+        if not series:
+            continue
+
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+
+        for labels, value in sorted(series.items()):
+            if metric_type != 'histogram':
+                lines.append(f'{name}{_braces(labels)} {value}')
+                continue
+
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), value['buckets']):
+                cumulative += count
+                bucket_labels = ','.join(filter(None, (labels, f'le="{bound}"')))
+                lines.append(f'{name}_bucket{{{bucket_labels}}} {cumulative}')
+            lines.append(f"{name}_sum{_braces(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_braces(labels)} {value['count']}")
+
+    return '\n'.join(lines) + '\n'
+
+def _empty_metrics():
+    return {'counters': dict(), 'histograms': dict(), 'gauges': dict()}
+
+def _empty_histogram():
+    return {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+
+def _label_string(labels):
+    """ Return the labels in the Prometheus format without the braces, sorted so the same labels are the same series. """
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _braces(labels):
+    return f'{{{labels}}}' if labels else ''
+
+# Metrics recorded by this process.
+METRICS = MetricsRegistry()
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_auto_20200608_1231'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printer',
+            name='snmp_checked',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='SNMP Settings Checked'),
+        ),
+        migrations.AddField(
+            model_name='printer',
+            name='snmp_community',
+            field=models.CharField(default='public', max_length=50, verbose_name='SNMP Community'),
+        ),
+        migrations.AlterField(
+            model_name='printer',
+            name='printer_name',
+            field=models.CharField(help_text='Name of printer on server. Example: IT Copier OR 8x11_1125.', max_length=75, unique=True, verbose_name='Printer Name'),
+        ),
+    ]
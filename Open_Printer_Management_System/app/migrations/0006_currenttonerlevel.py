@@ -0,0 +1,67 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:42
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+
+def populate_current_levels(apps, schema_editor):
+    """ Fill the CurrentTonerLevel table with the latest level of every printer module.
+
+    Modules whose latest level is older than ``TIMEDELTA`` compared to the latest level of the
+      same printer are left out, since the printer didn't report them in its last poll.
+    """
+    TonerLevel = apps.get_model('app', 'TonerLevel')
+    CurrentTonerLevel = apps.get_model('app', 'CurrentTonerLevel')
+
+    latest_ids = [
+        row['latest_id'] for row in
+        TonerLevel.objects.values('printer_name', 'module_identifier').annotate(latest_id=Max('id')).order_by()
+    ]
+
+    latest_levels = list()
+    for position in range(0, len(latest_ids), 500):
+        latest_levels.extend(TonerLevel.objects.filter(id__in=latest_ids[position:position + 500]))
+
+    last_polls = dict()
+    for toner_level in latest_levels:
+        last_poll = last_polls.get(toner_level.printer_name_id)
+        if last_poll is None or toner_level.date_time > last_poll:
+            last_polls[toner_level.printer_name_id] = toner_level.date_time
+
+    CurrentTonerLevel.objects.bulk_create([
+        CurrentTonerLevel(
+            printer_name_id=toner_level.printer_name_id,
+            module_identifier=toner_level.module_identifier,
+            level=toner_level.level,
+            date_time=toner_level.date_time
+        )
+        for toner_level in latest_levels
+        if last_polls[toner_level.printer_name_id] - toner_level.date_time < settings.TIMEDELTA
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_printer_snmp_settings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentTonerLevel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_time', models.DateTimeField()),
+                ('module_identifier', models.CharField(help_text='Identifier for the toners or units. Example. Magenta OR Toner Collection Unit.', max_length=50)),
+                ('level', models.CharField(help_text='This should be either a percentage (0 - 100 without the percent sign) or OK or NA.', max_length=3)),
+                ('printer_name', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.printer')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='currenttonerlevel',
+            constraint=models.UniqueConstraint(fields=('printer_name', 'module_identifier'), name='unique_current_toner_level'),
+        ),
+        migrations.RunPython(populate_current_levels, migrations.RunPython.noop),
+    ]
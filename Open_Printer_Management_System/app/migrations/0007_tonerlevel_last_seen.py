@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_currenttonerlevel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currenttonerlevel',
+            name='toner_level',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.tonerlevel'),
+        ),
+        migrations.AddField(
+            model_name='tonerlevel',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='tonerlevel',
+            name='date_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+from django.db.models import F, Max
+
+
+def start_runs(apps, schema_editor):
+    """ Turn the existing toner level samples into runs of a single sample.
+
+    Every existing row was a single sample, so its ``last_seen`` is its ``date_time``. Consecutive samples with the
+      same level aren't merged here, the migration doesn't depend on ``TONER_HISTORY_MODE``: the
+      ``compacttonerhistory`` management command merges them when the history is kept in ``'changes'`` mode.
+    """
+    TonerLevel = apps.get_model('app', 'TonerLevel')
+
+    TonerLevel.objects.update(last_seen=F('date_time'))
+
+def link_current_levels(apps, schema_editor):
+    """ Point every CurrentTonerLevel row to the latest TonerLevel row of its printer module. """
+    TonerLevel = apps.get_model('app', 'TonerLevel')
+    CurrentTonerLevel = apps.get_model('app', 'CurrentTonerLevel')
+
+    latest_ids = {
+        (row['printer_name'], row['module_identifier']): row['latest_id'] for row in
+        TonerLevel.objects.values('printer_name', 'module_identifier').annotate(latest_id=Max('id')).order_by()
+    }
+
+    current_levels = list(CurrentTonerLevel.objects.all())
+    for current_level in current_levels:
+        current_level.toner_level_id = latest_ids.get((current_level.printer_name_id, current_level.module_identifier))
+
+    CurrentTonerLevel.objects.bulk_update(current_levels, ['toner_level'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_tonerlevel_last_seen'),
+    ]
+
+    operations = [
+        migrations.RunPython(start_runs, migrations.RunPython.noop),
+        migrations.RunPython(link_current_levels, migrations.RunPython.noop),
+    ]
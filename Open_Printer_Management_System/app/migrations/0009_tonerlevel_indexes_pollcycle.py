@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:46
+
+from django.db import migrations, models
+from django.db.models import Max
+import django.utils.timezone
+
+
+def create_last_poll(apps, schema_editor):
+    """ Record the last time the toner levels were updated, so the homepage keeps showing it. """
+    CurrentTonerLevel = apps.get_model('app', 'CurrentTonerLevel')
+    PollCycle = apps.get_model('app', 'PollCycle')
+
+    last_update = CurrentTonerLevel.objects.aggregate(Max('date_time'))['date_time__max']
+    if last_update is not None:
+        PollCycle.objects.create(date_time=last_update)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_compact_toner_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollCycle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('printer_count', models.IntegerField(default=0, verbose_name='Printers Polled')),
+                ('rows_written', models.IntegerField(default=0, verbose_name='Rows Written')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='printer',
+            index=models.Index(fields=['department_name', 'printer_name'], name='printer_department_order'),
+        ),
+        migrations.AddIndex(
+            model_name='tonerlevel',
+            index=models.Index(fields=['printer_name', 'module_identifier', 'date_time'], name='tonerlevel_module_history'),
+        ),
+        migrations.AddIndex(
+            model_name='tonerlevel',
+            index=models.Index(fields=['date_time'], name='tonerlevel_date_time'),
+        ),
+        migrations.RunPython(create_last_poll, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_tonerlevel_indexes_pollcycle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('processed_until', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TonerLevelRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('module_identifier', models.CharField(help_text='Identifier for the toners or units. Example. Magenta OR Toner Collection Unit.', max_length=50)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('period_start', models.DateTimeField()),
+                ('min_level', models.IntegerField(blank=True, null=True)),
+                ('max_level', models.IntegerField(blank=True, null=True)),
+                ('last_level', models.CharField(max_length=3)),
+                ('last_seen', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tonerlevel',
+            index=models.Index(fields=['last_seen'], name='tonerlevel_last_seen'),
+        ),
+        migrations.AddField(
+            model_name='tonerlevelrollup',
+            name='printer_name',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.printer'),
+        ),
+        migrations.AddConstraint(
+            model_name='tonerlevelrollup',
+            constraint=models.UniqueConstraint(fields=('printer_name', 'module_identifier', 'period', 'period_start'), name='unique_toner_level_rollup'),
+        ),
+    ]
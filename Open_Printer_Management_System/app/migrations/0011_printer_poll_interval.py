@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_tonerlevelrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printer',
+            name='poll_interval',
+            field=models.DurationField(blank=True, null=True, verbose_name='Poll Interval'),
+        ),
+    ]
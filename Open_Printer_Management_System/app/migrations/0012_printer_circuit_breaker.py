@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_printer_poll_interval'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printer',
+            name='breaker_retry_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Breaker Retry At'),
+        ),
+        migrations.AddField(
+            model_name='printer',
+            name='breaker_state',
+            field=models.CharField(choices=[('closed', 'Closed'), ('open', 'Open')], default='closed', max_length=6, verbose_name='Breaker State'),
+        ),
+        migrations.AddField(
+            model_name='printer',
+            name='consecutive_failures',
+            field=models.PositiveIntegerField(default=0, verbose_name='Consecutive Failures'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:54
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_printer_circuit_breaker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], default='queued', max_length=8)),
+                ('active_key', models.CharField(blank=True, max_length=20, null=True, unique=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('printers_total', models.IntegerField(default=0, verbose_name='Printers')),
+                ('printers_done', models.IntegerField(default=0, verbose_name='Printers Done')),
+                ('printers_failed', models.IntegerField(default=0, verbose_name='Printers Failed')),
+                ('rows_written', models.IntegerField(default=0, verbose_name='Rows Written')),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+    ]
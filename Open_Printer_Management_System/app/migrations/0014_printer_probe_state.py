@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_polljob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printer',
+            name='probe_error',
+            field=models.TextField(blank=True, verbose_name='Probe Error'),
+        ),
+        migrations.AddField(
+            model_name='printer',
+            name='probe_state',
+            field=models.CharField(choices=[('probing', 'Probing'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=7, verbose_name='Probe State'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_printer_probe_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TonerForecast',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('module_identifier', models.CharField(help_text='Identifier for the toners or units. Example. Magenta OR Toner Collection Unit.', max_length=50)),
+                ('cartridge_start', models.DateTimeField()),
+                ('last_level', models.IntegerField()),
+                ('last_seen', models.DateTimeField()),
+                ('observations', models.IntegerField(default=0)),
+                ('sum_t', models.FloatField(default=0)),
+                ('sum_level', models.FloatField(default=0)),
+                ('sum_tt', models.FloatField(default=0)),
+                ('sum_t_level', models.FloatField(default=0)),
+                ('rate', models.FloatField(blank=True, null=True, verbose_name='Points Per Day')),
+                ('days_left', models.FloatField(blank=True, null=True, verbose_name='Days Left')),
+                ('empty_date', models.DateTimeField(blank=True, null=True, verbose_name='Empty Date')),
+                ('printer_name', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.printer')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='tonerforecast',
+            constraint=models.UniqueConstraint(fields=('printer_name', 'module_identifier'), name='unique_toner_forecast'),
+        ),
+    ]
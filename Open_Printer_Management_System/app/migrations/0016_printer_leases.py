@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_tonerforecast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrinterLease',
+            fields=[
+                ('printer_name', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lease', serialize=False, to='app.printer')),
+                ('worker_id', models.CharField(blank=True, max_length=100, verbose_name='Worker')),
+                ('expires', models.DateTimeField(blank=True, null=True, verbose_name='Lease Expires')),
+                ('polled_at', models.DateTimeField(blank=True, null=True, verbose_name='Last Polled')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='printer',
+            name='poller_site',
+            field=models.CharField(blank=True, help_text='Only the pollers started with this site poll the printer. Leave empty if any poller can reach it.', max_length=50, verbose_name='Poller Site'),
+        ),
+        migrations.AddIndex(
+            model_name='printerlease',
+            index=models.Index(fields=['polled_at'], name='printerlease_polled_at'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:36
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def start_probe_clocks(apps, schema_editor):
+    """ Start the clean up clock of the printers that were already being added or couldn't be added. """
+    Printer = apps.get_model('app', 'Printer')
+    Printer.objects.exclude(probe_state='ready').update(probe_updated=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_printer_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printer',
+            name='probe_updated',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Probe Updated'),
+        ),
+        migrations.RunPython(start_probe_clocks, migrations.RunPython.noop),
+    ]
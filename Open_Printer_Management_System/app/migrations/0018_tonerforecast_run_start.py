@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_printer_probe_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tonerforecast',
+            name='run_start',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
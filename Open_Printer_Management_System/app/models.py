@@ -1,12 +1,46 @@
-from django.db import models
+import time
+
+from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 
+from .metrics import METRICS
+
+# Maximum number of values in a single ``__in`` lookup, older SQLite versions only allow 999 parameters per query.
+IN_QUERY_CHUNK_SIZE = 500
+
 class Printer(models.Model):
     """
     Stores a single printer entry with the data (``printer_name``, ``printer_model_name``, 
-    ``printer_location``, ``ip_address``, ``department_name``, and ``snmp_version``.).
+    ``printer_location``, ``ip_address``, ``department_name``, ``snmp_version``, and ``snmp_community``.).
+
+    ``snmp_checked`` is the last time the SNMP version and community were determined for the printer.
+    ``poll_interval`` is how often the ``runpoller`` daemon polls the printer, based on its toner use. When it
+    is empty ``TIMEDELTA`` from ``settings.py`` is used.
+
+    ``breaker_state``, ``consecutive_failures``, and ``breaker_retry_at`` are the circuit breaker of the printer.
+    While the breaker is open the printer isn't polled until ``breaker_retry_at`` (see ``_poll_through_breaker`` in poller.py).
+
+    ``probe_state`` is ``'probing'`` while the SNMP settings and model of a printer added from the web interface are
+    being determined in the background (see ``run_printer_probe`` in jobs.py), and ``'failed'`` with the reason in
+    ``probe_error`` if that didn't work. Only ``'ready'`` printers are polled. ``probe_updated`` is when the probe
+    started or failed, so the printers whose probe failed or never finished are cleaned up even if nobody comes back
+    to the page (see ``clean_up_printer_probes`` in jobs.py).
+
+    ``poller_site`` is the site whose pollers poll the printer when several ``updatetonerdata --worker-id`` workers
+    share the printers (see leases.py). Empty for printers that aren't tied to a site.
     """
+    BREAKER_CLOSED = 'closed'
+    BREAKER_OPEN = 'open'
+    BREAKER_STATE_CHOICES = [
+        (BREAKER_CLOSED, 'Closed'),
+        (BREAKER_OPEN, 'Open'),
+    ]
+    PROBING = 'probing'
+    READY = 'ready'
+    FAILED = 'failed'
+    PROBE_STATE_CHOICES = [(PROBING, 'Probing'), (READY, 'Ready'), (FAILED, 'Failed')]
+
     printer_name = models.CharField(
         'Printer Name',
         max_length=75,
@@ -35,6 +69,27 @@ class Printer(models.Model):
         help_text="What department is this printer in?"
     )
     snmp_version = models.IntegerField('SNMP Version', default=1)
+    snmp_community = models.CharField('SNMP Community', max_length=50, default='public')
+    snmp_checked = models.DateTimeField('SNMP Settings Checked', null=True, blank=True)
+    poll_interval = models.DurationField('Poll Interval', null=True, blank=True)
+    breaker_state = models.CharField('Breaker State', max_length=6, choices=BREAKER_STATE_CHOICES, default=BREAKER_CLOSED)
+    consecutive_failures = models.PositiveIntegerField('Consecutive Failures', default=0)
+    breaker_retry_at = models.DateTimeField('Breaker Retry At', null=True, blank=True)
+    probe_state = models.CharField('Probe State', max_length=7, choices=PROBE_STATE_CHOICES, default=READY)
+    probe_error = models.TextField('Probe Error', blank=True)
+    probe_updated = models.DateTimeField('Probe Updated', null=True, blank=True)
+    poller_site = models.CharField(
+        'Poller Site',
+        max_length=50,
+        blank=True,
+        help_text="Only the pollers started with this site poll the printer. Leave empty if any poller can reach it."
+    )
+
+    class Meta:
+        indexes = [
+            # Order of the printers on the homepage.
+            models.Index(fields=['department_name', 'printer_name'], name='printer_department_order'),
+        ]
 
     def __str__(self):
         return self.printer_name
@@ -42,22 +97,234 @@ class Printer(models.Model):
 class TonerLevel(models.Model):
     """
     Stores a single toner level for each module in each printer using 
-    (``printer_name`` from :model:`app.Printer`, ``date_time``, ``module_deintifier``, and ``level``).
+    (``printer_name`` from :model:`app.Printer`, ``date_time``, ``last_seen``, ``module_deintifier``, and ``level``).
+
+    ``date_time`` is the first time the level was seen and ``last_seen`` the last time. When ``TONER_HISTORY_MODE``
+    in ``settings.py`` is ``'changes'``, a new row is only written when the level changes and ``last_seen`` of the
+    latest row is extended while it stays the same. With ``'samples'`` every poll writes a new row.
+    """
+    printer_name = models.ForeignKey(Printer, on_delete=models.CASCADE)
+    date_time = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now)
+    module_identifier = models.CharField(
+        max_length=50,
+        help_text="Identifier for the toners or units. Example. Magenta OR Toner Collection Unit."
+    )
+    level = models.CharField(max_length=3, help_text="This should be either a percentage (0 - 100 without the percent sign) or OK or NA.")
+
+    class Meta:
+        indexes = [
+            # History of a printer module in time order.
+            models.Index(fields=['printer_name', 'module_identifier', 'date_time'], name='tonerlevel_module_history'),
+            # Rows written by a poll and time range queries over all the printers.
+            models.Index(fields=['date_time'], name='tonerlevel_date_time'),
+            # Rows seen since the last rollup and rows old enough to be deleted.
+            models.Index(fields=['last_seen'], name='tonerlevel_last_seen'),
+        ]
+
+    def __str__(self):
+        return str(self.printer_name)
+
+class CurrentTonerLevel(models.Model):
+    """
+    Stores the latest toner level for each module in each printer using
+    (``printer_name`` from :model:`app.Printer`, ``date_time``, ``module_identifier``, and ``level``).
+
+    There is only one row per printer and module. The rows are updated by ``update_database`` every time
+    the printer is polled, so the homepage doesn't need to search the :model:`app.TonerLevel` history.
+    ``date_time`` is the last time the printer answered the poll and ``toner_level`` is the latest
+    :model:`app.TonerLevel` row of the module.
+
+    When the printer stops answering, its rows are kept with the last known levels and a "Printer seems to be off"
+    row (``PRINTER_OFF_LEVELS`` in snmp.py) is added, whose ``date_time`` is when it was first seen off.
     """
     printer_name = models.ForeignKey(Printer, on_delete=models.CASCADE)
-    date_time = models.DateTimeField(auto_now_add=True)
+    toner_level = models.ForeignKey(TonerLevel, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    date_time = models.DateTimeField()
     module_identifier = models.CharField(
         max_length=50,
         help_text="Identifier for the toners or units. Example. Magenta OR Toner Collection Unit."
     )
     level = models.CharField(max_length=3, help_text="This should be either a percentage (0 - 100 without the percent sign) or OK or NA.")
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['printer_name', 'module_identifier'], name='unique_current_toner_level'),
+        ]
+
+    def __str__(self):
+        return str(self.printer_name)
+
+class PollCycle(models.Model):
+    """
+    Stores a single entry every time toner levels are written to the database by ``update_database`` using
+    (``date_time``, ``printer_count``, and ``rows_written``).
+
+    The latest entry is the "last updated" marker of the homepage. It is read by primary key, so it doesn't
+    need to sort the :model:`app.TonerLevel` history.
+    """
+    date_time = models.DateTimeField(default=timezone.now)
+    printer_count = models.IntegerField('Printers Polled', default=0)
+    rows_written = models.IntegerField('Rows Written', default=0)
+
+    def __str__(self):
+        return str(self.date_time)
+
+class TonerLevelRollup(models.Model):
+    """
+    Stores a summary of the :model:`app.TonerLevel` history of a printer module for one hour or one day using
+    (``printer_name`` from :model:`app.Printer`, ``module_identifier``, ``period``, ``period_start``, ``min_level``,
+    ``max_level``, ``last_level``, and ``last_seen``).
+
+    The rows are created and updated by the ``rolluptonerdata`` management command. ``min_level`` and ``max_level``
+    only take percentages into account, so they are empty when the module only reported OK/Unknown levels.
+    ``last_level`` is the level seen at ``last_seen``, the latest time the module was seen in the period.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    printer_name = models.ForeignKey(Printer, on_delete=models.CASCADE)
+    module_identifier = models.CharField(
+        max_length=50,
+        help_text="Identifier for the toners or units. Example. Magenta OR Toner Collection Unit."
+    )
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    period_start = models.DateTimeField()
+    min_level = models.IntegerField(null=True, blank=True)
+    max_level = models.IntegerField(null=True, blank=True)
+    last_level = models.CharField(max_length=3)
+    last_seen = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['printer_name', 'module_identifier', 'period', 'period_start'], name='unique_toner_level_rollup'
+            ),
+        ]
+
+    def __str__(self):
+        return str(self.printer_name)
+
+class RollupWatermark(models.Model):
+    """
+    Stores how far the ``rolluptonerdata`` management command has summarized the :model:`app.TonerLevel` history.
+
+    There is only one row. :model:`app.TonerLevel` rows with a ``last_seen`` older than ``processed_until`` are
+    already in the :model:`app.TonerLevelRollup` table.
+    """
+    processed_until = models.DateTimeField()
+
+    def __str__(self):
+        return str(self.processed_until)
+
+class TonerForecast(models.Model):
+    """
+    Stores the days-until-empty estimate of a printer module (``printer_name`` from :model:`app.Printer` and
+    ``module_identifier``), so it can be shown without going through the :model:`app.TonerLevel` history.
+
+    The estimate is a least squares line over the percentage levels seen since the cartridge was put in.
+    Instead of the levels, the row keeps the sums the line is calculated from (``observations``, ``sum_t``,
+    ``sum_level``, ``sum_tt``, and ``sum_t_level``, with ``t`` in days since ``cartridge_start``), so every poll
+    only adds its level to them (see ``update_forecasts`` in forecasting.py). A level more than
+    ``FORECAST_SWAP_JUMP`` points above ``last_level`` is a new cartridge and starts the sums again.
+    Only the first and the last time each level was seen (``run_start`` and ``last_seen`` for ``last_level``)
+    are in the sums, so polling more often doesn't change the line.
+
+    ``rate`` is the percentage points used per day, and ``days_left`` and ``empty_date`` when the module will be
+    empty at that rate from ``last_level``. They are empty while there isn't enough data or the level isn't going down.
+    """
+    printer_name = models.ForeignKey(Printer, on_delete=models.CASCADE)
+    module_identifier = models.CharField(
+        max_length=50,
+        help_text="Identifier for the toners or units. Example. Magenta OR Toner Collection Unit."
+    )
+    cartridge_start = models.DateTimeField()
+    last_level = models.IntegerField()
+    last_seen = models.DateTimeField()
+    run_start = models.DateTimeField(null=True, blank=True)
+    observations = models.IntegerField(default=0)
+    sum_t = models.FloatField(default=0)
+    sum_level = models.FloatField(default=0)
+    sum_tt = models.FloatField(default=0)
+    sum_t_level = models.FloatField(default=0)
+    rate = models.FloatField('Points Per Day', null=True, blank=True)
+    days_left = models.FloatField('Days Left', null=True, blank=True)
+    empty_date = models.DateTimeField('Empty Date', null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['printer_name', 'module_identifier'], name='unique_toner_forecast'),
+        ]
+
+    def __str__(self):
+        return str(self.printer_name)
+
+class PollJob(models.Model):
+    """
+    Stores a toner refresh started from the web interface and its progress using (``status``, ``active_key``,
+    ``created``, ``updated``, ``finished``, ``printers_total``, ``printers_done``, ``printers_failed``,
+    ``rows_written``, and ``error``).
+
+    The job runs in a background thread (see jobs.py). ``active_key`` is set while the job is queued or running and
+    cleared when it ends, so the unique constraint on it only allows one active refresh at a time on every database
+    backend. ``updated`` changes with every progress update and is used to find jobs whose process died.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FINISHED, 'Finished'), (FAILED, 'Failed')]
+
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=QUEUED)
+    active_key = models.CharField(max_length=20, null=True, blank=True, unique=True)
+    created = models.DateTimeField(default=timezone.now)
+    updated = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(null=True, blank=True)
+    printers_total = models.IntegerField('Printers', default=0)
+    printers_done = models.IntegerField('Printers Done', default=0)
+    printers_failed = models.IntegerField('Printers Failed', default=0)
+    rows_written = models.IntegerField('Rows Written', default=0)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'{self.pk} ({self.status})'
+
+class PrinterLease(models.Model):
+    """
+    Stores which ``updatetonerdata`` worker is polling a printer using (``printer_name`` from :model:`app.Printer`,
+    ``worker_id``, ``expires``, and ``polled_at``).
+
+    When several workers share the printers, each one leases a batch of printers by setting ``worker_id`` and
+    ``expires``, polls them, and clears the lease when their levels are written, setting ``polled_at``. A lease
+    that is past ``expires`` (the worker died or hung) can be taken by another worker. See leases.py.
+    """
+    printer_name = models.OneToOneField(Printer, on_delete=models.CASCADE, primary_key=True, related_name='lease')
+    worker_id = models.CharField('Worker', max_length=100, blank=True)
+    expires = models.DateTimeField('Lease Expires', null=True, blank=True)
+    polled_at = models.DateTimeField('Last Polled', null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Printers that are due, least recently polled first.
+            models.Index(fields=['polled_at'], name='printerlease_polled_at'),
+        ]
+
     def __str__(self):
         return str(self.printer_name)
 
 def update_database(printer_levels_dict):
     """ Update the TonerLevel Table in the database with the information in the dictionary argument.
 
+    The printers are looked up with a single query and all the rows are inserted with ``bulk_create``
+      inside one transaction, instead of one query and one commit per module.
+    When ``TONER_HISTORY_MODE`` is ``'changes'``, modules with the same level as their latest row only get
+      that row's ``last_seen`` extended (one UPDATE for all of them) instead of a new row. Printers that were off
+      in the previous poll start new rows, so a run doesn't cover the time they were off.
+    The :model:`app.CurrentTonerLevel` and :model:`app.TonerForecast` rows of the printers are updated and
+      a :model:`app.PollCycle` is recorded in the same transaction.
+    Printers that aren't in the database anymore (deleted while they were being polled) are skipped.
+
     Args:
         printer_levels_dict (dict): Dictionary with toner levels data.
         DICTIONARY STRUCTURE:
@@ -69,15 +336,166 @@ def update_database(printer_levels_dict):
                 '8X11_2232': {...}
                 ...
             }
+
+    Returns:
+        rows_written (int): Number of :model:`app.TonerLevel` rows written.
+    """
+    # Imported here because forecasting.py imports the models, and so the models (and the migrations) don't need
+    #   easysnmp.
+    from .forecasting import update_forecasts
+    from .snmp import PRINTER_OFF_LEVELS
+
+    write_start = time.perf_counter()
+
+    now = timezone.now()
+    only_changes = settings.TONER_HISTORY_MODE == 'changes'
+
+    # The whole Printer table is small, so it is cheaper to read all of it than to filter by
+    #   hundreds of names (SQLite also limits the number of parameters in a query).
+    printer_ids = dict(Printer.objects.values_list('printer_name', 'id'))
+    polled_printer_ids = [printer_ids[printer_name] for printer_name in printer_levels_dict if printer_name in printer_ids]
+
+    with transaction.atomic():
+        current_levels = dict()
+        for printer_ids_chunk in _chunks(polled_printer_ids, IN_QUERY_CHUNK_SIZE):
+            for current_level in CurrentTonerLevel.objects.filter(printer_name_id__in=printer_ids_chunk):
+                current_levels[(current_level.printer_name_id, current_level.module_identifier)] = current_level
+
+        reported_levels = [
+            (printer_ids[printer_name], module_name, level_value)
+            for printer_name, module_level_dict in printer_levels_dict.items()
+            if printer_name in printer_ids
+            for module_name, level_value in module_level_dict.items()
+        ]
+
+        # The kept levels of these printers are from before they were off (see update_current_levels).
+        off_printer_ids = {
+            printer_id for printer_id, module_name in current_levels if module_name in PRINTER_OFF_LEVELS
+        }
+
+        toner_levels = list()
+        extended_toner_level_ids = list()
+
+        for printer_id, module_name, level_value in reported_levels:
+            current_level = current_levels.get((printer_id, module_name))
+
+            if only_changes and current_level is not None and current_level.toner_level_id is not None \
+                    and current_level.level == level_value and printer_id not in off_printer_ids:
+                extended_toner_level_ids.append(current_level.toner_level_id)
+                continue
+
+            toner_levels.append(TonerLevel(
+                # printer_name_id is used instead of `printer_name` because the TonerLevel's printer_name
+                #   field is a foreign key for the Printer model and only the id is needed.
+                printer_name_id=printer_id,
+                module_identifier=module_name,
+                level=level_value,
+                date_time=now,
+                last_seen=now
+            ))
+
+        for toner_level_ids_chunk in _chunks(extended_toner_level_ids, IN_QUERY_CHUNK_SIZE):
+            TonerLevel.objects.filter(pk__in=toner_level_ids_chunk).update(last_seen=now)
+
+        TonerLevel.objects.bulk_create(toner_levels)
+        _set_created_ids(toner_levels, now)
+
+        update_current_levels(current_levels, reported_levels, toner_levels, now)
+        update_forecasts(reported_levels, now)
+
+        # The new cycle changes the dashboard version (see caching.py) when the new levels can be read.
+        PollCycle.objects.create(date_time=now, printer_count=len(polled_printer_ids), rows_written=len(toner_levels))
+
+    METRICS.observe('db_write_seconds', time.perf_counter() - write_start, operation='update_database')
+    METRICS.inc('db_rows_written_total', len(toner_levels))
+    return len(toner_levels)
+
+def update_current_levels(current_levels, reported_levels, toner_levels, now):
+    """ Upsert the :model:`app.CurrentTonerLevel` rows of the polled printers.
+
+    Modules that are in ``reported_levels`` are updated or created and the modules that the printers
+      don't report anymore (like "Printer seems to be off" once the printer is back on) are deleted.
+    Printers that only report ``PRINTER_OFF_LEVELS`` keep the rows of their other modules as they are, so the
+      dashboard still shows the last known levels and when they were read.
+
+    Args:
+        current_levels (dict): The existing :model:`app.CurrentTonerLevel` rows of the polled printers
+            by ``(printer id, module identifier)``.
+        reported_levels (list): ``(printer id, module identifier, level)`` tuples with the new levels.
+        toner_levels (list): The :model:`app.TonerLevel` rows that were just created.
+        now (datetime): Time of the poll.
     """
-    for printer_name, module_level_dict in printer_levels_dict.items():
-        for module_name, level_value in module_level_dict.items():
-            TonerLevel.objects.create(
+    # Imported here so the models don't need easysnmp.
+    from .snmp import PRINTER_OFF_LEVELS
+
+    created_ids = {
+        (toner_level.printer_name_id, toner_level.module_identifier): toner_level.pk for toner_level in toner_levels
+    }
 
-                # This line needs to be this way instead of `printer_name = printer_name` because the
-                #   TonerLevel's printer_name field is a foreign key for the Printer model.
-                printer_name=Printer.objects.get(printer_name=printer_name),
+    levels_to_update = list()
+    levels_to_create = list()
 
+    reported_modules = dict()
+    for printer_id, module_name, _ in reported_levels:
+        reported_modules.setdefault(printer_id, set()).add(module_name)
+    off_printer_ids = {
+        printer_id for printer_id, module_names in reported_modules.items() if module_names == set(PRINTER_OFF_LEVELS)
+    }
+
+    for printer_id, module_name, level_value in reported_levels:
+        key = (printer_id, module_name)
+        current_level = current_levels.pop(key, None)
+
+        if current_level is None:
+            levels_to_create.append(CurrentTonerLevel(
+                printer_name_id=printer_id,
                 module_identifier=module_name,
-                level=level_value
-            )
+                level=level_value,
+                date_time=now,
+                toner_level_id=created_ids.get(key)
+            ))
+        elif printer_id in off_printer_ids:
+            # Still off, the row keeps the time the printer was first seen off.
+            if key in created_ids:
+                current_level.toner_level_id = created_ids[key]
+                levels_to_update.append(current_level)
+        else:
+            current_level.level = level_value
+            current_level.date_time = now
+            if key in created_ids:
+                current_level.toner_level_id = created_ids[key]
+            levels_to_update.append(current_level)
+
+    # Whatever is left wasn't reported by the printers this time, the printers that are off keep their levels.
+    levels_to_delete = [
+        current_level.pk for (printer_id, _), current_level in current_levels.items()
+        if printer_id not in off_printer_ids
+    ]
+    for levels_to_delete_chunk in _chunks(levels_to_delete, IN_QUERY_CHUNK_SIZE):
+        CurrentTonerLevel.objects.filter(pk__in=levels_to_delete_chunk).delete()
+
+    CurrentTonerLevel.objects.bulk_update(
+        levels_to_update, ['level', 'date_time', 'toner_level'], batch_size=IN_QUERY_CHUNK_SIZE
+    )
+    CurrentTonerLevel.objects.bulk_create(levels_to_create)
+
+def _set_created_ids(toner_levels, date_time):
+    """ Set the primary keys of TonerLevel rows created with ``bulk_create``.
+
+    PostgreSQL returns them from the INSERT, but SQLite doesn't, so they are read back using the
+      ``date_time`` all the rows were created with.
+    """
+    if not toner_levels or toner_levels[0].pk is not None:
+        return
+
+    created_ids = {
+        (printer_id, module_identifier): toner_level_id
+        for toner_level_id, printer_id, module_identifier in
+        TonerLevel.objects.filter(date_time=date_time).values_list('id', 'printer_name_id', 'module_identifier')
+    }
+    for toner_level in toner_levels:
+        toner_level.pk = created_ids.get((toner_level.printer_name_id, toner_level.module_identifier))
+
+def _chunks(items, size):
+    """ Split a list into lists of at most ``size`` items. """
+    return [items[position:position + size] for position in range(0, len(items), size)]
@@ -0,0 +1,448 @@
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .caching import bump_dashboard_version
+from .metrics import METRICS
+from .models import Printer, TonerLevel, IN_QUERY_CHUNK_SIZE, _chunks
+from .snmp import SNMP, PRINTER_OFF_LEVELS, determine_snmp_version
+
+# Printer fields changed by ``_poll_printer`` that need to be saved after a poll.
+POLL_STATE_FIELDS = [
+    'snmp_version', 'snmp_community', 'snmp_checked', 'breaker_state', 'consecutive_failures', 'breaker_retry_at'
+]
+
+logger = logging.getLogger(__name__)
+
+def poll_printer(printer, timeout=None):
+    """ Get the toner levels of a single printer.
+
+    If the printer doesn't answer with its saved SNMP version and community, they are determined
+      again (see ``_poll_printer``). The SNMP settings and the circuit breaker of the printer are saved
+      to the database if they changed.
+
+    Args:
+        printer (Printer): Instance of :model:`app.Printer` to poll.
+        timeout (float): Seconds to wait for each SNMP response from the printer. If ``None``, then
+            ``POLLER_PRINTER_TIMEOUT`` from ``settings.py`` is used.
+
+    Returns:
+        levels_dict (dict): Dictionary with the toner levels of the printer, the same one returned
+            by ``SNMP.get_consumable_levels()``, or ``None`` if there is nothing to store because the
+            breaker of the printer is open or it missed fewer than ``BREAKER_FAILURE_THRESHOLD`` polls.
+    """
+    levels_dict, changed = _poll_printer(printer, timeout)
+    if changed:
+        save_poll_state([printer])
+    return levels_dict
+
+def poll_printers(printers, workers=None, timeout=None, deadline=None, progress=None):
+    """ Get the toner levels of multiple printers at the same time using a thread pool.
+
+    Most of the time spent polling a printer is waiting for UDP responses (or timeouts when the
+      printer is off), so the printers are polled by ``workers`` threads instead of one after another.
+
+    Args:
+        printers (iterable): Instances of :model:`app.Printer` to poll.
+        workers (int): Number of printers polled at the same time. If ``None``, then
+            ``POLLER_WORKERS`` from ``settings.py`` is used.
+        timeout (float): Seconds to wait for each SNMP response from a printer. If ``None``, then
+            ``POLLER_PRINTER_TIMEOUT`` from ``settings.py`` is used.
+        deadline (float): Seconds the whole cycle can take. Printers that didn't finish by then are left
+            out of the returned dictionary. If ``None``, then ``POLLER_CYCLE_DEADLINE`` from ``settings.py`` is used.
+            The polls still running at the deadline can't be interrupted: their threads keep going after this
+            returns, until their SNMP requests time out (each one waits at most ``timeout`` seconds per try), and
+            their results and state changes are thrown away. The printer is polled again in the next cycle.
+        progress (callable): Optional function called with the printer and its levels (``None`` if there is
+            nothing to store) every time a printer finishes. It is called from the calling thread.
+
+    A poll that raises an exception (a printer answering with values that aren't numbers, for example) is logged
+      and counted as a poll without an answer, the other printers are still polled and saved.
+
+    Returns:
+        printer_levels_dict (dict): Dictionary with the toner levels of every printer that finished
+            before the deadline and has levels to store, ready for ``update_database``.
+        DICTIONARY STRUCTURE:
+            {
+                'PRINTER NAME': {
+                    'MODULE IDENTIFIER/TONER COLOR': 'LEVEL',
+                    'Cyan': '13', ...
+                },
+                '8X11_2232': {...}
+                ...
+            }
+        unfinished_printers (list): The printers that didn't finish before the deadline.
+    """
+    if workers is None:
+        workers = settings.POLLER_WORKERS
+    if deadline is None:
+        deadline = settings.POLLER_CYCLE_DEADLINE.total_seconds()
+
+    printer_levels_dict = dict()
+    unfinished_printers = list()
+    changed_printers = list()
+
+    printers = list(printers)
+    if not printers:
+        return printer_levels_dict, unfinished_printers
+
+    cycle_start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(printers))))
+    try:
+        futures = {executor.submit(_poll_printer, printer, timeout): printer for printer in printers}
+
+        # Future -> (levels_dict, changed) of the printers that finished.
+        results = dict()
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                results[future] = _poll_result(future, futures[future])
+                if progress is not None:
+                    progress(futures[future], results[future][0])
+        except FuturesTimeoutError:
+            pass
+        not_done = set(futures) - set(results)
+
+        # Printers that are still waiting for a free worker won't be started at all.
+        # The ones already running can't be interrupted, but their results are ignored.
+        for future in not_done:
+            future.cancel()
+
+        # Keep the same order as the printers argument so the database rows are written in a predictable order.
+        for future, printer in futures.items():
+            if future not in results:
+                unfinished_printers.append(printer)
+                continue
+
+            levels_dict, changed = results[future]
+            if levels_dict is not None:
+                printer_levels_dict[printer.printer_name] = levels_dict
+            if changed:
+                changed_printers.append(printer)
+    finally:
+        # Don't wait for the polls that are still running at the deadline, see the deadline argument.
+        executor.shutdown(wait=False)
+
+    METRICS.observe('poll_cycle_seconds', time.perf_counter() - cycle_start)
+    METRICS.inc('poll_cycle_printers_total', len(printers))
+    METRICS.inc('poll_cycle_unfinished_total', len(unfinished_printers))
+    METRICS.set('poll_cycle_last_timestamp_seconds', time.time())
+
+    # The threads don't touch the database, the new SNMP settings and breakers are saved here all at once.
+    save_poll_state(changed_printers)
+
+    return printer_levels_dict, unfinished_printers
+
+def _poll_result(future, printer):
+    """ Return the result of the ``_poll_printer`` future of a printer.
+
+    If the poll raised an exception, it is logged and the printer is counted as not answering, so a printer that
+      keeps failing ends up with its breaker open instead of raising every cycle.
+
+    Returns:
+        The same as ``_poll_printer``, ``(None, True)`` if the poll raised an exception.
+    """
+    try:
+        return future.result()
+    except Exception:
+        _record_poll_error(printer)
+        return None, True
+
+def _record_poll_error(printer):
+    """ Log the exception raised by the poll of a printer and count it as a poll without an answer.
+
+    Called from the ``except`` block, so the traceback is logged. The circuit breaker of the printer is changed,
+      so the printer needs to be saved with ``save_poll_state``.
+    """
+    logger.exception('Polling %s (%s) failed.', printer.printer_name, printer.ip_address)
+    METRICS.inc('poller_printer_failures_total', printer=printer.printer_name)
+    _record_failure(printer, timezone.now())
+
+def save_poll_state(printers):
+    """ Save the SNMP settings and the circuit breaker of the printers, which are changed by ``_poll_printer``. """
+    if printers:
+        with METRICS.timer('db_write_seconds', operation='save_poll_state'):
+            Printer.objects.bulk_update(printers, POLL_STATE_FIELDS)
+        # The dashboard shows the circuit breaker of the printers.
+        bump_dashboard_version()
+
+def poll_intervals(printer_ids, now=None):
+    """ Choose how often each printer should be polled based on how fast its toner is being used.
+
+    The rate of use of every module with percentage levels is its drop in level since it was last replaced
+      (or since ``POLL_RATE_WINDOW`` ago) divided by the time it took. The printer is polled often enough
+      that its fastest module doesn't drop more than ``POLL_LEVEL_STEP`` points between two polls, so idle
+      printers are polled every ``POLL_INTERVAL_MAX`` and busy ones more often.
+    Printers with a module at or below ``POLL_LOW_LEVEL`` are polled at least every ``TIMEDELTA``, going down
+      to ``POLL_INTERVAL_MIN`` as the module gets empty. Printers without percentage levels, or without enough
+      history to know their rate of use yet, are polled every ``TIMEDELTA``.
+
+    Args:
+        printer_ids (iterable): Ids of the :model:`app.Printer` instances.
+        now (datetime): Current time, ``timezone.now()`` if ``None``.
+
+    Returns:
+        intervals (dict): Dictionary with the printer ids as keys and the intervals (timedelta) as values.
+    """
+    if now is None:
+        now = timezone.now()
+    since = now - settings.POLL_RATE_WINDOW
+    printer_ids = list(printer_ids)
+
+    # (printer id, module identifier) -> [(time, percentage), ...] in time order.
+    observations = defaultdict(list)
+    for printer_ids_chunk in _chunks(printer_ids, IN_QUERY_CHUNK_SIZE):
+        rows = TonerLevel.objects.filter(printer_name_id__in=printer_ids_chunk, last_seen__gte=since).order_by(
+            'date_time', 'id'
+        ).values_list('printer_name', 'module_identifier', 'level', 'date_time', 'last_seen')
+
+        for printer_id, module_identifier, level, first_seen, last_seen in rows.iterator():
+            if not level.isdigit():
+                continue
+            module_observations = observations[(printer_id, module_identifier)]
+            module_observations.append((max(first_seen, since), int(level)))
+            if last_seen > first_seen:
+                module_observations.append((last_seen, int(level)))
+
+    # Printer id -> (fastest rate in points per second, longest history in seconds, lowest current level)
+    printer_usage = dict()
+    for (printer_id, _), module_observations in observations.items():
+        rate, history_seconds = _usage_rate(module_observations)
+        current_level = module_observations[-1][1]
+
+        fastest_rate, longest_history, lowest_level = printer_usage.get(printer_id, (0.0, 0.0, current_level))
+        printer_usage[printer_id] = (
+            max(fastest_rate, rate), max(longest_history, history_seconds), min(lowest_level, current_level)
+        )
+
+    intervals = dict()
+    for printer_id in printer_ids:
+        if printer_id not in printer_usage:
+            intervals[printer_id] = settings.TIMEDELTA
+            continue
+
+        fastest_rate, longest_history, lowest_level = printer_usage[printer_id]
+
+        if fastest_rate > 0:
+            interval = timedelta(seconds=settings.POLL_LEVEL_STEP / fastest_rate)
+        elif longest_history >= settings.TIMEDELTA.total_seconds():
+            interval = settings.POLL_INTERVAL_MAX
+        else:
+            interval = settings.TIMEDELTA
+
+        if lowest_level <= settings.POLL_LOW_LEVEL:
+            low_level_interval = settings.POLL_INTERVAL_MIN + \
+                (settings.TIMEDELTA - settings.POLL_INTERVAL_MIN) * (lowest_level / max(settings.POLL_LOW_LEVEL, 1))
+            interval = min(interval, low_level_interval)
+
+        intervals[printer_id] = min(max(interval, settings.POLL_INTERVAL_MIN), settings.POLL_INTERVAL_MAX)
+
+    return intervals
+
+def save_poll_intervals(printers, intervals):
+    """ Set the ``poll_interval`` of the printers from ``poll_intervals`` and save the ones that changed. """
+    changed_printers = list()
+    for printer in printers:
+        interval = intervals.get(printer.pk)
+        if interval == settings.TIMEDELTA:
+            interval = None
+
+        if printer.poll_interval != interval:
+            printer.poll_interval = interval
+            changed_printers.append(printer)
+
+    if changed_printers:
+        Printer.objects.bulk_update(changed_printers, ['poll_interval'])
+
+class PollSchedule:
+    """ Keeps track of when each printer is due to be polled by the ``runpoller`` daemon.
+
+    Every printer has its own due time, measured with ``time.monotonic()`` so changes to the system clock
+      don't bunch up or delay the polls. New printers are spread over the first interval instead of all being
+      polled at once when the daemon starts. Printers are polled every ``interval`` seconds until they get
+      their own interval with ``set_interval``.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        # Printer id -> monotonic time the printer is due to be polled.
+        self.next_poll = dict()
+        # Printer id -> monotonic time the last poll of the printer started.
+        self.last_started = dict()
+        # Printer id -> seconds between polls, for the printers that don't use the default interval.
+        self.intervals = dict()
+
+    def sync(self, printer_ids, now):
+        """ Add the printers that are new and forget the ones that were deleted. """
+        printer_ids = list(printer_ids)
+
+        for printer_id in set(self.next_poll) - set(printer_ids):
+            del self.next_poll[printer_id]
+            self.last_started.pop(printer_id, None)
+            self.intervals.pop(printer_id, None)
+
+        new_printer_ids = [printer_id for printer_id in printer_ids if printer_id not in self.next_poll]
+        for position, printer_id in enumerate(new_printer_ids):
+            self.next_poll[printer_id] = now + self.interval * position / len(new_printer_ids)
+
+    def due(self, now, busy=()):
+        """ Return the ids of the printers that are due, oldest first, leaving out the ones in ``busy``. """
+        due_printers = [
+            (due_time, printer_id) for printer_id, due_time in self.next_poll.items()
+            if due_time <= now and printer_id not in busy
+        ]
+        return [printer_id for _, printer_id in sorted(due_printers)]
+
+    def started(self, printer_id, now):
+        """ Schedule the next poll of a printer one interval after this one started. """
+        self.last_started[printer_id] = now
+        self.next_poll[printer_id] = now + self.intervals.get(printer_id, self.interval)
+
+    def set_interval(self, printer_id, interval):
+        """ Change the seconds between the polls of a printer, moving its next poll if it was polled before. """
+        if printer_id not in self.next_poll:
+            return
+
+        self.intervals[printer_id] = interval
+        if printer_id in self.last_started:
+            self.next_poll[printer_id] = self.last_started[printer_id] + interval
+
+def _poll_printer(printer, timeout):
+    """ Poll a printer with ``_poll_through_breaker`` and record how long it took and if it didn't answer.
+
+    Returns:
+        The same as ``_poll_through_breaker``.
+    """
+    failures_before = printer.consecutive_failures
+    start = time.perf_counter()
+    try:
+        return _poll_through_breaker(printer, timeout)
+    finally:
+        METRICS.observe('poller_printer_seconds', time.perf_counter() - start, printer=printer.printer_name)
+        if printer.consecutive_failures > failures_before:
+            METRICS.inc('poller_printer_failures_total', printer=printer.printer_name)
+
+def _poll_through_breaker(printer, timeout):
+    """ Get the toner levels of a printer, going through its circuit breaker and determining its SNMP settings again if needed.
+
+    Circuit breaker:
+        Closed: The printer is polled. After ``BREAKER_FAILURE_THRESHOLD`` polls in a row without an answer the
+            breaker opens and ``PRINTER_OFF_LEVELS`` are returned once, so only the change is stored. The polls
+            that fail before that return ``None`` and nothing is stored for them.
+        Open: The printer isn't polled until ``breaker_retry_at`` and ``None`` is returned.
+        Half-open (open and ``breaker_retry_at`` has passed): A single sysUpTime GET is sent first. If it doesn't
+            answer, the breaker stays open with twice the wait (up to ``BREAKER_BACKOFF_MAX``). If it does, the
+            printer is polled and the breaker closes when the levels come back.
+
+    When the printer doesn't answer with the saved SNMP version and community, and they haven't
+      been checked in the last ``SNMP_RECHECK_INTERVAL``, ``determine_snmp_version`` is called again.
+    If a different version or community works (a firmware upgrade can change them), the printer
+      instance is updated and polled again. The database isn't touched here because this runs in the
+      worker threads.
+
+    Args:
+        printer (Printer): Instance of :model:`app.Printer` to poll.
+        timeout (float): Seconds to wait for each SNMP response from the printer.
+
+    Returns:
+        levels_dict (dict): Dictionary with the toner levels of the printer, or ``None`` if there is nothing to store.
+        changed (bool): ``True`` if the SNMP settings or the breaker of the printer changed and need to be saved.
+    """
+    if timeout is None:
+        timeout = settings.POLLER_PRINTER_TIMEOUT
+
+    now = timezone.now()
+    state_before = [getattr(printer, field) for field in POLL_STATE_FIELDS]
+
+    def changed():
+        return state_before != [getattr(printer, field) for field in POLL_STATE_FIELDS]
+
+    if printer.breaker_state == Printer.BREAKER_OPEN:
+        if printer.breaker_retry_at is not None and now < printer.breaker_retry_at:
+            return None, False
+
+        probe = SNMP(printer.ip_address, printer.snmp_version, printer.snmp_community, timeout=timeout, retries=0)
+        if not probe.is_reachable() and not _recheck_snmp_settings(printer, timeout, now):
+            _record_failure(printer, now)
+            return None, changed()
+
+    levels_dict = _get_levels(printer, timeout)
+    if levels_dict == PRINTER_OFF_LEVELS and _recheck_snmp_settings(printer, timeout, now):
+        levels_dict = _get_levels(printer, timeout)
+
+    if levels_dict != PRINTER_OFF_LEVELS:
+        printer.breaker_state = Printer.BREAKER_CLOSED
+        printer.consecutive_failures = 0
+        printer.breaker_retry_at = None
+        return levels_dict, changed()
+
+    if _record_failure(printer, now):
+        return levels_dict, True
+    return None, changed()
+
+def _recheck_snmp_settings(printer, timeout, now):
+    """ Determine the SNMP settings of a printer again if they weren't checked in the last ``SNMP_RECHECK_INTERVAL``.
+
+    Returns:
+        bool: ``True`` if a different SNMP version or community works and the printer instance was updated.
+    """
+    if printer.snmp_checked is not None and now - printer.snmp_checked < settings.SNMP_RECHECK_INTERVAL:
+        return False
+
+    printer.snmp_checked = now
+    version, community = determine_snmp_version(printer.ip_address, timeout=timeout, retries=settings.POLLER_RETRIES)
+
+    if version > 0 and (version, community) != (printer.snmp_version, printer.snmp_community):
+        printer.snmp_version = version
+        printer.snmp_community = community
+        return True
+    return False
+
+def _record_failure(printer, now):
+    """ Count a poll without an answer and open (or reopen) the breaker of the printer when needed.
+
+    Returns:
+        bool: ``True`` if the breaker was closed and just opened.
+    """
+    was_open = printer.breaker_state == Printer.BREAKER_OPEN
+    printer.consecutive_failures += 1
+
+    if not was_open and printer.consecutive_failures < settings.BREAKER_FAILURE_THRESHOLD:
+        return False
+
+    retries = printer.consecutive_failures - settings.BREAKER_FAILURE_THRESHOLD
+    printer.breaker_state = Printer.BREAKER_OPEN
+    printer.breaker_retry_at = now + min(settings.BREAKER_BACKOFF * 2 ** min(retries, 16), settings.BREAKER_BACKOFF_MAX)
+    return not was_open
+
+def _get_levels(printer, timeout):
+    """ Get the toner levels of a printer with its saved SNMP settings.
+
+    The SNMP session comes from ``SESSION_POOL``, so a long-running poller doesn't open a new session every poll.
+    """
+    snmp = SNMP(
+        printer.ip_address, printer.snmp_version, printer.snmp_community,
+        timeout=timeout, retries=settings.POLLER_RETRIES
+    )
+    return snmp.get_consumable_levels()
+
+def _usage_rate(module_observations):
+    """ Return the rate a module is being used at (points per second) and how many seconds of history it is based on.
+
+    Only the observations since the level last went up (the toner was replaced) are used.
+    """
+    start = 0
+    for position in range(1, len(module_observations)):
+        if module_observations[position][1] > module_observations[position - 1][1]:
+            start = position
+
+    first_time, first_level = module_observations[start]
+    last_time, last_level = module_observations[-1]
+    history_seconds = (last_time - first_time).total_seconds()
+
+    if history_seconds <= 0 or last_level >= first_level:
+        return 0.0, history_seconds
+    return (first_level - last_level) / history_seconds, history_seconds
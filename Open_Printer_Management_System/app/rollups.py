@@ -0,0 +1,235 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    Printer, TonerLevel, TonerLevelRollup, CurrentTonerLevel, RollupWatermark, PollCycle, IN_QUERY_CHUNK_SIZE, _chunks
+)
+
+def rollup_history():
+    """ Summarize the :model:`app.TonerLevel` rows seen since the last run into hourly and daily rollups.
+
+    Every row is a level that was seen at ``date_time`` and again at ``last_seen`` (the same time when
+      ``TONER_HISTORY_MODE`` is ``'samples'``). Those observations are added to the min/max/last of the
+      hour and day they happened in. Min, max, and last give the same result when an observation is added
+      twice, so rows whose ``last_seen`` was extended after the last run are simply added again.
+
+    The next run starts from ``ROLLUP_SAFETY_LAG`` before this one started, not from when it started: the pollers
+      stamp the rows before their transaction commits, so a row stamped before this run started can become visible
+      after it read the history. Those rows would never be summarized, and ``delete_old_history`` would delete them.
+
+    Each printer is summarized in its own transaction so the web process isn't locked out for long.
+
+    Returns:
+        rollups_written (int): Number of :model:`app.TonerLevelRollup` rows created or updated.
+    """
+    run_started = timezone.now()
+
+    watermark = RollupWatermark.objects.first()
+    processed_until = watermark.processed_until if watermark else None
+
+    new_rows = TonerLevel.objects.all()
+    if processed_until is not None:
+        new_rows = new_rows.filter(last_seen__gt=processed_until)
+
+    rollups_written = 0
+    printer_ids = list(new_rows.values_list('printer_name', flat=True).distinct().order_by())
+
+    for printer_id in printer_ids:
+        with transaction.atomic():
+            rollups_written += _rollup_printer(new_rows.filter(printer_name_id=printer_id), printer_id, processed_until)
+
+    safe_until = run_started - settings.ROLLUP_SAFETY_LAG
+    if watermark is None:
+        RollupWatermark.objects.create(processed_until=safe_until)
+    elif safe_until > watermark.processed_until:
+        watermark.processed_until = safe_until
+        watermark.save()
+
+    return rollups_written
+
+def delete_old_history(cutoff, chunk_size=IN_QUERY_CHUNK_SIZE, pause=0.1):
+    """ Delete :model:`app.TonerLevel` rows last seen before ``cutoff`` in small chunks.
+
+    Only rows that have already been summarized by ``rollup_history`` are deleted, and the latest row of each
+      printer module (the one :model:`app.CurrentTonerLevel` points to) is always kept. Every chunk is deleted in
+      its own transaction with a pause between them, so SQLite doesn't stay locked for the web process.
+
+    Args:
+        cutoff (datetime): Rows last seen before this are deleted.
+        chunk_size (int): Number of rows deleted per transaction.
+        pause (float): Seconds to wait between chunks.
+
+    Returns:
+        rows_deleted (int): Number of :model:`app.TonerLevel` rows deleted.
+    """
+    watermark = RollupWatermark.objects.first()
+    if watermark is None:
+        return 0
+    cutoff = min(cutoff, watermark.processed_until)
+
+    old_rows = TonerLevel.objects.filter(last_seen__lt=cutoff).exclude(
+        pk__in=CurrentTonerLevel.objects.filter(toner_level__isnull=False).values('toner_level')
+    )
+
+    rows_deleted = 0
+    while True:
+        ids_to_delete = list(old_rows.values_list('id', flat=True)[:chunk_size])
+        if not ids_to_delete:
+            break
+
+        TonerLevel.objects.filter(id__in=ids_to_delete).delete()
+        rows_deleted += len(ids_to_delete)
+
+        if pause:
+            time.sleep(pause)
+
+    return rows_deleted
+
+def delete_old_poll_cycles(cutoff):
+    """ Delete the :model:`app.PollCycle` rows recorded before ``cutoff``.
+
+    ``update_database`` records one every time it is called, so ``runpoller`` adds one every few seconds. The
+      latest one is always kept, the dashboard shows it and its id is part of the dashboard version (see
+      caching.py).
+
+    Returns:
+        cycles_deleted (int): Number of :model:`app.PollCycle` rows deleted.
+    """
+    latest_cycle_id = PollCycle.objects.order_by('-pk').values_list('pk', flat=True).first()
+    if latest_cycle_id is None:
+        return 0
+    cycles_deleted, _ = PollCycle.objects.filter(date_time__lt=cutoff).exclude(pk=latest_cycle_id).delete()
+    return cycles_deleted
+
+def compact_history():
+    """ Merge the consecutive :model:`app.TonerLevel` rows of every printer module that have the same level.
+
+    The history written with ``TONER_HISTORY_MODE`` set to ``'samples'`` (or before the runs) has a row for every
+      poll. Every run of rows with the same level is merged into its first row, which gets the latest ``last_seen``
+      of the run, the way ``update_database`` writes them in ``'changes'`` mode. The :model:`app.CurrentTonerLevel`
+      rows are pointed to the last run of their module, so the pollers keep extending it. Running it again doesn't
+      change anything.
+
+    Each printer is compacted in its own transaction so it doesn't hold a single huge transaction on big databases.
+
+    Returns:
+        rows_deleted (int): Number of :model:`app.TonerLevel` rows merged into the run before them.
+    """
+    rows_deleted = 0
+
+    for printer_id in Printer.objects.values_list('id', flat=True):
+        with transaction.atomic():
+            rows = TonerLevel.objects.filter(printer_name_id=printer_id).order_by(
+                'module_identifier', 'date_time', 'id'
+            ).values_list('id', 'module_identifier', 'level', 'last_seen')
+
+            extended_runs = dict()
+            ids_to_delete = list()
+            last_run_ids = dict()
+            run = None
+
+            for toner_level_id, module_identifier, level, last_seen in rows.iterator():
+                if run is not None and run['module_identifier'] == module_identifier and run['level'] == level:
+                    if last_seen > run['last_seen']:
+                        run['last_seen'] = extended_runs[run['id']] = last_seen
+                    ids_to_delete.append(toner_level_id)
+                else:
+                    run = {'id': toner_level_id, 'module_identifier': module_identifier, 'level': level, 'last_seen': last_seen}
+                    last_run_ids[module_identifier] = toner_level_id
+
+            TonerLevel.objects.bulk_update(
+                [TonerLevel(id=toner_level_id, last_seen=last_seen) for toner_level_id, last_seen in extended_runs.items()],
+                ['last_seen'], batch_size=IN_QUERY_CHUNK_SIZE
+            )
+
+            current_levels = list(CurrentTonerLevel.objects.filter(printer_name_id=printer_id))
+            for current_level in current_levels:
+                current_level.toner_level_id = last_run_ids.get(current_level.module_identifier)
+            CurrentTonerLevel.objects.bulk_update(current_levels, ['toner_level'], batch_size=IN_QUERY_CHUNK_SIZE)
+
+            for ids_to_delete_chunk in _chunks(ids_to_delete, IN_QUERY_CHUNK_SIZE):
+                TonerLevel.objects.filter(id__in=ids_to_delete_chunk).delete()
+            rows_deleted += len(ids_to_delete)
+
+    return rows_deleted
+
+def period_start(date_time, period):
+    """ Return the start of the hour or day (in the local time zone) that ``date_time`` is in. """
+    local_time = timezone.localtime(date_time).replace(minute=0, second=0, microsecond=0)
+    if period == TonerLevelRollup.DAY:
+        local_time = local_time.replace(hour=0)
+    return local_time
+
+def _rollup_printer(rows, printer_id, processed_until):
+    """ Add the observations of the rows of a single printer to its rollups. """
+    rollups = dict()
+
+    for module_identifier, level, first_seen, last_seen in rows.values_list(
+            'module_identifier', 'level', 'date_time', 'last_seen').iterator():
+        observations = [last_seen]
+        if processed_until is None or first_seen > processed_until:
+            observations.append(first_seen)
+
+        for observed_at in observations:
+            for period in (TonerLevelRollup.HOUR, TonerLevelRollup.DAY):
+                key = (module_identifier, period, period_start(observed_at, period))
+                rollup = rollups.get(key)
+                if rollup is None:
+                    rollup = rollups[key] = TonerLevelRollup(
+                        printer_name_id=printer_id, module_identifier=module_identifier, period=period,
+                        period_start=key[2], last_level=level, last_seen=observed_at
+                    )
+                _add_observation(rollup, level, observed_at)
+
+    if not rollups:
+        return 0
+
+    # Merge with the rollups that already exist for the same periods.
+    earliest_start = min(key[2] for key in rollups)
+    existing_rollups = TonerLevelRollup.objects.filter(printer_name_id=printer_id, period_start__gte=earliest_start)
+
+    rollups_to_update = list()
+    for existing in existing_rollups:
+        rollup = rollups.pop((existing.module_identifier, existing.period, existing.period_start), None)
+        if rollup is None:
+            continue
+
+        _merge_rollups(existing, rollup)
+        rollups_to_update.append(existing)
+
+    TonerLevelRollup.objects.bulk_update(
+        rollups_to_update, ['min_level', 'max_level', 'last_level', 'last_seen'], batch_size=IN_QUERY_CHUNK_SIZE
+    )
+    TonerLevelRollup.objects.bulk_create(rollups.values(), batch_size=IN_QUERY_CHUNK_SIZE)
+
+    return len(rollups_to_update) + len(rollups)
+
+def _add_observation(rollup, level, observed_at):
+    """ Add a level seen at ``observed_at`` to the min/max/last of the rollup. """
+    try:
+        _add_percentage(rollup, int(level))
+    except ValueError:
+        pass
+
+    if observed_at >= rollup.last_seen:
+        rollup.last_level = level
+        rollup.last_seen = observed_at
+
+def _merge_rollups(existing, rollup):
+    """ Add the min/max/last of ``rollup`` to the ``existing`` rollup of the same period. """
+    for percentage in (rollup.min_level, rollup.max_level):
+        if percentage is not None:
+            _add_percentage(existing, percentage)
+
+    if rollup.last_seen >= existing.last_seen:
+        existing.last_level = rollup.last_level
+        existing.last_seen = rollup.last_seen
+
+def _add_percentage(rollup, percentage):
+    if rollup.min_level is None or percentage < rollup.min_level:
+        rollup.min_level = percentage
+    if rollup.max_level is None or percentage > rollup.max_level:
+        rollup.max_level = percentage
@@ -2,28 +2,237 @@
 # pip install easysnmp
 from django.conf import settings
 
+import logging
 import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from easysnmp import Session
 from easysnmp.exceptions import EasySNMPTimeoutError, EasySNMPConnectionError, EasySNMPNoSuchNameError, EasySNMPError
 
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Printer-MIB columns used to get the toner levels.
+# The supply table (prtMarkerSuppliesTable) columns share the same row indexes, the colorant
+#   table (prtMarkerColorantTable) is read using the same indexes as the supply table.
+SUPPLY_DESCRIPTION_OID = ".1.3.6.1.2.1.43.11.1.1.6.1"
+SUPPLY_MAX_CAPACITY_OID = ".1.3.6.1.2.1.43.11.1.1.8.1"
+SUPPLY_LEVEL_OID = ".1.3.6.1.2.1.43.11.1.1.9.1"
+COLORANT_VALUE_OID = ".1.3.6.1.2.1.43.12.1.1.4.1"
+
+# sysUpTime, read with a single GET to check if a printer that was off answers again.
+SYS_UPTIME_OID = ".1.3.6.1.2.1.1.3.0"
+
+# System group values read when discovering printers: sysDescr, sysName, and sysLocation.
+SYS_DESCRIPTION_OID = ".1.3.6.1.2.1.1.1.0"
+SYS_NAME_OID = ".1.3.6.1.2.1.1.5.0"
+SYS_LOCATION_OID = ".1.3.6.1.2.1.1.6.0"
+
+# SNMP v2/v3 values that mean that there is nothing else to read in a column.
+END_OF_COLUMN_TYPES = ('ENDOFMIBVIEW', 'NOSUCHOBJECT', 'NOSUCHINSTANCE')
+
+# Levels returned by ``SNMP.get_consumable_levels()`` when the printer doesn't answer.
+# The text in this dictionary is checked in the template, so don't change it
+#   without changing the template's if statement as well.
+PRINTER_OFF_LEVELS = {"Printer seems to be off": "Not on"}
+
+# Seconds to keep waiting for a higher SNMP version after a lower one answered when probing a printer.
+# Agents that support more than one version answer all of them at about the same time.
+PROBE_GRACE_PERIOD = 0.25
+
+
+class SessionPool:
+    """ Process-wide pool of ``easysnmp.Session`` instances that are reused instead of creating one for every request.
+
+    Creating a session parses the MIBs and opens a socket, which costs more CPU than polling a printer.
+    Sessions are kept by (hostname, version, community, timeout, retries) and a session is only used by one
+      thread at a time: it is taken out of the pool by ``acquire`` and put back by ``release``.
+
+    Failed sessions: a session that raised a timeout, connection, or unexpected error is discarded instead of being
+      put back, so the next request to that printer starts with a new one. An SNMP v1 NoSuchName error is a normal
+      answer and doesn't discard the session.
+
+    Health check: a session that was idle for ``check_after`` seconds or more is checked with a sysUpTime GET
+      before it is handed out. If the printer doesn't answer the check the session is discarded and a new one is
+      created, so a session that went stale while it was idle doesn't turn into a failed poll. A printer that is
+      off pays for the check once, after that its session is discarded by the failed request and the next one is new.
+
+    Idle eviction: sessions that weren't used for ``idle_timeout`` seconds are closed, and when there are more than
+      ``max_size`` idle sessions the least recently used ones are closed, so a big fleet doesn't run out of sockets.
+
+    Args:
+        max_size (int): Maximum number of idle sessions kept in the pool.
+        idle_timeout (float): Seconds an idle session is kept.
+        check_after (float): Seconds a session can be idle before it is checked on ``acquire``.
+
+    Attributes:
+        max_idle_per_key (int): Maximum number of idle sessions kept for the same key.
+        hits (int): Number of sessions taken from the pool.
+        misses (int): Number of sessions that had to be created.
+        discarded (int): Number of sessions discarded after an error or a failed health check.
+    """
+    max_idle_per_key = 2
+
+    def __init__(self, max_size, idle_timeout, check_after):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+        self._lock = threading.Lock()
+        # Key -> [(session, monotonic time it was released), ...], least recently released key first.
+        self._idle = OrderedDict()
+        self._idle_count = 0
+
+    @staticmethod
+    def key(hostname, version, community, timeout, retries):
+        return (hostname, version, community, timeout, retries)
+
+    def acquire(self, key):
+        """ Take an idle session for the key out of the pool, or create a new one if there isn't any.
+
+        A session that was idle for ``check_after`` seconds or more is only returned if it passes the health check.
+        """
+        session = None
+        with self._lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+
+            sessions = self._idle.get(key)
+            if sessions:
+                session, released = sessions.pop()
+                self._idle_count -= 1
+                if not sessions:
+                    del self._idle[key]
+
+        # The check is done outside of the lock, it can take as long as a request to the printer.
+        if session is not None and (now - released < self.check_after or self._is_healthy(session)):
+            with self._lock:
+                self.hits += 1
+            return session
+
+        with self._lock:
+            if session is not None:
+                self.discarded += 1
+            self.misses += 1
+
+        hostname, version, community, timeout, retries = key
+        # use_numeric is needed so the returned OIDs can be compared with the column OIDs.
+        return Session(
+            hostname=hostname, community=community, version=version, timeout=timeout, retries=retries,
+            use_numeric=True
+        )
+
+    def release(self, key, session, healthy=True):
+        """ Put a session back into the pool, or discard it if it isn't healthy. """
+        if not healthy:
+            with self._lock:
+                self.discarded += 1
+            return
+
+        with self._lock:
+            sessions = self._idle.setdefault(key, list())
+            self._idle.move_to_end(key)
+            if len(sessions) >= self.max_idle_per_key:
+                return
+            sessions.append((session, time.monotonic()))
+            self._idle_count += 1
+
+            while self._idle_count > self.max_size:
+                oldest_key, oldest_sessions = next(iter(self._idle.items()))
+                oldest_sessions.pop(0)
+                self._idle_count -= 1
+                if not oldest_sessions:
+                    del self._idle[oldest_key]
+
+    @contextmanager
+    def session(self, hostname, version, community='public', timeout=1, retries=3):
+        """ Context manager that acquires a session and releases it at the end, discarding it after an error. """
+        key = self.key(hostname, version, community, timeout, retries)
+        session = self.acquire(key)
+        try:
+            yield session
+        except EasySNMPNoSuchNameError:
+            self.release(key, session)
+            raise
+        except BaseException:
+            self.release(key, session, healthy=False)
+            raise
+        self.release(key, session)
+
+    def clear(self):
+        """ Close all the idle sessions. """
+        with self._lock:
+            self._idle.clear()
+            self._idle_count = 0
+
+    @staticmethod
+    def _is_healthy(session):
+        # Any answer means the session works, even an error like NoSuchName from an SNMP v1 agent.
+        try:
+            session.get(SYS_UPTIME_OID)
+        except (SystemError, EasySNMPTimeoutError, EasySNMPConnectionError):
+            return False
+        except EasySNMPError:
+            pass
+        return True
+
+    def _evict_idle(self, now):
+        # Every session is checked, the order of the keys only follows the last release of each key,
+        #   and the older sessions of a key can be stale while its newest one is still fresh.
+        cutoff = now - self.idle_timeout
+        for key in list(self._idle):
+            sessions = self._idle[key]
+            fresh_sessions = [(session, released) for session, released in sessions if released >= cutoff]
+            if len(fresh_sessions) == len(sessions):
+                continue
+            self._idle_count -= len(sessions) - len(fresh_sessions)
+            if fresh_sessions:
+                self._idle[key] = fresh_sessions
+            else:
+                del self._idle[key]
+
+# Sessions used by everything that talks to the printers in this process (poller, adding printers, and discovery).
+SESSION_POOL = SessionPool(
+    settings.SNMP_SESSION_POOL_SIZE, settings.SNMP_SESSION_IDLE_TIMEOUT.total_seconds(),
+    settings.SNMP_SESSION_CHECK_AFTER.total_seconds()
+)
+
+
 class SNMP:
     """ 
 
     Args:
         hostname (str): IPv4 address for the printer.
         version (int): SNMP version for the printer.
+        community (str): SNMP community for the printer.
+        timeout (float): Seconds to wait for each SNMP response.
+        retries (int): Number of times a request is retried after a timeout.
 
     Attributes:
         hostname (str): IPv4 address for the printer.
         version (int): SNMP version for the printer.
-        session (easysnmp.Session): SNMP session for the printer with the given hostname and version.
+        community (str): SNMP community for the printer.
+        session (easysnmp.Session): SNMP session taken from ``SESSION_POOL`` while a request is being made,
+            ``None`` the rest of the time.
+        max_repetitions (int): Number of rows of each column asked for in a single GETBULK request.
     """
-    def __init__(self, hostname, version):
-        """ Initialize attributes and SNMP Session. """
+    max_repetitions = 10
+
+    def __init__(self, hostname, version, community='public', timeout=1, retries=3):
+        """ Initialize attributes. The SNMP session is taken from ``SESSION_POOL`` for each request. """
         self.hostname = hostname
         self.version = version
-
-        self.session = Session(hostname=self.hostname, community='public', version=self.version)
+        self.community = community
+        self.timeout = timeout
+        self.retries = retries
+        self.session = None
 
     def get_consumable_levels(self):
         """ Create a dictionary with the toner levels of a printer ready to update the database.
@@ -39,34 +248,36 @@ class SNMP:
                     ...
                 }
         """
-        # Try to get a list of the last value of the oid by walking the supply description oid.
-        # Some printers or copiers, Konica mainly, don't have the oids in in numerical order.
+        # Read the supply and colorant columns all at the same time instead of one GET per value.
+        # Some printers or copiers, Konica mainly, don't have the oids in in numerical order, so the
+        #   row indexes are taken from the supply description column.
         # Example: .1.3.6.1.2.1.43.11.1.1.6.1.1, .1.3.6.1.2.1.43.11.1.1.6.1.4, .1.3.6.1.2.1.43.11.1.1.6.1.8
         try:
-            oids = [oid.oid[-1] for oid in self.session.walk(".1.3.6.1.2.1.43.11.1.1.6.1")]
+            table = self.walk_columns(
+                [SUPPLY_DESCRIPTION_OID, SUPPLY_MAX_CAPACITY_OID, SUPPLY_LEVEL_OID, COLORANT_VALUE_OID]
+            )
         except (SystemError, EasySNMPTimeoutError, EasySNMPConnectionError):
-
-            # The text in this dictionary is checked in the template, so don't change it
-            #   without changing the template's if statement as well.
-            consumables_dict = {"Printer seems to be off": "Not on"}
-            return consumables_dict                    
+            return dict(PRINTER_OFF_LEVELS)
 
         consumables_dict = dict()
 
-        for oid in oids:
-            try:
-                # Get the colorant name.
-                # Doing this so that the supply name is only `Black` instead of `Canon GPR-55 Black Toner`
-                supply_name = self.session.get(".1.3.6.1.2.1.43.12.1.1.4.1." + oid).value
-            except EasySNMPNoSuchNameError:
-                # In my testing, I have only gotten to this exception on a Canon copier.
-                # It happens because there is no colorant name for waste toners or drum units.
-                continue
+        for index, supply_description in table[SUPPLY_DESCRIPTION_OID].items():
+            # Get the colorant name.
+            # Doing this so that the supply name is only `Black` instead of `Canon GPR-55 Black Toner`
+            supply_name = table[COLORANT_VALUE_OID].get(index)
+            if supply_name is None:
+                # In my testing, this only happens on a Canon copier because there is no colorant name for
+                #   waste toners or drum units.
+                # SNMP v1 used to raise EasySNMPNoSuchNameError for these supplies and they were skipped,
+                #   v2/v3 used to return NOSUCHINSTANCE and the supply description was used instead.
+                if self.version == 1:
+                    continue
+                supply_name = "NOSUCHINSTANCE"
 
-            # Supply description example: `Canon GPR-55 Black Toner`
-            supply_description = self.session.get(".1.3.6.1.2.1.43.11.1.1.6.1." + oid).value
-            supply_max_capacity = self.session.get(".1.3.6.1.2.1.43.11.1.1.8.1." + oid).value
-            supply_level = self.session.get(".1.3.6.1.2.1.43.11.1.1.9.1." + oid).value
+            supply_max_capacity = table[SUPPLY_MAX_CAPACITY_OID].get(index)
+            supply_level = table[SUPPLY_LEVEL_OID].get(index)
+            if supply_max_capacity is None or supply_level is None:
+                continue
 
             # Sometimes the supply description is in hexadecimal.
             # This tries to convert hex to ascii if that is the case.
@@ -90,43 +301,300 @@ class SNMP:
 
         return consumables_dict
 
+    def is_reachable(self):
+        """ Return ``True`` if the printer answers a single GET for its sysUpTime.
+
+        This is much cheaper than ``get_consumable_levels()`` when the printer is off, because only one
+          request times out instead of one per column.
+        """
+        try:
+            with self.pooled_session():
+                self._request('get', SYS_UPTIME_OID, [SYS_UPTIME_OID])
+        except EasySNMPNoSuchNameError:
+            # An SNMP v1 error response still means that the printer is on.
+            return True
+        except (SystemError, EasySNMPTimeoutError, EasySNMPConnectionError, EasySNMPError):
+            return False
+        return True
+
+    def walk_columns(self, columns):
+        """ Walk multiple table columns at the same time.
+
+        Every request asks for the next values of all the columns that haven't been fully read yet.
+        SNMP v2/v3 use GETBULK, so a table with ``n`` rows takes about ``n / max_repetitions`` round-trips.
+        SNMP v1 doesn't have GETBULK, so it uses a GETNEXT with all the columns, one round-trip per row.
 
-def determine_snmp_version(hostname):
-    """ Function to get the SNMP version through brute force.
+        Args:
+            columns (list): Numeric OIDs of the table columns (with the leading dot).
+
+        Returns:
+            table (dict): Dictionary with the values of each column by row index.
+            DICTIONARY STRUCTURE:
+                {
+                    'COLUMN OID': {
+                        'ROW INDEX': 'VALUE',
+                        '1': 'Canon GPR-55 Black Toner', ...
+                    },
+                    ...
+                }
+        """
+        table = {column: dict() for column in columns}
+
+        # Last OID read of each column that hasn't been fully read yet.
+        cursors = {column: column for column in columns}
+
+        with self.pooled_session():
+            self._walk(table, cursors)
+
+        return table
+
+    @contextmanager
+    def pooled_session(self):
+        """ Set ``self.session`` to a session from ``SESSION_POOL`` until the end of the with block.
+
+        If the instance already has a session (a request made inside another one), that one is used.
+        """
+        if self.session is not None:
+            yield self.session
+            return
+
+        with SESSION_POOL.session(self.hostname, self.version, self.community, self.timeout, self.retries) as session:
+            self.session = session
+            try:
+                yield session
+            finally:
+                self.session = None
+
+    def _walk(self, table, cursors):
+        """ Fill the table with the columns of the cursors (see ``walk_columns``) using ``self.session``. """
+        while cursors:
+            active_columns = list(cursors)
+            requested_oids = [cursors[column] for column in active_columns]
+
+            if self.version == 1:
+                variables = self._get_next(requested_oids, active_columns)
+            else:
+                variables = self._request(
+                    'get_bulk', requested_oids, active_columns, max_repetitions=self.max_repetitions
+                )
+
+            if not variables:
+                break
+
+            # The response has one value per requested column for every repetition, in the same order as the request.
+            for position, variable in enumerate(variables):
+                column = active_columns[position % len(active_columns)]
+                if column not in cursors:
+                    continue
+
+                oid = _full_oid(variable) if variable is not None else None
+
+                # The column is finished when the agent returns a value from the next column/table or the end of the MIB.
+                if oid is None or variable.snmp_type in END_OF_COLUMN_TYPES or not oid.startswith(column + "."):
+                    del cursors[column]
+                    continue
+
+                # An agent that returns the same or a lower OID would be asked for it again forever,
+                #   so the column is finished there (like the -Cc check of net-snmp's snmpwalk).
+                if _oid_key(oid) <= _oid_key(cursors[column]):
+                    logger.warning(
+                        '%s returned %s after %s, the OIDs of the column %s are not increasing.',
+                        self.hostname, oid, cursors[column], column
+                    )
+                    del cursors[column]
+                    continue
+
+                table[column][oid[len(column) + 1:]] = variable.value
+                cursors[column] = oid
+
+    def _get_next(self, oids, columns):
+        """ SNMP v1 GETNEXT for multiple OIDs, ``columns`` are the table columns of the OIDs.
+
+        With SNMP v1 a single OID at the end of the MIB makes the agent reject the whole request,
+          so if that happens the OIDs are requested one at a time and the ones without a next value are ``None``.
+        """
+        try:
+            return self._request('get_next', oids, columns)
+        except EasySNMPNoSuchNameError:
+            variables = list()
+            for oid, column in zip(oids, columns):
+                try:
+                    variables.append(self._request('get_next', oid, [column]))
+                except EasySNMPNoSuchNameError:
+                    variables.append(None)
+            return variables
+
+    def _request(self, operation, oids, columns, **kwargs):
+        """ Make an SNMP request with ``self.session`` and record its latency, timeouts, and NoSuchName errors.
+
+        Args:
+            operation (str): Name of the ``easysnmp.Session`` method (``get``, ``get_next``, or ``get_bulk``).
+            oids (str or list): OIDs of the request.
+            columns (list): Table columns (or OIDs) the metrics are recorded for. A walk asks for a different row
+                every request, so the metrics are kept by column instead of by OID.
+        """
+        start = time.perf_counter()
+        try:
+            return getattr(self.session, operation)(oids, **kwargs)
+        except EasySNMPTimeoutError:
+            for column in columns:
+                METRICS.inc('snmp_timeouts_total', operation=operation, oid=column)
+            raise
+        except EasySNMPNoSuchNameError:
+            for column in columns:
+                METRICS.inc('snmp_nosuchname_total', operation=operation, oid=column)
+            raise
+        finally:
+            METRICS.observe_many(
+                'snmp_request_seconds', time.perf_counter() - start,
+                [{'operation': operation, 'oid': column} for column in columns]
+            )
+
+
+def _full_oid(variable):
+    """ Join the OID and index of an ``easysnmp.SNMPVariable`` into a single numeric OID with a leading dot. """
+    oid = variable.oid
+    if variable.oid_index:
+        oid = f"{oid}.{variable.oid_index}"
+    if not oid.startswith("."):
+        oid = "." + oid
+    return oid
+
+def _oid_key(oid):
+    """ Return a numeric OID as a tuple of ints, so OIDs are compared by their numbers instead of as text. """
+    return tuple(int(number) for number in oid.strip(".").split("."))
+
+def determine_snmp_version(hostname, communities=None, timeout=1, retries=1, executor=None):
+    """ Function to get the SNMP version and community through brute force.
     
-    The function tries to get the printer's description using version 3. If it
-    fails, then try with version 2. If that fails, then try with version 1. Finally
-    if that fails, then the printer may be off or the system's firmware may be too
-    old to support SNMP.
+    The function tries to get the printer's description using version 3, and versions 2 and 1
+    with every community in ``SNMP_COMMUNITIES`` from ``settings.py``, all at the same time.
+    The first combination that answers is used, waiting ``PROBE_GRACE_PERIOD`` seconds longer
+    for a higher version if a lower one answered first. If none of them answers, then the printer
+    may be off or the system's firmware may be too old to support SNMP.
+
+    A printer that is off only costs one timeout instead of one per version.
 
     Args:
         hostname (str): IPv4 address for the printer.
+        communities (list): SNMP communities to try. If ``None``, then ``SNMP_COMMUNITIES``
+            from ``settings.py`` is used.
+        timeout (float): Seconds to wait for each SNMP response.
+        retries (int): Number of times a request is retried after a timeout.
+        executor (ThreadPoolExecutor): Executor the attempts are run in, shared by all the probes of a network scan
+            (see ``scan_networks`` in discovery.py). If ``None``, an executor is created for this printer.
     
     Returns:
         version (int): If positive, SNMP version of the printer. If negative, printer is off / unexpected error.
+        community (str): SNMP community that worked for the printer. ``None`` if the version is negative.
     """
-    version = -1
+    if communities is None:
+        communities = settings.SNMP_COMMUNITIES
+
+    # Version 3 doesn't use the community, so it is only tried once (see ``snmp_attempt_count``).
+    attempts = [(3, communities[0])] + [(version, community) for version in (2, 1) for community in communities]
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=len(attempts))
+    pending = dict()
+    try:
+        pending = {
+            executor.submit(_probe_snmp, hostname, version, community, timeout, retries): (version, community)
+            for version, community in attempts
+        }
+        found = None
+
+        while pending:
+            if found is None:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            else:
+                # Only wait a little longer for the higher versions that haven't answered yet.
+                higher = [future for future in pending if pending[future][0] > found[0]]
+                if not higher:
+                    break
+                done, _ = wait(higher, timeout=PROBE_GRACE_PERIOD, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+
+            for future in done:
+                attempt = pending.pop(future)
+                if future.result() and (found is None or attempt[0] > found[0]):
+                    found = attempt
+    finally:
+        # Attempts that haven't started aren't needed anymore. The ones waiting for a timeout finish in the background.
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False)
+
+    if found is None:
+        return -1, None
+    return found
+
+def snmp_attempt_count(communities=None):
+    """ Return the number of version and community combinations ``determine_snmp_version`` tries at the same time. """
+    if communities is None:
+        communities = settings.SNMP_COMMUNITIES
+    return 1 + 2 * len(communities)
 
+def _probe_snmp(hostname, version, community, timeout, retries):
+    """ Return ``True`` if the printer answers a request for its description with the given version and community. """
     try:
-        session = Session(hostname=hostname, community='public', version=3, retries=1)
-        description = session.get('.1.3.6.1.2.1.1.1.0')
-        version = 3
-    except (EasySNMPTimeoutError, EasySNMPError):
+        with SESSION_POOL.session(hostname, version, community, timeout, retries) as session:
+            session.get(SYS_DESCRIPTION_OID)
+    except (SystemError, EasySNMPTimeoutError, EasySNMPConnectionError, EasySNMPError):
+        return False
+    return True
+
+def describe_device(hostname, version, community='public', timeout=1, retries=3):
+    """ Get the system description, name, and location of a device and check if it has the Printer-MIB.
+
+    Used when discovering printers, so switches and other SNMP devices in the same network aren't added.
+
+    Args:
+        hostname (str): IPv4 address for the device.
+        version (int): SNMP version for the device.
+        community (str): SNMP community for the device.
+        timeout (float): Seconds to wait for each SNMP response.
+        retries (int): Number of times a request is retried after a timeout.
+
+    Returns:
+        description (dict): Dictionary with the system data, ``None`` if the device didn't answer.
+        DICTIONARY STRUCTURE:
+            {
+                'description': 'HP ETHERNET MULTI-ENVIRONMENT',
+                'name': 'NPI1A2B3C',
+                'location': 'Building 8 Room 45',
+                'is_printer': True
+            }
+    """
+    def read(request, oid):
+        # SNMP v1 agents answer a missing value with an error instead of a NOSUCH* value.
         try:
-            session = Session(hostname=hostname, community='public', version=2, retries=1)
-            description = session.get('.1.3.6.1.2.1.1.1.0')
-            version = 2
-        except (EasySNMPTimeoutError, EasySNMPError):
-            try:
-                session = Session(hostname=hostname, community='public', version=1, retries=1)
-                description = session.get('.1.3.6.1.2.1.1.1.0')
-                version = 1
-            except (SystemError, EasySNMPTimeoutError, EasySNMPConnectionError, EasySNMPError):
-                version = -1
+            variable = request(oid)
+        except EasySNMPNoSuchNameError:
+            return None
+        return None if variable.snmp_type in END_OF_COLUMN_TYPES else variable
+
+    try:
+        with SESSION_POOL.session(hostname, version, community, timeout, retries) as session:
+            description, name, location = [
+                read(session.get, oid) for oid in (SYS_DESCRIPTION_OID, SYS_NAME_OID, SYS_LOCATION_OID)
+            ]
+            supply = read(session.get_next, SUPPLY_DESCRIPTION_OID)
+    except (SystemError, EasySNMPTimeoutError, EasySNMPConnectionError, EasySNMPError):
+        return None
 
-    return version
+    return {
+        'description': str(description.value) if description else '',
+        'name': str(name.value) if name else '',
+        'location': str(location.value) if location else '',
+        # The first supply description only exists on devices with the Printer-MIB.
+        'is_printer': supply is not None and _full_oid(supply).startswith(SUPPLY_DESCRIPTION_OID + '.'),
+    }
 
-def determine_printer_model(hostname, version):
+def determine_printer_model(hostname, version, community='public', timeout=1, retries=3):
     """ Get the printer's model name from the SNMP data.
 
     The function tries to get the printer's model name through the SNMP data.
@@ -136,21 +604,26 @@ def determine_printer_model(hostname, version):
       printer is too old and/or it needs a firmware update to have all the SNMP access.
 
     Args:
-        hostname (str):
-        version (int):
+        hostname (str): IPv4 address for the printer.
+        version (int): SNMP version for the printer.
+        community (str): SNMP community for the printer.
+        timeout (float): Seconds to wait for each SNMP response.
+        retries (int): Number of times a request is retried after a timeout.
     
     Returns:
         printer_model_name (str): A string with the printer's models name retrieved
             from SNMP.
         Negative int: -2 = unspecified error.
-                      -3 = SNMP data not given (printer/firmware too old).
+                      -3 = SNMP data not given (printer/firmware too old, or the agent answered with an error).
     """
-    session = Session(hostname=hostname, community='public', version=version)
-
     try:
-        printer_model_name = session.get('.1.3.6.1.2.1.25.3.2.1.3.1').value
-    except SystemError:
+        with SESSION_POOL.session(hostname, version, community, timeout, retries) as session:
+            printer_model_name = session.get('.1.3.6.1.2.1.25.3.2.1.3.1').value
+    except (SystemError, EasySNMPTimeoutError, EasySNMPConnectionError):
         return -2
+    except EasySNMPError:
+        # The printer answered, but not with the model (unknown object, undeterminable type, v1 NoSuchName, ...).
+        return -3
 
     # If the SNMP data gives 'NOSUCHINSTANCE' that means that the firmware of
     #   the printer needs to be updated or the printer is too old.
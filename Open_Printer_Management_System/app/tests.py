@@ -1,3 +1,1524 @@
-from django.test import TestCase
+import io
+import math
+import multiprocessing
+import os
+import random
+import tempfile
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from easysnmp.exceptions import EasySNMPTimeoutError, EasySNMPUnknownObjectIDError, EasySNMPNoSuchNameError
+
+from . import agentfarm
+from .agentfarm import (
+    MibView, SimulatedAgent, run_farm, walk_paths, tlv, encode_integer, encode_oid, decode_oid, decode_integer,
+    read_tlv, INTEGER, OCTET_STRING, NULL, SEQUENCE, OBJECT_IDENTIFIER, NO_SUCH_INSTANCE, END_OF_MIB_VIEW,
+    GET_REQUEST, GET_NEXT_REQUEST, GET_BULK_REQUEST, NO_SUCH_NAME, MAX_BULK_VARIABLES
+)
+from .caching import bump_dashboard_version
+from .forecasting import FORECAST_FIELDS, refit_forecasts
+from .jobs import REFRESH_JOB_KEY, start_refresh_job, run_printer_probe, clean_up_printer_probes
+from .leases import ensure_leases, lease_printers, held_printer_ids, release_printers
+from .management.commands import runpoller
+from .metrics import MetricsRegistry, read_metrics
+from .models import (
+    Printer, PrinterLease, TonerLevel, CurrentTonerLevel, PollCycle, PollJob, TonerForecast, TonerLevelRollup,
+    RollupWatermark, update_database
+)
+from .poller import poll_printer, _poll_through_breaker
+from .rollups import compact_history, rollup_history, delete_old_history
+from .snmp import (
+    SNMP, SESSION_POOL, SessionPool, SUPPLY_DESCRIPTION_OID, SUPPLY_LEVEL_OID, SYS_UPTIME_OID, PRINTER_OFF_LEVELS,
+    determine_printer_model
+)
+from .views import group_dashboard, render_dashboard
+
+SUPPLY_DESCRIPTION = agentfarm.parse_oid(SUPPLY_DESCRIPTION_OID)
+SUPPLY_LEVEL = agentfarm.parse_oid(SUPPLY_LEVEL_OID)
+SUPPLY_MAX_CAPACITY = agentfarm.SUPPLY_MAX_CAPACITY_PREFIX
+COLORANT_VALUE = (1, 3, 6, 1, 2, 1, 43, 12, 1, 1, 4, 1)
+
+# Row of the supply table of every supply in the recorded walks, by the name ``get_consumable_levels`` gives it.
+WALK_SUPPLIES = {
+    'canon_imagerunner_advance_c5535': {'Black': 1, 'Cyan': 2, 'Magenta': 3, 'Yellow': 4, 'Waste Toner': 5},
+    'hp_color_laserjet_m553': {
+        'Black': 1, 'Cyan': 2, 'Magenta': 3, 'Yellow': 4, 'Fuser Kit HP 110V-B5L35A, 220V-B5L36A': 5
+    },
+    'konica_minolta_bizhub_c458': {
+        'Cyan': 1, 'Magenta': 2, 'Yellow': 3, 'Black': 4, 'Drum Cartridge (Black)': 8, 'Waste Toner Box': 9,
+        'Transfer Belt Unit': 10
+    },
+}
+
+# Seed of the levels of the simulated printers.
+FARM_SEED = 7
+
+class ForecastTests(TestCase):
+    """ ``update_forecasts`` (one poll at a time) and ``refit_forecasts`` (from the history) give the same forecasts. """
+
+    def setUp(self):
+        self.printer = create_printer('8X11_2232', '10.20.3.4')
+
+    def poll_history(self, days, seed):
+        """ Write ``days`` of polls of a printer with irregular intervals, an old cartridge, a swap, and a time it was off. """
+        generator = random.Random(seed)
+        now = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        end = now + timedelta(days=days)
+        black = 10.0
+        cyan = 80.0
+
+        while now < end:
+            days_left = (end - now).total_seconds() / 86400
+            if days / 3 < days_left < days / 3 + 1:
+                levels = {'Printer seems to be off': 'Not on'}
+            else:
+                levels = {'Black': str(int(black)), 'Cyan': str(int(cyan)), 'Waste Toner Box': 'OK'}
+
+            with mock.patch('django.utils.timezone.now', return_value=now):
+                update_database({self.printer.printer_name: levels})
+
+            # Polled every few minutes to a few hours, like the adaptive intervals of the pollers.
+            interval = timedelta(minutes=generator.choice([5, 15, 60, 240]))
+            now += interval
+            black -= interval.total_seconds() / 86400 * 0.8
+            cyan -= interval.total_seconds() / 86400 * 1.7
+            if black < 2:
+                black = 100.0
+
+    def assert_refit_matches(self):
+        incremental = {
+            forecast.module_identifier: forecast for forecast in TonerForecast.objects.filter(printer_name=self.printer)
+        }
+        self.assertEqual(refit_forecasts([self.printer.pk]), len(incremental))
+        refit = {
+            forecast.module_identifier: forecast for forecast in TonerForecast.objects.filter(printer_name=self.printer)
+        }
+
+        self.assertEqual(sorted(refit), ['Black', 'Cyan'])
+        self.assertEqual(sorted(incremental), sorted(refit))
+        for module_identifier, forecast in refit.items():
+            for field in FORECAST_FIELDS:
+                expected = getattr(forecast, field)
+                actual = getattr(incremental[module_identifier], field)
+                with self.subTest(module=module_identifier, field=field):
+                    if isinstance(expected, float):
+                        self.assertAlmostEqual(actual, expected, delta=1e-6 * max(abs(expected), 1))
+                    elif isinstance(expected, datetime) and field == 'empty_date':
+                        # Calculated from the rounded days left.
+                        self.assertAlmostEqual(actual, expected, delta=timedelta(milliseconds=1))
+                    else:
+                        self.assertEqual(actual, expected)
+
+        self.assertIsNotNone(refit['Cyan'].days_left)
+
+    @override_settings(TONER_HISTORY_MODE='changes')
+    def test_refit_matches_incremental_changes_mode(self):
+        self.poll_history(30, seed=1)
+        self.assert_refit_matches()
+
+    @override_settings(TONER_HISTORY_MODE='samples')
+    def test_refit_matches_incremental_samples_mode(self):
+        self.poll_history(12, seed=2)
+        self.assert_refit_matches()
+
+    @override_settings(TONER_HISTORY_MODE='changes')
+    def test_poll_frequency_does_not_change_the_forecast(self):
+        start = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+
+        def forecast_after(printer, minutes):
+            for step in range(int(10 * 1440 / minutes) + 1):
+                now = start + timedelta(minutes=step * minutes)
+                level = 90 - int((now - start).total_seconds() / 86400)
+                with mock.patch('django.utils.timezone.now', return_value=now):
+                    update_database({printer.printer_name: {'Black': str(level)}})
+            return TonerForecast.objects.get(printer_name=printer, module_identifier='Black')
+
+        often = forecast_after(self.printer, 10)
+        rarely = forecast_after(create_printer('8X11_1125', '10.20.3.5'), 120)
+        # Two observations per level, only the last time each level was seen differs a little.
+        self.assertEqual(often.observations, rarely.observations)
+        self.assertEqual(often.observations, 21)
+        self.assertAlmostEqual(often.rate, rarely.rate, delta=0.01)
+        self.assertAlmostEqual(often.rate, 1.0, delta=0.05)
+
+def create_printer(printer_name, ip_address, **fields):
+    fields = {
+        'printer_model_name': 'HP LaserJet m402dn', 'printer_location': 'Building 8 Room 45', 'department_name': 'IT',
+        **fields
+    }
+    return Printer.objects.create(printer_name=printer_name, ip_address=ip_address, **fields)
+
+class SimulatedAgentTests(SimpleTestCase):
+    """ ``SimulatedAgent.respond`` answers GET, GETNEXT, and GETBULK from a recorded walk like a printer. """
+
+    def setUp(self):
+        self.view = MibView.from_walk(walk_path('konica_minolta_bizhub_c458'))
+        self.agent = SimulatedAgent(self.view, {1, 2}, 'public', 0, 0, 0, [0, 0], random.Random(1))
+
+    def respond(self, version, pdu_type, oids, **kwargs):
+        return decode_response(self.agent.respond(encode_request(version, pdu_type, oids, **kwargs)))
+
+    def test_get(self):
+        error_status, _, variables = self.respond(1, GET_REQUEST, [SUPPLY_LEVEL + (8,), SUPPLY_LEVEL + (5,)])
+        self.assertEqual(error_status, 0)
+        self.assertEqual(variables[0], (SUPPLY_LEVEL + (8,), INTEGER, 55))
+        self.assertEqual(variables[1], (SUPPLY_LEVEL + (5,), NO_SUCH_INSTANCE, b''))
+
+        # SNMP v1 rejects the whole request.
+        error_status, error_index, _ = self.respond(0, GET_REQUEST, [SUPPLY_LEVEL + (8,), SUPPLY_LEVEL + (5,)])
+        self.assertEqual((error_status, error_index), (NO_SUCH_NAME, 2))
+
+    def test_getnext_pages_through_a_column(self):
+        rows = list()
+        oid = SUPPLY_DESCRIPTION
+        while True:
+            _, _, [(oid, _, value)] = self.respond(0, GET_NEXT_REQUEST, [oid])
+            if oid[:len(SUPPLY_DESCRIPTION)] != SUPPLY_DESCRIPTION:
+                break
+            rows.append((oid[-1], value))
+
+        self.assertEqual([row for row, _ in rows], [1, 2, 3, 4, 8, 9, 10])
+        self.assertEqual(rows[4], (8, b'Drum Cartridge (Black)'))
+
+    def test_getnext_at_the_end_of_the_mib(self):
+        last_oid = self.view.oids[-1]
+        error_status, error_index, _ = self.respond(0, GET_NEXT_REQUEST, [SUPPLY_LEVEL, last_oid])
+        self.assertEqual((error_status, error_index), (NO_SUCH_NAME, 2))
+
+        _, _, variables = self.respond(1, GET_NEXT_REQUEST, [last_oid])
+        self.assertEqual(variables, [(last_oid, END_OF_MIB_VIEW, b'')])
+
+    def test_getbulk_pages_through_columns_in_repetition_order(self):
+        cursors = [SUPPLY_DESCRIPTION, SUPPLY_LEVEL]
+        _, _, variables = self.respond(1, GET_BULK_REQUEST, cursors, max_repetitions=3)
+        self.assertEqual([oid for oid, _, _ in variables], [
+            SUPPLY_DESCRIPTION + (1,), SUPPLY_LEVEL + (1,), SUPPLY_DESCRIPTION + (2,), SUPPLY_LEVEL + (2,),
+            SUPPLY_DESCRIPTION + (3,), SUPPLY_LEVEL + (3,)
+        ])
+
+        # The next page starts after the last row of every column.
+        _, _, variables = self.respond(1, GET_BULK_REQUEST, [oid for oid, _, _ in variables[-2:]], max_repetitions=3)
+        self.assertEqual([oid[-1] for oid, _, _ in variables], [4, 4, 8, 8, 9, 9])
+        self.assertEqual(variables[-1], (SUPPLY_LEVEL + (9,), INTEGER, -3))
+
+    def test_getbulk_non_repeaters(self):
+        _, _, variables = self.respond(
+            1, GET_BULK_REQUEST, [(1, 3, 6, 1, 2, 1, 1, 5), SUPPLY_LEVEL], non_repeaters=1, max_repetitions=2
+        )
+        self.assertEqual([oid for oid, _, _ in variables], [
+            (1, 3, 6, 1, 2, 1, 1, 5, 0), SUPPLY_LEVEL + (1,), SUPPLY_LEVEL + (2,)
+        ])
+
+    def test_getbulk_is_limited(self):
+        _, _, variables = self.respond(1, GET_BULK_REQUEST, [(1, 3, 6, 1, 2, 1)], max_repetitions=1000)
+        self.assertEqual(len(variables), MAX_BULK_VARIABLES)
+
+        # Past the end of the MIB the agent stops repeating.
+        _, _, variables = self.respond(1, GET_BULK_REQUEST, [self.view.oids[-2]], max_repetitions=10)
+        self.assertEqual(variables[-1], (self.view.oids[-1], END_OF_MIB_VIEW, b''))
+        self.assertEqual(len(variables), 2)
+
+    def test_getbulk_with_snmp_v1_is_a_getnext(self):
+        _, _, variables = self.respond(0, GET_BULK_REQUEST, [SUPPLY_LEVEL], max_repetitions=5)
+        self.assertEqual([oid for oid, _, _ in variables], [SUPPLY_LEVEL + (1,)])
+
+    def test_other_versions_and_communities_are_ignored(self):
+        agent = SimulatedAgent(self.view, {2}, 'public', 0, 0, 0, [0, 0], random.Random(1))
+        self.assertIsNone(agent.respond(encode_request(0, GET_REQUEST, [SUPPLY_LEVEL + (1,)])))
+        self.assertIsNone(agent.respond(encode_request(1, GET_REQUEST, [SUPPLY_LEVEL + (1,)], community=b'private')))
+        self.assertIsNotNone(agent.respond(encode_request(1, GET_REQUEST, [SUPPLY_LEVEL + (1,)])))
+
+class FarmPollingTests(SimpleTestCase):
+    """ ``SNMP`` reads the toner levels of the simulated printers of ``run_farm`` with SNMP v1 and v2c. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.paths = walk_paths()
+        cls.farms = {version: SimulatedFarm(cls.paths, len(cls.paths), version, 39400 + 10 * version) for version in (1, 2)}
+
+    @classmethod
+    def tearDownClass(cls):
+        for farm in cls.farms.values():
+            farm.stop()
+        SESSION_POOL.clear()
+        super().tearDownClass()
+
+    def test_walks(self):
+        self.assertEqual([walk_name(path) for path in self.paths], sorted(WALK_SUPPLIES))
+
+    def assert_consumable_levels(self, version):
+        farm = self.farms[version]
+        for number, path in enumerate(self.paths):
+            with self.subTest(walk=walk_name(path)):
+                levels = SNMP(farm.address(number), version, timeout=1, retries=1).get_consumable_levels()
+                self.assertEqual(levels, expected_levels(farm.views[number], walk_name(path), version))
+
+    def test_consumable_levels_snmp_v1(self):
+        self.assert_consumable_levels(1)
+        # The supplies without a colorant are skipped with SNMP v1.
+        self.assertEqual(sorted(expected_levels(self.farms[1].views[2], 'konica_minolta_bizhub_c458', 1)), [
+            'Black', 'Cyan', 'Magenta', 'Yellow'
+        ])
+
+    def test_consumable_levels_snmp_v2c(self):
+        self.assert_consumable_levels(2)
+
+    def test_walk_columns_pages_with_getnext_and_getbulk(self):
+        columns = [SUPPLY_DESCRIPTION_OID, SUPPLY_LEVEL_OID]
+        konica = self.paths.index(walk_path('konica_minolta_bizhub_c458'))
+
+        for version in (1, 2):
+            farm = self.farms[version]
+            snmp = SNMP(farm.address(konica), version, timeout=1, retries=0)
+            snmp.max_repetitions = 3
+
+            requests_before = farm.requests(konica)
+            table = snmp.walk_columns(columns)
+            requests = farm.requests(konica) - requests_before
+
+            with self.subTest(version=version):
+                view = farm.views[konica]
+                self.assertEqual(list(table[SUPPLY_DESCRIPTION_OID]), ['1', '2', '3', '4', '8', '9', '10'])
+                self.assertEqual(table[SUPPLY_DESCRIPTION_OID]['10'], 'Transfer Belt Unit')
+                self.assertEqual(table[SUPPLY_LEVEL_OID], {
+                    str(row): str(decode_integer(view.get(SUPPLY_LEVEL + (row,))[2:])) for row in (1, 2, 3, 4, 8, 9, 10)
+                })
+                # 7 rows and the end of the columns: one GETNEXT per row with v1, 3 rows per GETBULK with v2c.
+                self.assertEqual(requests, 8 if version == 1 else math.ceil(8 / 3))
+
+class UpdateTonerDataTests(TestCase):
+    """ ``updatetonerdata`` polls the simulated printers and saves their levels. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.paths = walk_paths()
+        cls.farm = SimulatedFarm(cls.paths, 2 * len(cls.paths), 2, 39440)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.farm.stop()
+        SESSION_POOL.clear()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings_override = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            METRICS_FILE=os.path.join(self.directory.name, 'metrics.json'), TONER_HISTORY_MODE='changes',
+            POLLER_RETRIES=0, BREAKER_FAILURE_THRESHOLD=2,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.printers = [
+            create_printer(f'SIM_{number:02d}', self.farm.address(number), snmp_version=2)
+            for number in range(self.farm.agent_count)
+        ]
+        # Nothing listens on this port.
+        self.off_printer = create_printer('SIM_OFF', '127.0.0.1:39439', snmp_version=2)
+
+    def update(self):
+        stdout = io.StringIO()
+        call_command('updatetonerdata', workers=4, timeout=0.5, stdout=stdout, stderr=io.StringIO())
+        return stdout.getvalue()
+
+    def test_update(self):
+        output = self.update()
+        self.assertIn(f'Polled {len(self.printers) + 1} printers', output)
+
+        supply_count = 0
+        for number, printer in enumerate(self.printers):
+            expected = expected_levels(self.farm.views[number], walk_name(self.paths[number % len(self.paths)]), 2)
+            supply_count += len(expected)
+            current_levels = dict(
+                CurrentTonerLevel.objects.filter(printer_name=printer).values_list('module_identifier', 'level')
+            )
+            self.assertEqual(current_levels, expected)
+
+        self.assertEqual(TonerLevel.objects.count(), supply_count)
+        self.assertEqual(PollCycle.objects.get().printer_count, len(self.printers))
+
+        # The printer that is off missed its first poll, nothing is stored until its breaker opens.
+        self.off_printer.refresh_from_db()
+        self.assertEqual(self.off_printer.consecutive_failures, 1)
+        self.assertFalse(CurrentTonerLevel.objects.filter(printer_name=self.off_printer).exists())
+
+        # The levels didn't change, so the rows are only seen again. The second missed poll opens the breaker of
+        #   the printer that is off, which stores its off level.
+        first_seen = TonerLevel.objects.order_by('pk').values_list('last_seen', flat=True).first()
+        self.update()
+        self.assertEqual(TonerLevel.objects.exclude(printer_name=self.off_printer).count(), supply_count)
+        self.assertGreater(TonerLevel.objects.order_by('pk').values_list('last_seen', flat=True).first(), first_seen)
+        self.assertEqual(
+            list(CurrentTonerLevel.objects.filter(printer_name=self.off_printer).values_list('module_identifier', flat=True)),
+            ['Printer seems to be off']
+        )
+        self.assertEqual(PollCycle.objects.count(), 2)
+
+        # Percentage supplies get a forecast.
+        self.assertTrue(TonerForecast.objects.filter(printer_name=self.printers[0], module_identifier='Black').exists())
+
+class SimulatedFarm:
+    """ Simulated printers of ``run_farm`` running in their own process, like in ``benchmarkpolling``. """
+
+    def __init__(self, paths, agent_count, version, base_port):
+        self.agent_count = agent_count
+        self.base_port = base_port
+        self.counters = multiprocessing.Array('q', agent_count * 2, lock=False)
+        self._stop = multiprocessing.Event()
+        ready = multiprocessing.Event()
+
+        self.process = multiprocessing.Process(target=run_farm, daemon=True, args=(
+            paths, agent_count, '127.0.0.1', base_port, {version}, 'public', 0, 0, 0, FARM_SEED, self.counters,
+            ready, self._stop
+        ))
+        self.process.start()
+        if not ready.wait(timeout=30):
+            self.stop()
+            raise RuntimeError(f'The simulated printers did not start, check that the ports from {base_port} are free.')
+
+        # The same levels as the farm, which uses the walks one after another with the same seed.
+        generator = random.Random(FARM_SEED)
+        walk_views = [MibView.from_walk(path) for path in paths]
+        self.views = [walk_views[number % len(paths)].with_random_levels(generator) for number in range(agent_count)]
+
+    def address(self, number):
+        return f'127.0.0.1:{self.base_port + number}'
+
+    def requests(self, number):
+        return self.counters[number * 2]
+
+    def stop(self):
+        self._stop.set()
+        self.process.join(timeout=10)
+
+def expected_levels(view, walk, version):
+    """ Return the levels ``get_consumable_levels`` should read from a simulated printer with the view. """
+    levels = dict()
+    for name, row in WALK_SUPPLIES[walk].items():
+        if version == 1 and view.get(COLORANT_VALUE + (row,)) is None:
+            continue
+        level = decode_integer(view.get(SUPPLY_LEVEL + (row,))[2:])
+        max_capacity = decode_integer(view.get(SUPPLY_MAX_CAPACITY + (row,))[2:])
+        levels[name] = {-3: 'OK', -2: 'Unknown'}.get(level) or '{:.0f}'.format(level / max_capacity * 100)
+    return levels
+
+def walk_path(walk):
+    return os.path.join(agentfarm.WALKS_DIRECTORY, f'{walk}.snmpwalk')
+
+def walk_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+def encode_request(version, pdu_type, oids, community=b'public', request_id=1, non_repeaters=0, max_repetitions=0):
+    """ Encode an SNMP v1 (``version`` 0) or v2c (1) request for the OIDs (tuples of ints). """
+    variable_list = b''.join(tlv(SEQUENCE, tlv(OBJECT_IDENTIFIER, encode_oid(oid)) + tlv(NULL, b'')) for oid in oids)
+    pdu = tlv(pdu_type, b''.join((
+        tlv(INTEGER, encode_integer(request_id)),
+        tlv(INTEGER, encode_integer(non_repeaters)),
+        tlv(INTEGER, encode_integer(max_repetitions)),
+        tlv(SEQUENCE, variable_list),
+    )))
+    return tlv(SEQUENCE, tlv(INTEGER, encode_integer(version)) + tlv(OCTET_STRING, community) + pdu)
+
+def decode_response(data):
+    """ Return the error status, error index, and ``(OID, tag, value)`` of every variable of an SNMP response.
+
+    Integers are decoded, the other values are the BER bytes.
+    """
+    _, message, _ = read_tlv(data, 0)
+    _, _, position = read_tlv(message, 0)
+    _, _, position = read_tlv(message, position)
+    _, pdu, _ = read_tlv(message, position)
+
+    _, _, position = read_tlv(pdu, 0)
+    _, error_status, position = read_tlv(pdu, position)
+    _, error_index, position = read_tlv(pdu, position)
+    _, variable_list, _ = read_tlv(pdu, position)
+
+    variables = list()
+    position = 0
+    while position < len(variable_list):
+        _, variable, position = read_tlv(variable_list, position)
+        _, oid, value_position = read_tlv(variable, 0)
+        tag, value, _ = read_tlv(variable, value_position)
+        variables.append((decode_oid(oid), tag, decode_integer(value) if tag == INTEGER else value))
+    return decode_integer(error_status), decode_integer(error_index), variables
+
+class WalkColumnsTests(SimpleTestCase):
+    """ ``SNMP.walk_columns`` stops reading a column when the agent doesn't return increasing OIDs. """
+
+    def walk(self, responses, version=2):
+        snmp = SNMP('10.20.3.4', version)
+        snmp.session = ScriptedSession(responses)
+        with self.assertLogs('app.snmp', 'WARNING') as logs:
+            table = snmp.walk_columns([SUPPLY_DESCRIPTION_OID, SUPPLY_LEVEL_OID])
+        return table, snmp.session.requests, logs.output
+
+    def test_repeated_oid_ends_the_column(self):
+        table, requests, logs = self.walk([
+            [variable(SUPPLY_DESCRIPTION_OID + '.1', 'Black'), variable(SUPPLY_LEVEL_OID + '.1', '40')],
+            [variable(SUPPLY_DESCRIPTION_OID + '.1', 'Black'), variable(SUPPLY_LEVEL_OID + '.2', '50')],
+            [variable(SUPPLY_LEVEL_OID + '.3', '60')],
+            [variable('.1.3.6.1.2.1.43.11.1.1.10.1.1', '0')],
+        ])
+        self.assertEqual(table, {SUPPLY_DESCRIPTION_OID: {'1': 'Black'}, SUPPLY_LEVEL_OID: {'1': '40', '2': '50', '3': '60'}})
+        self.assertEqual(requests, 4)
+        self.assertEqual(len(logs), 1)
+
+    def test_lower_oid_ends_the_column(self):
+        # .10 sorts before .9 as text, so the OIDs are compared by their numbers.
+        table, _, _ = self.walk([
+            [variable(SUPPLY_DESCRIPTION_OID + '.9', 'Black'), variable(SUPPLY_LEVEL_OID + '.9', '40')],
+            [variable(SUPPLY_DESCRIPTION_OID + '.10', 'Cyan'), variable(SUPPLY_LEVEL_OID + '.2', '50')],
+            [variable('.1.3.6.1.2.1.43.11.1.1.7.1.1', '0')],
+        ], version=1)
+        self.assertEqual(table, {
+            SUPPLY_DESCRIPTION_OID: {'9': 'Black', '10': 'Cyan'}, SUPPLY_LEVEL_OID: {'9': '40'}
+        })
+
+class ScriptedSession:
+    """ Stand-in for ``easysnmp.Session`` that answers every GETNEXT or GETBULK with the next list of variables. """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def get_next(self, oids):
+        return self.get_bulk(oids)
+
+    def get_bulk(self, oids, max_repetitions=None):
+        self.requests += 1
+        return self.responses.pop(0)
+
+def variable(oid, value, snmp_type='OCTETSTR'):
+    """ Return an ``easysnmp.SNMPVariable`` lookalike for a numeric OID. """
+    oid, oid_index = oid.rsplit('.', 1)
+    return SimpleNamespace(oid=oid, oid_index=oid_index, value=value, snmp_type=snmp_type)
+
+class DeterminePrinterModelTests(SimpleTestCase):
+    """ ``determine_printer_model`` turns the errors of the agent into its negative return values. """
+
+    def determine_printer_model(self, error):
+        session = mock.Mock(**{'get.side_effect': error})
+        with mock.patch.object(SESSION_POOL, 'acquire', return_value=session):
+            return determine_printer_model('10.20.3.4', 2)
+
+    def test_timeout_is_an_unexpected_error(self):
+        self.assertEqual(self.determine_printer_model(EasySNMPTimeoutError('timed out')), -2)
+
+    def test_agent_errors_are_no_snmp_data(self):
+        self.assertEqual(self.determine_printer_model(EasySNMPUnknownObjectIDError('unknown object id')), -3)
+        self.assertEqual(self.determine_printer_model(EasySNMPNoSuchNameError('no such name')), -3)
+
+class SessionPoolTests(SimpleTestCase):
+    """ ``SessionPool`` checks sessions that were idle before reusing them and closes the ones idle for too long. """
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('app.snmp.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('app.snmp.Session', side_effect=lambda **kwargs: mock.Mock(name=kwargs['hostname']))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.pool = SessionPool(max_size=10, idle_timeout=600, check_after=60)
+        self.key = SessionPool.key('10.20.3.4', 2, 'public', 1, 3)
+
+    def released_session(self, key, idle_for):
+        session = self.pool.acquire(key)
+        self.pool.release(key, session)
+        self.now += idle_for
+        return session
+
+    def test_recently_used_session_is_not_checked(self):
+        session = self.released_session(self.key, 30)
+        self.assertIs(self.pool.acquire(self.key), session)
+        session.get.assert_not_called()
+        self.assertEqual((self.pool.hits, self.pool.misses), (1, 1))
+
+    def test_idle_session_that_answers_the_check_is_reused(self):
+        session = self.released_session(self.key, 120)
+        self.assertIs(self.pool.acquire(self.key), session)
+        session.get.assert_called_once_with(SYS_UPTIME_OID)
+
+    def test_v1_error_answer_passes_the_check(self):
+        session = self.released_session(self.key, 120)
+        session.get.side_effect = EasySNMPNoSuchNameError('no such name')
+        self.assertIs(self.pool.acquire(self.key), session)
+
+    def test_idle_session_that_fails_the_check_is_replaced(self):
+        session = self.released_session(self.key, 120)
+        session.get.side_effect = EasySNMPTimeoutError('timed out')
+        new_session = self.pool.acquire(self.key)
+        self.assertIsNot(new_session, session)
+        self.assertEqual((self.pool.hits, self.pool.misses, self.pool.discarded), (0, 2, 1))
+
+        # The new session was just created, so it isn't checked.
+        new_session.get.assert_not_called()
+
+    def idle_sessions(self, key):
+        return [session for session, _ in self.pool._idle.get(key, [])]
+
+    def test_idle_sessions_behind_a_fresh_key_are_evicted(self):
+        other_key = SessionPool.key('10.20.3.5', 2, 'public', 1, 3)
+        sessions = [self.pool.acquire(self.key) for _ in range(SessionPool.max_idle_per_key)]
+        for session in sessions:
+            self.pool.release(self.key, session)
+        self.now += 100
+        other_session = self.released_session(other_key, 100)
+
+        # The pool is full for the key, so this session isn't kept, but the key is moved after the other one.
+        self.pool.release(self.key, mock.Mock())
+        self.now += 450
+
+        self.pool.acquire(SessionPool.key('10.20.3.6', 2, 'public', 1, 3))
+        self.assertEqual(self.idle_sessions(self.key), [])
+        self.assertEqual(self.idle_sessions(other_key), [other_session])
+        self.assertEqual(self.pool._idle_count, 1)
+
+    def test_stale_session_of_a_fresh_key_is_evicted(self):
+        first = self.pool.acquire(self.key)
+        second = self.pool.acquire(self.key)
+        self.pool.release(self.key, first)
+        self.now += 500
+        self.pool.release(self.key, second)
+        self.now += 200
+
+        self.pool.acquire(SessionPool.key('10.20.3.6', 2, 'public', 1, 3))
+        self.assertEqual(self.idle_sessions(self.key), [second])
+        self.assertEqual(self.pool._idle_count, 1)
+
+@override_settings(TONER_HISTORY_MODE='changes')
+class CurrentLevelsTests(TestCase):
+    """ The current levels of a printer that stops answering are kept and marked as off. """
+
+    def setUp(self):
+        self.printer = create_printer('8X11_2232', '10.20.3.4')
+        self.start = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+
+    def poll(self, levels, hours):
+        with mock.patch('django.utils.timezone.now', return_value=self.start + timedelta(hours=hours)):
+            update_database({self.printer.printer_name: levels})
+
+    def current_levels(self):
+        return {
+            current_level.module_identifier: (current_level.level, current_level.date_time)
+            for current_level in CurrentTonerLevel.objects.filter(printer_name=self.printer)
+        }
+
+    def test_levels_are_kept_while_the_printer_is_off(self):
+        self.poll({'Black': '40', 'Cyan': '50'}, 0)
+        self.poll(PRINTER_OFF_LEVELS, 1)
+        self.poll(PRINTER_OFF_LEVELS, 2)
+
+        self.assertEqual(self.current_levels(), {
+            'Black': ('40', self.start),
+            'Cyan': ('50', self.start),
+            'Printer seems to be off': ('Not on', self.start + timedelta(hours=1)),
+        })
+
+        printer_entry = group_dashboard(
+            Printer.objects.all(), CurrentTonerLevel.objects.order_by('module_identifier'),
+            self.start + timedelta(minutes=30), now=self.start + timedelta(hours=2)
+        )[0]['printers'][0]
+        self.assertEqual([supply['module_identifier'] for supply in printer_entry['supplies']], ['Black', 'Cyan'])
+        self.assertEqual(printer_entry['off_since'], self.start + timedelta(hours=1))
+        self.assertEqual(printer_entry['last_polled'], self.start)
+        self.assertTrue(printer_entry['is_stale'])
+
+    def test_printer_back_on_starts_new_runs(self):
+        self.poll({'Black': '40', 'Cyan': '50'}, 0)
+        self.poll(PRINTER_OFF_LEVELS, 1)
+        self.poll({'Black': '40', 'Cyan': '45'}, 2)
+
+        back_on = self.start + timedelta(hours=2)
+        self.assertEqual(self.current_levels(), {'Black': ('40', back_on), 'Cyan': ('45', back_on)})
+
+        # The run of Black before the printer was off isn't extended over the time it was off.
+        black_runs = TonerLevel.objects.filter(printer_name=self.printer, module_identifier='Black').order_by('date_time')
+        self.assertEqual([(run.date_time, run.last_seen) for run in black_runs], [
+            (self.start, self.start), (back_on, back_on)
+        ])
+
+        # While it is on, the same level only extends the run.
+        self.poll({'Black': '40', 'Cyan': '45'}, 3)
+        self.assertEqual(black_runs.count(), 2)
+
+class HistoryRunTests(TestCase):
+    """ ``update_database`` stores the history as runs of the same level in 'changes' mode. """
+
+    def setUp(self):
+        self.printer = create_printer('8X11_2232', '10.20.3.4')
+        self.start = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+
+    def poll(self, levels, hours):
+        with mock.patch('django.utils.timezone.now', return_value=self.start + timedelta(hours=hours)):
+            return update_database({self.printer.printer_name: levels})
+
+    def runs(self, module_identifier):
+        return list(TonerLevel.objects.filter(printer_name=self.printer, module_identifier=module_identifier).order_by(
+            'date_time'
+        ).values_list('level', 'date_time', 'last_seen'))
+
+    @override_settings(TONER_HISTORY_MODE='changes')
+    def test_same_level_extends_the_run(self):
+        self.assertEqual(self.poll({'Black': '40', 'Waste Toner': 'OK'}, 0), 2)
+        self.assertEqual(self.poll({'Black': '40', 'Waste Toner': 'OK'}, 1), 0)
+        self.assertEqual(self.poll({'Black': '39', 'Waste Toner': 'OK'}, 2), 1)
+        self.assertEqual(self.poll({'Black': '40', 'Waste Toner': 'OK'}, 3), 1)
+
+        hour = timedelta(hours=1)
+        self.assertEqual(self.runs('Black'), [
+            ('40', self.start, self.start + hour),
+            ('39', self.start + 2 * hour, self.start + 2 * hour),
+            # Back to an earlier level is a new run, only the latest run is extended.
+            ('40', self.start + 3 * hour, self.start + 3 * hour),
+        ])
+        self.assertEqual(self.runs('Waste Toner'), [('OK', self.start, self.start + 3 * hour)])
+        self.assertEqual(
+            CurrentTonerLevel.objects.get(printer_name=self.printer, module_identifier='Black').toner_level.date_time,
+            self.start + 3 * hour
+        )
+
+    @override_settings(TONER_HISTORY_MODE='samples')
+    def test_samples_mode_writes_every_poll(self):
+        for hours in range(3):
+            self.assertEqual(self.poll({'Black': '40'}, hours), 1)
+
+        self.assertEqual(self.runs('Black'), [
+            ('40', self.start + timedelta(hours=hours), self.start + timedelta(hours=hours)) for hours in range(3)
+        ])
+
+class CompactHistoryTests(TestCase):
+    """ ``compact_history`` (the ``compacttonerhistory`` command) merges the history written one row per poll. """
+
+    def setUp(self):
+        self.printer = create_printer('8X11_2232', '10.20.3.4')
+        self.start = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+
+        with override_settings(TONER_HISTORY_MODE='samples'):
+            for hours, levels in enumerate([
+                {'Black': '40', 'Cyan': '80'}, {'Black': '40', 'Cyan': '80'}, {'Black': '39', 'Cyan': '80'},
+                {'Black': '40', 'Cyan': '80'}, {'Black': '40', 'Cyan': '79'},
+            ]):
+                with mock.patch('django.utils.timezone.now', return_value=self.start + timedelta(hours=hours)):
+                    update_database({self.printer.printer_name: levels})
+
+    def runs(self):
+        return list(TonerLevel.objects.order_by('module_identifier', 'date_time').values_list(
+            'module_identifier', 'level', 'date_time', 'last_seen'
+        ))
+
+    @override_settings(TONER_HISTORY_MODE='changes')
+    def test_compact(self):
+        stdout = io.StringIO()
+        call_command('compacttonerhistory', stdout=stdout)
+        self.assertIn('Merged 5 toner level rows', stdout.getvalue())
+
+        hour = timedelta(hours=1)
+        self.assertEqual(self.runs(), [
+            ('Black', '40', self.start, self.start + hour),
+            ('Black', '39', self.start + 2 * hour, self.start + 2 * hour),
+            ('Black', '40', self.start + 3 * hour, self.start + 4 * hour),
+            ('Cyan', '80', self.start, self.start + 3 * hour),
+            ('Cyan', '79', self.start + 4 * hour, self.start + 4 * hour),
+        ])
+
+        # The current levels point to the last runs, so the next poll extends them.
+        current_runs = dict(CurrentTonerLevel.objects.values_list('module_identifier', 'toner_level__date_time'))
+        self.assertEqual(current_runs, {'Black': self.start + 3 * hour, 'Cyan': self.start + 4 * hour})
+        with mock.patch('django.utils.timezone.now', return_value=self.start + 5 * hour):
+            self.assertEqual(update_database({self.printer.printer_name: {'Black': '40', 'Cyan': '79'}}), 0)
+
+        self.assertEqual(compact_history(), 0)
+
+    @override_settings(TONER_HISTORY_MODE='samples')
+    def test_samples_mode_is_not_compacted(self):
+        with self.assertRaises(CommandError):
+            call_command('compacttonerhistory', stdout=io.StringIO())
+        self.assertEqual(TonerLevel.objects.count(), 10)
+
+class CompactHistoryMigrationTests(TransactionTestCase):
+    """ Migration 0008 turns every existing sample into a run and links the current levels to the latest one. """
+
+    migrate_from = ('app', '0007_tonerlevel_last_seen')
+    migrate_to = ('app', '0008_compact_toner_history')
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def test_migration(self):
+        apps = self.migrate(self.migrate_from)
+        Printer = apps.get_model('app', 'Printer')
+        TonerLevel = apps.get_model('app', 'TonerLevel')
+        CurrentTonerLevel = apps.get_model('app', 'CurrentTonerLevel')
+
+        start = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        printer = Printer.objects.create(
+            printer_name='8X11_2232', printer_model_name='HP LaserJet m402dn', printer_location='Building 8 Room 45',
+            ip_address='10.20.3.4', department_name='IT'
+        )
+        for hours, level in enumerate(['40', '40', '39']):
+            TonerLevel.objects.create(
+                printer_name=printer, module_identifier='Black', level=level,
+                date_time=start + timedelta(hours=hours), last_seen=start + timedelta(days=30)
+            )
+        CurrentTonerLevel.objects.create(
+            printer_name=printer, module_identifier='Black', level='39', date_time=start + timedelta(hours=2)
+        )
+
+        apps = self.migrate(self.migrate_to)
+        TonerLevel = apps.get_model('app', 'TonerLevel')
+        CurrentTonerLevel = apps.get_model('app', 'CurrentTonerLevel')
+
+        # The samples are kept whatever TONER_HISTORY_MODE is, compacttonerhistory merges them.
+        self.assertEqual(list(TonerLevel.objects.order_by('date_time').values_list('level', 'date_time', 'last_seen')), [
+            ('40', start, start),
+            ('40', start + timedelta(hours=1), start + timedelta(hours=1)),
+            ('39', start + timedelta(hours=2), start + timedelta(hours=2)),
+        ])
+        self.assertEqual(CurrentTonerLevel.objects.get().toner_level.date_time, start + timedelta(hours=2))
+
+@override_settings(TONER_HISTORY_MODE='changes', ROLLUP_SAFETY_LAG=timedelta(minutes=15), TIME_ZONE='UTC')
+class RollupTests(TestCase):
+    """ ``rollup_history`` only reads the history seen since its last run and gives the same rollups when run again. """
+
+    def setUp(self):
+        self.printer = create_printer('8X11_2232', '10.20.3.4')
+        self.start = datetime(2026, 3, 1, 10, tzinfo=dt_timezone.utc)
+
+    def at(self, minutes):
+        return mock.patch('django.utils.timezone.now', return_value=self.start + timedelta(minutes=minutes))
+
+    def poll(self, levels, minutes):
+        with self.at(minutes):
+            update_database({self.printer.printer_name: levels})
+
+    def rollup(self, minutes):
+        with self.at(minutes):
+            return rollup_history()
+
+    def rollups(self):
+        return {
+            (rollup.module_identifier, rollup.period, rollup.period_start.hour if rollup.period == 'hour' else None): (
+                rollup.min_level, rollup.max_level, rollup.last_level, rollup.last_seen
+            ) for rollup in TonerLevelRollup.objects.all()
+        }
+
+    def test_rollups_are_the_same_after_another_run(self):
+        for minutes, level in [(0, '50'), (30, '50'), (50, '48'), (70, '47'), (80, '47')]:
+            self.poll({'Black': level, 'Waste Toner': 'OK'}, minutes)
+
+        self.rollup(90)
+        expected = {
+            ('Black', 'hour', 10): (48, 50, '48', self.start + timedelta(minutes=50)),
+            ('Black', 'hour', 11): (47, 47, '47', self.start + timedelta(minutes=80)),
+            ('Black', 'day', None): (47, 50, '47', self.start + timedelta(minutes=80)),
+            # Only the first and the last time a run was seen are observations.
+            ('Waste Toner', 'hour', 10): (None, None, 'OK', self.start),
+            ('Waste Toner', 'hour', 11): (None, None, 'OK', self.start + timedelta(minutes=80)),
+            ('Waste Toner', 'day', None): (None, None, 'OK', self.start + timedelta(minutes=80)),
+        }
+        self.assertEqual(self.rollups(), expected)
+        self.assertEqual(RollupWatermark.objects.get().processed_until, self.start + timedelta(minutes=75))
+
+        # The rows seen within the safety lag are read again, and give the same rollups.
+        self.assertEqual(self.rollup(95), 4)
+        self.assertEqual(self.rollups(), expected)
+
+        # Extending a run that was already rolled up only moves the last time it was seen.
+        self.poll({'Black': '47', 'Waste Toner': 'OK'}, 100)
+        self.rollup(110)
+        expected[('Black', 'hour', 11)] = (47, 47, '47', self.start + timedelta(minutes=100))
+        expected[('Black', 'day', None)] = (47, 50, '47', self.start + timedelta(minutes=100))
+        expected[('Waste Toner', 'hour', 11)] = (None, None, 'OK', self.start + timedelta(minutes=100))
+        expected[('Waste Toner', 'day', None)] = (None, None, 'OK', self.start + timedelta(minutes=100))
+        self.assertEqual(self.rollups(), expected)
+
+    def test_rows_committed_after_the_run_are_rolled_up(self):
+        self.poll({'Black': '50'}, 0)
+        self.rollup(30)
+
+        # A poller stamped a row before the run started, but it only became visible after the run read the history.
+        with self.at(25):
+            stamped = self.start + timedelta(minutes=25)
+            TonerLevel.objects.create(
+                printer_name=self.printer, module_identifier='Cyan', level='80', date_time=stamped, last_seen=stamped
+            )
+
+        self.rollup(60)
+        self.assertEqual(self.rollups()[('Cyan', 'hour', 10)], (80, 80, '80', stamped))
+
+    def test_delete_old_history(self):
+        for minutes, level in [(0, '50'), (60, '49'), (120, '48')]:
+            self.poll({'Black': level}, minutes)
+
+        # Nothing is deleted before it is rolled up.
+        with self.at(24 * 60):
+            self.assertEqual(delete_old_history(self.start + timedelta(hours=24), pause=0), 0)
+            rollup_history()
+            self.assertEqual(delete_old_history(self.start + timedelta(hours=24), pause=0), 2)
+
+        # The current level of the module is kept.
+        self.assertEqual(list(TonerLevel.objects.values_list('level', flat=True)), ['48'])
+        self.assertEqual(TonerLevelRollup.objects.filter(module_identifier='Black', period='hour').count(), 3)
+
+class RunPollerTests(TestCase):
+    """ The ``runpoller`` daemon saves the polls that raised like ``poll_printers`` does. """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings_override = override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            METRICS_FILE=os.path.join(self.directory.name, 'metrics.json'), BREAKER_FAILURE_THRESHOLD=2,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.command = runpoller.Command(stdout=io.StringIO(), stderr=io.StringIO())
+        self.command.cycle = self.command.new_cycle()
+        self.command.schedule = runpoller.PollSchedule(60)
+
+    def test_poll_that_raises_is_a_failure(self):
+        printer = create_printer('8X11_2232', '10.20.3.4')
+        future = Future()
+        future.set_exception(ValueError("invalid literal for int() with base 10: 'NA'"))
+
+        for failures in (1, 2):
+            with self.assertLogs('app.poller', 'ERROR'):
+                self.command.save_results({future: printer})
+
+            printer.refresh_from_db()
+            self.assertEqual(printer.consecutive_failures, failures)
+
+        self.assertEqual(printer.breaker_state, Printer.BREAKER_OPEN)
+        self.assertIsNotNone(printer.breaker_retry_at)
+        self.assertEqual(self.command.cycle['errors'], 2)
+        self.assertFalse(TonerLevel.objects.exists())
+
+@override_settings(
+    BREAKER_FAILURE_THRESHOLD=2, BREAKER_BACKOFF=timedelta(minutes=10), BREAKER_BACKOFF_MAX=timedelta(minutes=30),
+    SNMP_RECHECK_INTERVAL=timedelta(hours=1)
+)
+class CircuitBreakerTests(TestCase):
+    """ ``_poll_through_breaker`` opens the breaker of a printer that stops answering and checks it again later. """
+
+    levels = {'Black': '40', 'Cyan': '50'}
+
+    def setUp(self):
+        self.printer = create_printer('8X11_2232', '10.20.3.4', snmp_version=2)
+        self.start = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        # The SNMP settings were just checked, so they aren't checked again unless a test changes it.
+        self.printer.snmp_checked = self.start
+
+    def poll(self, minutes, levels=None, reachable=False, snmp_settings=(-1, None)):
+        """ Poll the printer ``minutes`` after the start with the SNMP requests stubbed. """
+        self.get_levels = mock.Mock(return_value=dict(PRINTER_OFF_LEVELS) if levels is None else levels)
+        self.is_reachable = mock.Mock(return_value=reachable)
+        self.determine_snmp_version = mock.Mock(return_value=snmp_settings)
+        with mock.patch('django.utils.timezone.now', return_value=self.start + timedelta(minutes=minutes)), \
+                mock.patch('app.poller._get_levels', self.get_levels), \
+                mock.patch('app.poller.SNMP.is_reachable', self.is_reachable), \
+                mock.patch('app.poller.determine_snmp_version', self.determine_snmp_version):
+            return _poll_through_breaker(self.printer, 1)
+
+    def assert_breaker(self, state, failures, retry_minutes=None):
+        self.assertEqual(self.printer.breaker_state, state)
+        self.assertEqual(self.printer.consecutive_failures, failures)
+        retry_at = None if retry_minutes is None else self.start + timedelta(minutes=retry_minutes)
+        self.assertEqual(self.printer.breaker_retry_at, retry_at)
+
+    def open_breaker(self):
+        self.poll(0)
+        self.poll(5)
+        self.assert_breaker(Printer.BREAKER_OPEN, 2, 15)
+
+    def test_breaker_opens_at_the_threshold(self):
+        self.assertEqual(self.poll(0), (None, True))
+        self.assert_breaker(Printer.BREAKER_CLOSED, 1)
+
+        # The levels of a printer that is off are only stored once, when the breaker opens.
+        self.assertEqual(self.poll(5), (PRINTER_OFF_LEVELS, True))
+        self.assert_breaker(Printer.BREAKER_OPEN, 2, 15)
+
+    def test_answer_before_the_threshold_resets_the_failures(self):
+        self.poll(0)
+        self.assertEqual(self.poll(5, self.levels), (self.levels, True))
+        self.assert_breaker(Printer.BREAKER_CLOSED, 0)
+
+        self.assertEqual(self.poll(10, self.levels), (self.levels, False))
+
+    def test_open_breaker_skips_polls_until_the_retry(self):
+        self.open_breaker()
+
+        self.assertEqual(self.poll(14, self.levels, reachable=True), (None, False))
+        self.get_levels.assert_not_called()
+        self.is_reachable.assert_not_called()
+        self.assert_breaker(Printer.BREAKER_OPEN, 2, 15)
+
+    def test_half_open_success_closes_the_breaker(self):
+        self.open_breaker()
+
+        self.assertEqual(self.poll(15, self.levels, reachable=True), (self.levels, True))
+        self.is_reachable.assert_called_once()
+        self.determine_snmp_version.assert_not_called()
+        self.assert_breaker(Printer.BREAKER_CLOSED, 0)
+
+    def test_half_open_failure_doubles_the_wait(self):
+        self.open_breaker()
+
+        self.assertEqual(self.poll(15), (None, True))
+        # Only the sysUpTime GET is sent, the supplies aren't polled.
+        self.get_levels.assert_not_called()
+        self.assert_breaker(Printer.BREAKER_OPEN, 3, 35)
+
+        self.poll(35)
+        self.assert_breaker(Printer.BREAKER_OPEN, 4, 65)
+        # Up to BREAKER_BACKOFF_MAX.
+        self.poll(65)
+        self.assert_breaker(Printer.BREAKER_OPEN, 5, 95)
+
+    def test_half_open_with_new_snmp_settings(self):
+        self.open_breaker()
+        self.printer.snmp_checked = self.start - timedelta(hours=2)
+
+        # The firmware was upgraded and the printer only answers SNMP v1 with another community now.
+        self.assertEqual(self.poll(15, self.levels, snmp_settings=(1, 'private')), (self.levels, True))
+        self.determine_snmp_version.assert_called_once()
+        self.assertEqual((self.printer.snmp_version, self.printer.snmp_community), (1, 'private'))
+        self.assertEqual(self.printer.snmp_checked, self.start + timedelta(minutes=15))
+        self.assert_breaker(Printer.BREAKER_CLOSED, 0)
+
+    def test_half_open_recheck_without_an_answer(self):
+        self.open_breaker()
+        self.printer.snmp_checked = self.start - timedelta(hours=2)
+
+        self.assertEqual(self.poll(15), (None, True))
+        self.determine_snmp_version.assert_called_once()
+        self.assertEqual((self.printer.snmp_version, self.printer.snmp_community), (2, 'public'))
+        self.assert_breaker(Printer.BREAKER_OPEN, 3, 35)
+
+        # The settings were just checked, so they aren't checked again on the next retry.
+        self.poll(35)
+        self.determine_snmp_version.assert_not_called()
+
+    def test_closed_breaker_rechecks_the_snmp_settings(self):
+        self.printer.snmp_checked = None
+
+        with mock.patch('django.utils.timezone.now', return_value=self.start), \
+                mock.patch('app.poller._get_levels', side_effect=[dict(PRINTER_OFF_LEVELS), self.levels]) as get_levels, \
+                mock.patch('app.poller.determine_snmp_version', return_value=(1, 'public')):
+            self.assertEqual(_poll_through_breaker(self.printer, 1), (self.levels, True))
+
+        # Polled again with the new version.
+        self.assertEqual(get_levels.call_count, 2)
+        self.assertEqual(self.printer.snmp_version, 1)
+        self.assert_breaker(Printer.BREAKER_CLOSED, 0)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_poll_printer_saves_the_breaker(self):
+        self.printer.save()
+        with mock.patch('django.utils.timezone.now', return_value=self.start), \
+                mock.patch('app.poller._get_levels', return_value=dict(PRINTER_OFF_LEVELS)):
+            self.assertIsNone(poll_printer(self.printer, 1))
+            self.assertEqual(poll_printer(self.printer, 1), PRINTER_OFF_LEVELS)
+
+        self.printer.refresh_from_db()
+        self.assert_breaker(Printer.BREAKER_OPEN, 2, 10)
+
+class RefreshJobTests(TestCase):
+    """ Only one refresh job is active at a time, even when two requests start one at the same time. """
+
+    def test_active_job_is_returned(self):
+        job = start_refresh_job()
+        self.assertEqual(job.active_key, REFRESH_JOB_KEY)
+        self.assertEqual(start_refresh_job(), job)
+        self.assertEqual(PollJob.objects.count(), 1)
+
+    def test_job_started_by_another_request_at_the_same_time(self):
+        job = PollJob.objects.create(active_key=REFRESH_JOB_KEY)
+        get = QuerySet.get
+
+        # The other request inserts its job right after this one looked for an active job.
+        def get_after_the_other_request(queryset, *args, **kwargs):
+            if not getattr(get_after_the_other_request, 'missed', False):
+                get_after_the_other_request.missed = True
+                raise PollJob.DoesNotExist
+            return get(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'get', get_after_the_other_request):
+            self.assertEqual(start_refresh_job(), job)
+        self.assertEqual(PollJob.objects.count(), 1)
+
+    def test_job_that_ended_while_it_was_read(self):
+        other_job = PollJob.objects.create(active_key=REFRESH_JOB_KEY)
+        get = QuerySet.get
+        calls = list()
+
+        # The job of the other request is there when this one inserts its job, and ends right after.
+        def get_while_the_other_job_ends(queryset, *args, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise PollJob.DoesNotExist
+            if len(calls) == 2:
+                PollJob.objects.filter(pk=other_job.pk).update(active_key=None, status=PollJob.FINISHED)
+            return get(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'get', get_while_the_other_job_ends):
+            job = start_refresh_job()
+        self.assertNotEqual(job, other_job)
+        self.assertEqual(job.active_key, REFRESH_JOB_KEY)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PrinterProbeTests(TestCase):
+    """ Printers added from the web interface go from 'probing' to 'ready' or 'failed', and failed ones are cleaned up. """
+
+    def setUp(self):
+        self.now = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        self.printer = create_printer('8X11_2232', '10.20.3.4', probe_state=Printer.PROBING, probe_updated=self.now)
+
+        # The probe runs in its own thread and closes its connection at the end, the test's connection stays open.
+        connection_patch = mock.patch('app.jobs.connection')
+        connection_patch.start()
+        self.addCleanup(connection_patch.stop)
+
+    def probe(self, snmp_settings=(2, 'public'), model='HP LaserJet m402dn', poll=None):
+        with mock.patch('app.jobs.determine_snmp_version', return_value=snmp_settings), \
+                mock.patch('app.jobs.determine_printer_model', return_value=model), \
+                mock.patch('app.jobs.poll_printer', poll or mock.Mock(return_value={'Black': '40'})):
+            run_printer_probe(self.printer.pk)
+        self.printer.refresh_from_db()
+
+    def test_ready(self):
+        self.probe(snmp_settings=(1, 'private'))
+        self.assertEqual(self.printer.probe_state, Printer.READY)
+        self.assertEqual((self.printer.snmp_version, self.printer.snmp_community), (1, 'private'))
+        self.assertEqual(
+            list(CurrentTonerLevel.objects.values_list('module_identifier', 'level')), [('Black', '40')]
+        )
+
+    def test_first_poll_that_raises_still_adds_the_printer(self):
+        with self.assertLogs('app.jobs', 'ERROR') as logs:
+            self.probe(poll=mock.Mock(side_effect=ValueError("invalid literal for int() with base 10: 'NA'")))
+
+        self.assertEqual(self.printer.probe_state, Printer.READY)
+        self.assertIn('Traceback', logs.output[0])
+        self.assertFalse(CurrentTonerLevel.objects.exists())
+
+    def test_failed(self):
+        self.probe(snmp_settings=(-1, None))
+        self.assertEqual(self.printer.probe_state, Printer.FAILED)
+        self.assertIn('the printer is on', self.printer.probe_error)
+
+        self.printer.probe_state = Printer.PROBING
+        self.printer.save()
+        self.probe(model=-3)
+        self.assertEqual(self.printer.probe_state, Printer.FAILED)
+        self.assertIn("doesn't have usable SNMP data", self.printer.probe_error)
+
+    def test_unexpected_error_is_logged(self):
+        with self.assertLogs('app.jobs', 'ERROR'):
+            with mock.patch('app.jobs.discover_printer', side_effect=RuntimeError('boom')):
+                run_printer_probe(self.printer.pk)
+        self.printer.refresh_from_db()
+        self.assertEqual(self.printer.probe_state, Printer.FAILED)
+        self.assertEqual(self.printer.probe_error, 'UNEXPECTED ERROR: Could not add printer.')
+
+    def test_clean_up(self):
+        failed = create_printer(
+            '8X11_2233', '10.20.3.5', probe_state=Printer.FAILED, probe_error='Printer not added.',
+            probe_updated=self.now
+        )
+        ready = create_printer('8X11_2234', '10.20.3.6')
+
+        # A probe that is still running and a failure that is recent are kept.
+        self.assertEqual(clean_up_printer_probes(self.now + timedelta(minutes=10)), 0)
+        self.printer.refresh_from_db()
+        self.assertEqual(self.printer.probe_state, Printer.PROBING)
+
+        # The probe was abandoned (the worker running it was restarted).
+        self.assertEqual(clean_up_printer_probes(self.now + timedelta(minutes=20)), 0)
+        self.printer.refresh_from_db()
+        self.assertEqual(self.printer.probe_state, Printer.FAILED)
+        self.assertEqual(self.printer.probe_updated, self.now + timedelta(minutes=20))
+        self.assertIn('stopped without finishing', self.printer.probe_error)
+
+        # Failed printers are deleted a day after they failed.
+        self.assertEqual(clean_up_printer_probes(self.now + timedelta(days=1, minutes=10)), 1)
+        self.assertFalse(Printer.objects.filter(pk=failed.pk).exists())
+        self.assertEqual(clean_up_printer_probes(self.now + timedelta(days=1, minutes=30)), 1)
+        self.assertEqual(list(Printer.objects.all()), [ready])
+
+    def test_session_that_added_the_printer_is_told(self):
+        self.probe(snmp_settings=(-1, None))
+        session = self.client.session
+        session['probing_printers'] = [self.printer.pk]
+        session.save()
+
+        response = self.client.get(reverse('homepage'))
+        self.assertContains(response, 'Printer not added.')
+        self.assertFalse(Printer.objects.exists())
+        self.assertEqual(self.client.session['probing_printers'], [])
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, TONER_HISTORY_MODE='changes'
+)
+class HomepageCachingTests(TestCase):
+    """ The homepage is answered from the cache, or with a 304, until a poll or a printer change. """
+
+    def setUp(self):
+        # The cache isn't emptied between tests, and the ids of the PollCycle rows are reused after a rollback.
+        cache.clear()
+        # The ETag also changes every DASHBOARD_CACHE_TIMEOUT seconds, so that time is fixed.
+        patcher = mock.patch('app.caching.time.time', return_value=1_000_000.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.printer = create_printer('8X11_2232', '10.20.3.4')
+        self.now = datetime(2026, 3, 1, 10, tzinfo=dt_timezone.utc)
+        self.poll({'Black': '45'})
+
+    def poll(self, levels):
+        self.now += timedelta(minutes=10)
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            update_database({self.printer.printer_name: levels})
+
+    def get(self, **headers):
+        return self.client.get(reverse('homepage'), **headers)
+
+    def test_conditional_get(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Last-Modified'], http_date(self.now.timestamp()))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        not_modified = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_poll_changes_the_page(self):
+        response = self.get()
+        self.assertContains(response, 'data-level="45"')
+
+        self.poll({'Black': '30'})
+        response_after_poll = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response_after_poll.status_code, 200)
+        self.assertNotEqual(response_after_poll['ETag'], response['ETag'])
+        self.assertContains(response_after_poll, 'data-level="30"')
+        self.assertNotContains(response_after_poll, 'data-level="45"')
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 200)
+
+    def test_dashboard_is_rendered_once_per_version(self):
+        with mock.patch('app.views.render_dashboard', wraps=render_dashboard) as render:
+            first_etag = self.get()['ETag']
+            self.get()
+            self.assertEqual(render.call_count, 1)
+
+            # A printer change outside of a poll replaces the token.
+            Printer.objects.filter(pk=self.printer.pk).update(printer_location='Building 9 Room 12')
+            bump_dashboard_version()
+            response = self.get(HTTP_IF_NONE_MATCH=first_etag)
+            self.assertEqual(render.call_count, 2)
+            self.assertContains(response, 'Building 9 Room 12')
+            self.assertNotEqual(response['ETag'], first_etag)
+
+            # A poll that doesn't change any level still records a new PollCycle.
+            self.poll({'Black': '45'})
+            self.get()
+            self.get()
+            self.assertEqual(render.call_count, 3)
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, TONER_HISTORY_MODE='changes'
+)
+class ApiTests(TestCase):
+    """ The JSON API pages through the rows by id, filters them by department, and answers with a 304 until the data
+    changes.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.printers = [
+            create_printer(f'8X11_22{number}', f'10.20.3.{number}', department_name='IT' if number % 2 else 'Finance')
+            for number in range(1, 6)
+        ]
+        self.printers.append(create_printer('8X11_2299', '10.20.3.99', probe_state=Printer.PROBING))
+        update_database({
+            printer.printer_name: {'Black': str(40 + number), 'Cyan': str(60 + number)}
+            for number, printer in enumerate(self.printers[:5])
+        })
+
+    def get(self, name, **params):
+        headers = {key: params.pop(key) for key in list(params) if key.startswith('HTTP_')}
+        return self.client.get(reverse(name), params, **headers)
+
+    def walk(self, name, limit, **params):
+        """ Return the ids of every page of the results, following the cursors. """
+        pages = []
+        cursor = None
+        while True:
+            response = self.get(name, limit=limit, **({'cursor': cursor} if cursor else {}), **params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            pages.append([result.get('id', result.get('printer')) for result in body['results']])
+            cursor = body['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_pages_follow_the_ids(self):
+        ready_ids = [printer.pk for printer in self.printers[:5]]
+        self.assertEqual(self.walk('api-printers', 2), [ready_ids[:2], ready_ids[2:4], ready_ids[4:]])
+        self.assertEqual(self.walk('api-printers', 5), [ready_ids])
+        self.assertEqual(len(sum(self.walk('api-levels', 3), [])), 10)
+
+    def test_rows_added_while_paging_show_up_on_a_later_page(self):
+        first_page = self.get('api-printers', limit=2).json()
+        added = create_printer('8X11_2206', '10.20.3.6')
+        second_page = self.get('api-printers', limit=10, cursor=first_page['next_cursor']).json()
+
+        ids = [result['id'] for result in first_page['results'] + second_page['results']]
+        self.assertEqual(ids, [printer.pk for printer in self.printers[:5]] + [added.pk])
+        self.assertIsNone(second_page['next_cursor'])
+
+    def test_invalid_pagination(self):
+        for params in ({'limit': 0}, {'limit': 1001}, {'limit': 'ten'}, {'cursor': '!!'}, {'cursor': 'YWJj'}):
+            response = self.get('api-printers', **params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+
+    def test_department_filter(self):
+        it_ids = [printer.pk for printer in self.printers[:5] if printer.department_name == 'IT']
+        self.assertEqual(
+            [result['id'] for result in self.get('api-printers', department='IT').json()['results']], it_ids
+        )
+        self.assertEqual(sorted({
+            result['printer'] for result in self.get('api-levels', department='IT').json()['results']
+        }), it_ids)
+        self.assertEqual(
+            self.walk('api-printers', 1, department='Finance'), [[self.printers[1].pk], [self.printers[3].pk]]
+        )
+        self.assertEqual(self.get('api-levels', department='Legal').json(), {'results': [], 'next_cursor': None})
+
+    def test_conditional_get(self):
+        response = self.get('api-levels', printer=self.printers[0].pk)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        self.assertEqual(self.get('api-levels', printer=self.printers[0].pk, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # The ETag depends on the query string.
+        self.assertEqual(self.get('api-levels', printer=self.printers[1].pk, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        update_database({self.printers[0].printer_name: {'Black': '12', 'Cyan': '60'}})
+        response = self.get('api-levels', printer=self.printers[0].pk, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn(
+            {'printer': self.printers[0].pk, 'module': 'Black', 'level': '12'},
+            [{key: result[key] for key in ('printer', 'module', 'level')} for result in response.json()['results']]
+        )
+
+        # A printer change outside of a poll also changes the ETag.
+        etag = response['ETag']
+        bump_dashboard_version()
+        self.assertEqual(self.get('api-levels', printer=self.printers[0].pk, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+class MetricsFileTests(SimpleTestCase):
+    """ ``MetricsRegistry.flush`` adds the recorded metrics to the metrics file in its own directory. """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = os.path.join(directory.name, 'metrics')
+        self.path = os.path.join(self.directory, 'metrics.json')
+
+    def test_flush_creates_the_directory(self):
+        registry = MetricsRegistry()
+        self.assertFalse(registry.flush(self.path))
+
+        registry.inc('db_rows_written_total', 3)
+        self.assertTrue(registry.flush(self.path))
+        registry.inc('db_rows_written_total', 2)
+        self.assertTrue(registry.flush(self.path))
+
+        self.assertEqual(read_metrics(self.path)['counters'], {'db_rows_written_total': {'': 5}})
+        # Only the file and its lock are left, the temporary files are replaced.
+        self.assertEqual(sorted(os.listdir(self.directory)), ['metrics.json', 'metrics.json.lock'])
+
+@override_settings(POLLER_LEASE_DURATION=timedelta(minutes=5))
+class LeaseTests(TestCase):
+    """ Workers sharing one lease table never hold the same printer, and only change their own leases. """
+
+    def setUp(self):
+        self.now = datetime(2026, 3, 1, 10, tzinfo=dt_timezone.utc)
+        self.polled_before = self.now - timedelta(minutes=10)
+        self.printers = [create_printer(f'8X11_22{number}', f'10.20.3.{number}') for number in range(1, 6)]
+        ensure_leases()
+
+    def lease(self, worker_id, batch_size, now=None):
+        printers = lease_printers(worker_id, batch_size, self.polled_before, now=now or self.now)
+        return [printer.pk for printer in printers]
+
+    def holders(self):
+        return dict(PrinterLease.objects.values_list('pk', 'worker_id'))
+
+    def test_workers_lease_different_printers(self):
+        # Tests run on SQLite, so the leases are taken with the compare and swap.
+        self.assertFalse(connection.features.has_select_for_update_skip_locked)
+
+        first = self.lease('poller-a', 2)
+        second = self.lease('poller-b', 2)
+        third = self.lease('poller-a', 2)
+        self.assertEqual(first + second + third, [printer.pk for printer in self.printers])
+        self.assertEqual(self.lease('poller-b', 2), [])
+        self.assertEqual(list(self.holders().values()).count('poller-a'), 3)
+
+    def test_printers_taken_after_they_were_read_are_skipped(self):
+        # The other worker takes the first two printers between the read of the candidates and the UPDATE.
+        update = QuerySet.update
+        other_worker_ids = list()
+
+        def update_after_other_worker(queryset, **values):
+            if values.get('worker_id') == 'poller-a' and not other_worker_ids:
+                other_worker_ids.extend(self.lease('poller-b', 2))
+            return update(queryset, **values)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update_after_other_worker):
+            leased_ids = self.lease('poller-a', 3)
+
+        self.assertEqual(other_worker_ids, [self.printers[0].pk, self.printers[1].pk])
+        self.assertEqual(leased_ids, [self.printers[2].pk])
+        self.assertEqual(self.holders()[self.printers[0].pk], 'poller-b')
+
+    def test_release_only_frees_the_leases_of_the_worker(self):
+        leased_ids = self.lease('poller-a', 2)
+        other_ids = self.lease('poller-b', 2)
+
+        self.assertEqual(release_printers('poller-a', leased_ids + other_ids, polled_at=self.now), 2)
+        leases = PrinterLease.objects.in_bulk()
+        for printer_id in leased_ids:
+            self.assertEqual((leases[printer_id].worker_id, leases[printer_id].expires), ('', None))
+            self.assertEqual(leases[printer_id].polled_at, self.now)
+        for printer_id in other_ids:
+            self.assertEqual(leases[printer_id].worker_id, 'poller-b')
+            self.assertIsNone(leases[printer_id].polled_at)
+
+        # The polled printers wait for the next cycle, the one that wasn't leased is still due.
+        self.assertEqual(self.lease('poller-a', 5), [self.printers[4].pk])
+
+    def test_release_without_poll_can_be_leased_again(self):
+        leased_ids = self.lease('poller-a', 2)
+        release_printers('poller-a', leased_ids)
+        self.assertEqual(self.lease('poller-b', 2), leased_ids)
+
+    def test_expired_lease_is_taken_over(self):
+        leased_ids = self.lease('poller-a', 2)
+        self.assertEqual(held_printer_ids('poller-a', leased_ids, now=self.now + timedelta(minutes=4)), set(leased_ids))
+        self.assertEqual(
+            set(PrinterLease.objects.filter(pk__in=leased_ids).values_list('expires', flat=True)),
+            {self.now + timedelta(minutes=9)}
+        )
+
+        # The renewed leases are still held a minute after the first expiry, not after the renewed one.
+        later = self.now + timedelta(minutes=6)
+        self.assertEqual(self.lease('poller-b', 5, now=later), [printer.pk for printer in self.printers[2:]])
+        later = self.now + timedelta(minutes=10)
+        self.assertEqual(self.lease('poller-b', 5, now=later), leased_ids)
+
+        # The worker that lost the leases can't write or release them anymore.
+        self.assertEqual(held_printer_ids('poller-a', leased_ids, now=later), set())
+        self.assertEqual(release_printers('poller-a', leased_ids, polled_at=later), 0)
+        self.assertEqual(held_printer_ids('poller-b', leased_ids, now=later), set(leased_ids))
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, TONER_HISTORY_MODE='changes',
+    POLLER_LEASE_DURATION=timedelta(minutes=5)
+)
+class PollLeasedPrintersTests(TestCase):
+    """ ``updatetonerdata --worker-id`` polls the printers in leased batches and only writes the leases it holds. """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(METRICS_FILE=os.path.join(directory.name, 'metrics.json'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.printers = [create_printer(f'8X11_22{number}', f'10.20.3.{number}') for number in range(1, 6)]
+        self.polled_batches = list()
+
+    def poll_printers(self, printers, workers, timeout, deadline):
+        self.polled_batches.append([printer.pk for printer in printers])
+        return {printer.printer_name: {'Black': '40'} for printer in printers}, []
+
+    def update(self, worker_id, poll_printers=None):
+        stdout = io.StringIO()
+        with mock.patch(
+                'app.management.commands.updatetonerdata.poll_printers', side_effect=poll_printers or self.poll_printers
+        ):
+            call_command('updatetonerdata', worker_id=worker_id, batch_size=2, stdout=stdout, stderr=io.StringIO())
+        return stdout.getvalue()
+
+    def test_printers_are_polled_in_batches(self):
+        output = self.update('poller-a')
+        self.assertIn('Worker poller-a polled 5 printers in 3 batches', output)
+        self.assertEqual(sum(self.polled_batches, []), [printer.pk for printer in self.printers])
+        self.assertEqual(CurrentTonerLevel.objects.count(), 5)
+        self.assertEqual(set(PrinterLease.objects.values_list('worker_id', flat=True)), {''})
+        self.assertFalse(PrinterLease.objects.filter(polled_at__isnull=True).exists())
+
+        # Another worker in the same cycle finds nothing due.
+        self.assertIn('Worker poller-b polled 0 printers in 0 batches', self.update('poller-b'))
+
+    def test_printers_leased_by_another_worker_are_skipped(self):
+        ensure_leases()
+        other_ids = [printer.pk for printer in lease_printers('poller-b', 2, timezone.now())]
+
+        self.update('poller-a')
+        self.assertEqual(sorted(sum(self.polled_batches, [])), [printer.pk for printer in self.printers[2:]])
+        self.assertFalse(CurrentTonerLevel.objects.filter(printer_name_id__in=other_ids).exists())
+        self.assertEqual(
+            set(PrinterLease.objects.filter(pk__in=other_ids).values_list('worker_id', flat=True)), {'poller-b'}
+        )
+
+    def test_levels_of_a_lease_lost_during_the_poll_are_not_written(self):
+        lost_printer = self.printers[0]
+
+        def poll_printers(printers, **options):
+            if lost_printer in printers:
+                # The lease expired and another worker took it while the batch was being polled.
+                PrinterLease.objects.filter(pk=lost_printer.pk).update(
+                    worker_id='poller-b', expires=timezone.now() + timedelta(minutes=5)
+                )
+            return self.poll_printers(printers, **options)
+
+        output = self.update('poller-a', poll_printers)
+        self.assertIn('Worker poller-a polled 4 printers', output)
+        self.assertFalse(CurrentTonerLevel.objects.filter(printer_name=lost_printer).exists())
+        self.assertEqual(PrinterLease.objects.get(pk=lost_printer.pk).worker_id, 'poller-b')
+        self.assertEqual(CurrentTonerLevel.objects.count(), 4)
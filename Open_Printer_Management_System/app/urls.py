@@ -1,8 +1,16 @@
 from django.urls import path
 
-from . import views
+from . import views, api
 
 urlpatterns = [
     path('', views.homepage, name='homepage'),
     path('refresh-toner', views.refresh_toner, name="refresh-toner"),
+    path('refresh-toner/<int:job_id>', views.refresh_toner_status, name="refresh-toner-status"),
+    path('printers/<int:printer_id>/history', views.printer_history, name="printer-history"),
+    path('metrics', views.metrics, name="metrics"),
+    path('api/printers', api.printers, name="api-printers"),
+    path('api/levels', api.current_levels, name="api-levels"),
+    path('api/forecasts', api.forecasts, name="api-forecasts"),
+    path('api/printers/<int:printer_id>/history', api.printer_history, name="api-printer-history"),
+    path('api/printers/<int:printer_id>/history/chart', api.printer_history_chart, name="api-printer-history-chart"),
 ]
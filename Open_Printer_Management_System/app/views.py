@@ -1,13 +1,23 @@
 from django.conf import settings
 from django.contrib import messages
-from django.core.management import call_command
-from django.shortcuts import render, redirect
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.utils.safestring import mark_safe
 
 from .forms import AddPrinterForm, SiteToggles
-from .models import Printer, TonerLevel
-from .snmp import determine_snmp_version, determine_printer_model
+from .models import Printer, TonerLevel, CurrentTonerLevel, PollCycle, PollJob, TonerForecast
+from .jobs import (
+    REFRESH_JOB_KEY, start_refresh_job, start_printer_probe, fail_abandoned_jobs, clean_up_printer_probes, job_progress
+)
+from .caching import dashboard_version, bump_dashboard_version, dashboard_cache_key, dashboard_etag
+from .metrics import METRICS, read_metrics, render_prometheus
+from .snmp import PRINTER_OFF_LEVELS
+from .history import HISTORY_RANGES, DEFAULT_HISTORY_RANGE, CHART_WIDTH, downsample_history, history_range, chart_series
 
 def homepage(request):
     """
@@ -18,168 +28,396 @@ def homepage(request):
             Instance of the form to add a printer in the front-end interface.
         
         ``toggles_form``
-            Instance of the form that changes the values of ``show_location``, ``show_ip``, and ``show_printer_model``.
+            Instance of the form with the switches that show/hide the location, IP address, and model of the
+            printers. They are handled in the browser, so changing them doesn't send a request.
         
-        ``show_location``
-            Boolean variable to show/hide the location data of the printers.
-        
-        ``show_ip``
-            Boolean variable to show/hide the IP address data of the printers.
-        
-        ``show_printer_model``
-            Boolean variable to show/hide the printer model data of the printers.
-        
-        ``all_departments``
-            An instance of :model:`app.Printer` displaying only the distinct departments for the printers. 
-        
-        ``all_printers``
-            An instance of :model:`app.Printer` with all the printers ordered by ``department_name`` and ``printer_name``.
-        
-        ``all_toner_levels``
-            An instance of :model:`app.TonerLevel` filtering by ``date_time`` using the time threshold specified in ``settings.py``, 
-            distinct, and ordered by ``printer_name`` and ``module_identifier``.
+        ``dashboard``
+            The printer cards grouped by department (:template:`app/printer_cards.html`, see ``render_dashboard``).
+            They are kept in the cache until the printers or their toner levels change.
+
+        ``events_url``
+            URL of the Server-Sent Events stream that updates the cards after every poll (see events.py).
 
         ``last_updated``
-            An instance of :model:`app.TonerLevel` displaying the latest date and time the toner data was updated. If there is no toner 
-            data, then the value is ``None``.
+            The latest date and time the toner data was updated. If there is no toner data, then the value is ``None``.
+
+        ``refresh_job_id``
+            Id of the :model:`app.PollJob` refreshing the toner data, if there is one running, so the page can show
+            its progress. Otherwise the value is ``None``.
+
+    GET responses have an ``ETag`` (from the dashboard version, see caching.py) and a ``Last-Modified`` (the time of
+    the last poll) so browsers can send conditional requests and get a 304 when nothing changed. Pages with messages
+    don't have them, because the messages are only shown once.
     
     **Template**
         :template:`app/home.html`
     """
-    # Initial toggle switch state.
-    show_location = True
-    show_ip = True
-    show_printer_model = False
+    clean_up_printer_probes()
+    report_printer_probes(request)
 
     if request.method == 'GET':
         add_printer_form = AddPrinterForm()
-        toggles_form = SiteToggles()
     else:
         add_printer_form = AddPrinterForm(request.POST)
 
-        # if the form is complete and there are no repeated IP addresses,
-        # then the add_printer_form_function will run. If the custom exceptions are raised,
-        # error messages will be sent to the template and redirect to the homepages.
+        # if the form is complete and there are no repeated IP addresses, then the printer is saved and
+        #   its SNMP settings and model are determined in the background (see add_printer_form_function).
+        # If that doesn't work, the error message is shown on the next page load.
         if add_printer_form.is_valid():
-            try:
-                add_printer_form_function(add_printer_form)
-            except PrinterOffException:
-                messages.error(request,
-                    'Printer not added. Make sure you have the correct IP address for the printer and the printer is on.'
-                )
-            except PrinterNotAddedException:
-                messages.error(request, 'UNEXPECTED ERROR: Could not add printer.')
-            except NoSNMPDataException:
-                messages.error(request, mark_safe(
-                    "ERROR: Could not add printer. The printer doesn't have usable SNMP data.</br>"
-                    "Printer may be too old or firmware may need to be updated."
-                ))
-            finally:
-                return redirect('homepage')
+            printer = add_printer_form_function(add_printer_form)
+            request.session['probing_printers'] = request.session.get('probing_printers', []) + [printer.pk]
+            return redirect('homepage')
         else:
             error_message = ""
             for error in add_printer_form.errors.values():
                 error_message += f"{error[0]}<br>"
             messages.error(request, mark_safe(error_message[:-4]))
             return redirect('homepage')
-        
-        # Controls the toggle switches to show/hide data from the printer cards.
-        toggles_form = SiteToggles(request.POST)
-        if toggles_form.is_valid():
-            if not toggles_form.cleaned_data['location']:
-                show_location = False
-            if not toggles_form.cleaned_data['ip_address']:
-                show_ip = False
-            if toggles_form.cleaned_data['printer_model']:
-                show_printer_model = True
-
-    # Printer model objects.
-    all_departments = Printer.objects.filter().values('department_name').distinct().order_by('department_name')
-    all_printer_objects = Printer.objects.all().order_by('department_name', 'printer_name')
 
-    # time_threshold is the last 'x' minutes/hours set in settings.py.
-    time_threshold = timezone.now() - settings.TIMEDELTA
-    all_toner_levels = TonerLevel.objects.filter(date_time__gte=time_threshold).distinct().order_by('printer_name', 'module_identifier')
+    querysets = dashboard_querysets()
 
-    clean_toner_levels = toner_level_cleanup(all_toner_levels)
-    
-    # Try to get the latest date/time the toner data was updated.
+    # Get the latest date/time the toner data was updated.
     # If there is no data, which means there is no toner data yet (fresh install), 
     #   then the variable will be None.
-    try:
-        last_update_obj = TonerLevel.objects.filter().values('date_time').order_by('-date_time').distinct()[0]['date_time']
-    except IndexError:
-        last_update_obj = None
-
-    return render(request, 'app/home.html', context={
-        'add_printer_form': add_printer_form, 'toggles_form': toggles_form, 'show_location': show_location,
-        'show_ip': show_ip, 'show_printer_model': show_printer_model, 'all_departments': all_departments,
-        'all_printers': all_printer_objects, 'all_toner_levels': clean_toner_levels, 'last_updated': last_update_obj
+    last_poll = next(iter(querysets['last_poll']), None)
+    last_update_obj = last_poll.date_time if last_poll else None
+
+    refresh_job = next(iter(querysets['refresh_job']), None)
+    refresh_job_id = refresh_job.pk if refresh_job else None
+
+    version = dashboard_version(last_poll.pk if last_poll else None)
+
+    etag = None
+    last_modified = None
+    if request.method == 'GET' and not len(messages.get_messages(request)):
+        etag = dashboard_etag(version, refresh_job_id)
+        last_modified = int(last_update_obj.timestamp()) if last_update_obj else None
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return set_conditional_headers(not_modified, etag, last_modified)
+
+    cache_key = dashboard_cache_key(version)
+    dashboard = cache.get(cache_key)
+    if dashboard is None:
+        dashboard = render_dashboard(querysets)
+        cache.set(cache_key, dashboard, settings.DASHBOARD_CACHE_TIMEOUT)
+
+    response = render(request, 'app/home.html', context={
+        'add_printer_form': add_printer_form, 'toggles_form': SiteToggles(), 'dashboard': dashboard,
+        'events_url': settings.LIVE_UPDATES_URL, 'last_updated': last_update_obj, 'refresh_job_id': refresh_job_id
     })
 
+    if etag is not None:
+        set_conditional_headers(response, etag, last_modified)
+    return response
+
+def render_dashboard(querysets):
+    """
+    Render the printer cards grouped by department (:template:`app/printer_cards.html`).
+
+    Args:
+        querysets (dict): QuerySets returned by ``dashboard_querysets``.
+
+    Returns:
+        dashboard (str): The rendered HTML, safe to put in :template:`app/home.html`.
+    """
+    # time_threshold is the last 'x' minutes/hours set in settings.py.
+    # Printers that haven't answered since then are still shown, but with the age of their levels.
+    time_threshold = timezone.now() - settings.TIMEDELTA
+
+    departments = group_dashboard(
+        querysets['printers'], querysets['toner_levels'], time_threshold, forecasts=querysets['forecasts']
+    )
+
+    return render_to_string('app/printer_cards.html', context={'departments': departments})
+
+def set_conditional_headers(response, etag, last_modified):
+    """
+    Add the ``ETag`` and ``Last-Modified`` headers to a homepage response, and make browsers check them
+    every time instead of showing the page from their cache.
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def dashboard_querysets():
+    """
+    QuerySets used by :view:`app.homepage`. They are also used by the ``explaindashboard`` management
+    command to show their query plans.
+
+    Returns:
+        querysets (dict): ``printers`` ordered by ``department_name`` and ``printer_name``, the current
+            ``toner_levels`` (the table only has one row per printer module, so the history doesn't need
+            to be searched), the ``forecasts`` that have a days left estimate (see forecasting.py), the
+            ``last_poll`` (read by primary key, so there is no sort), and the running ``refresh_job`` (read
+            through the unique ``active_key``).
+    """
+    return {
+        'printers': Printer.objects.all().order_by('department_name', 'printer_name'),
+        'toner_levels': CurrentTonerLevel.objects.order_by('printer_name', 'module_identifier'),
+        'forecasts': TonerForecast.objects.filter(days_left__isnull=False).only(
+            'printer_name_id', 'module_identifier', 'days_left'
+        ),
+        'last_poll': PollCycle.objects.order_by('-pk')[:1],
+        'refresh_job': PollJob.objects.filter(active_key=REFRESH_JOB_KEY)[:1],
+    }
+
+def group_dashboard(printers, toner_levels, time_threshold, now=None, forecasts=()):
+    """
+    Group the printers by department and attach their toner levels in a single pass over each QuerySet.
+
+    Args:
+        printers (Printer QuerySet): All the printers ordered by ``department_name`` and ``printer_name``.
+        toner_levels (CurrentTonerLevel QuerySet): The current toner levels ordered by ``module_identifier``.
+        time_threshold (datetime): Printers whose levels are older than this are marked as stale.
+            Printers that are off keep their last known levels, with ``off_since`` set to when they stopped answering.
+        now (datetime): Current time used for the circuit breaker state, ``timezone.now()`` if ``None``.
+        forecasts (TonerForecast QuerySet): The forecasts shown next to the toner levels.
+
+    Returns:
+        departments (list): List with the printers of each department.
+        LIST STRUCTURE:
+            [
+                {
+                    'department_name': 'IT',
+                    'printers': [
+                        {
+                            'printer': <Printer: IT Copier>,
+                            'last_polled': datetime or None,
+                            'is_stale': False,
+                            'off_since': datetime or None,
+                            'breaker_state': 'closed', 'failing', 'open', or 'half_open',
+                            'supplies': [
+                                {
+                                    'module_identifier': 'Black', 'level': '45', 'bar_class': 'bg-warning',
+                                    'show_level': True, 'days_left': 12 or None
+                                },
+                                ...
+                            ]
+                        },
+                        ...
+                    ]
+                },
+                ...
+            ]
+    """
+    if now is None:
+        now = timezone.now()
+
+    supplies_by_printer = dict()
+    last_polled_by_printer = dict()
+    off_since_by_printer = dict()
+    days_left = {
+        (forecast.printer_name_id, forecast.module_identifier): forecast.days_left for forecast in forecasts
+    }
+
+    for toner_level in toner_levels:
+        # The levels of a printer that is off are kept next to this row, see CurrentTonerLevel in models.py.
+        if toner_level.module_identifier in PRINTER_OFF_LEVELS:
+            off_since_by_printer[toner_level.printer_name_id] = toner_level.date_time
+            continue
+
+        supplies_by_printer.setdefault(toner_level.printer_name_id, []).append(supply_context(
+            toner_level.module_identifier, toner_level.level,
+            days_left.get((toner_level.printer_name_id, toner_level.module_identifier))
+        ))
+
+        last_polled = last_polled_by_printer.get(toner_level.printer_name_id)
+        if last_polled is None or toner_level.date_time > last_polled:
+            last_polled_by_printer[toner_level.printer_name_id] = toner_level.date_time
+
+    departments = list()
+
+    for printer in printers:
+        # The printers are ordered by department, so a new department starts when the name changes.
+        if not departments or departments[-1]['department_name'] != printer.department_name:
+            departments.append({'department_name': printer.department_name, 'printers': []})
+
+        last_polled = last_polled_by_printer.get(printer.pk)
+        departments[-1]['printers'].append({
+            'printer': printer,
+            'last_polled': last_polled,
+            'is_stale': last_polled is not None and last_polled < time_threshold,
+            'off_since': off_since_by_printer.get(printer.pk),
+            'breaker_state': breaker_state(printer, now),
+            'supplies': supplies_by_printer.get(printer.pk, []),
+        })
+
+    return departments
+
+def breaker_state(printer, now):
+    """
+    Return the circuit breaker state of a printer for the dashboard.
+
+    ``'failing'`` is a closed breaker that missed some polls, and ``'half_open'`` an open breaker whose retry time
+    has passed, so the printer will be checked on the next poll.
+    """
+    if printer.breaker_state == Printer.BREAKER_OPEN:
+        if printer.breaker_retry_at is None or printer.breaker_retry_at <= now:
+            return 'half_open'
+        return 'open'
+    if printer.consecutive_failures:
+        return 'failing'
+    return 'closed'
+
+def supply_context(module_identifier, level, days_left=None):
+    """
+    Create the dictionary used by the template to show a single toner level.
+
+    Percentages get a progress bar with the color depending on the level (``bg-success`` from 50%,
+    ``bg-warning`` above 10%, and ``bg-danger`` for the rest). Other levels like OK/Unknown don't have a
+    ``bar_class`` and are shown as text, and the "Not on" level of printers that are off isn't shown at all.
+    ``days_left`` is the estimate of the :model:`app.TonerForecast` of the module, rounded to whole days.
+    """
+    try:
+        percentage = int(level)
+    except ValueError:
+        percentage = None
+
+    if percentage is None:
+        bar_class = None
+    elif percentage >= 50:
+        bar_class = 'bg-success'
+    elif percentage > 10:
+        bar_class = 'bg-warning'
+    else:
+        bar_class = 'bg-danger'
+
+    return {
+        'module_identifier': module_identifier,
+        'level': level,
+        'bar_class': bar_class,
+        # This text is set when the printer is off, see PRINTER_OFF_LEVELS in snmp.py.
+        'show_level': level != "Not on",
+        'days_left': round(days_left) if days_left is not None and percentage is not None else None,
+    }
+
 def refresh_toner(request):
     """
     View doesn't display any data.
 
-    The view calls the ``updatetonerdata`` management command to update all the toner levels outside of the 
-    time threshold set in ``settings.py`` then redirects back to :view:`app.homepage`.
+    The view starts a background job that updates all the toner levels (see ``start_refresh_job`` in jobs.py) and
+    returns right away. If a refresh is already running, that one is used instead of starting another one.
+    Requests that accept JSON get the progress of the job (the same data as :view:`app.refresh_toner_status`),
+    the others are redirected back to :view:`app.homepage`.
     """
-    call_command('updatetonerdata')
+    job = start_refresh_job()
+
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse(job_progress(job))
+
+    messages.info(request, 'The toner data is being refreshed in the background.')
     return redirect('homepage')
 
+def refresh_toner_status(request, job_id):
+    """
+    Return the progress of a toner refresh job as JSON (see ``job_progress`` in jobs.py).
+
+    The homepage asks for it every few seconds while a refresh is running and reloads when the job is no
+    longer active.
+    """
+    fail_abandoned_jobs()
+    job = get_object_or_404(PollJob, pk=job_id)
+    return JsonResponse(job_progress(job))
+
+def metrics(request):
+    """
+    Return the metrics of the pollers in the Prometheus text format (see metrics.py).
+
+    The metrics recorded by this web worker (refresh jobs) are added to ``METRICS_FILE`` first, so the page
+    includes them.
+    """
+    METRICS.flush()
+    return HttpResponse(render_prometheus(read_metrics()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def printer_history(request, printer_id):
+    """
+    Display a chart with the toner level history of a printer.
+
+    The history is downsampled to ``HISTORY_CHART_BUCKETS`` buckets with the min and max level of each module
+    (see ``downsample_history`` in history.py), so the chart of a 3 year range is as quick as the one of a day.
+
+    **Context**
+        ``printer``
+            The :model:`app.Printer`.
+
+        ``series``
+            The modules drawn in the chart (see ``chart_series`` in history.py).
+
+        ``ranges``
+            The keys of the ranges that can be chosen (``HISTORY_RANGES``).
+
+        ``range_key``
+            The chosen range, from the ``range`` query parameter.
+
+        ``start`` and ``end``
+            The dates and times at the left and right of the chart.
+
+        ``chart_width``
+            Width of the chart in SVG coordinates.
+
+    **Template**
+        :template:`app/printer_history.html`
+    """
+    printer = get_object_or_404(Printer, pk=printer_id)
+
+    range_key = request.GET.get('range', DEFAULT_HISTORY_RANGE)
+    if range_key not in HISTORY_RANGES:
+        range_key = DEFAULT_HISTORY_RANGE
+    start, end = history_range(range_key)
+
+    history = downsample_history(printer.pk, start, end)
+
+    return render(request, 'app/printer_history.html', context={
+        'add_printer_form': AddPrinterForm(), 'printer': printer, 'series': chart_series(history, start, end), 'ranges': list(HISTORY_RANGES),
+        'range_key': range_key, 'start': start, 'end': end, 'chart_width': CHART_WIDTH
+    })
+
 def add_printer_form_function(form):
     """
-    Function used to add the printer to the database after getting the SNMP version and printer model
-    from the SNMP data.
+    Function used to add the printer to the database. The SNMP version, community, and printer model are
+    determined from the SNMP data in a background thread (see ``run_printer_probe`` in jobs.py), so the
+    request doesn't wait for SNMP timeouts when the printer is off or the IP address is wrong.
 
     Args:
         form (forms.AddPrinterForm): User submitted form with printer name, printer location, IP 
         address, and department name.
     
     Returns:
-        No returns.
-    """
-    printer_name = form.cleaned_data['printer_name']
-    printer_location = form.cleaned_data['printer_location']
-    ip_address = form.cleaned_data['ip_address']
-    department_name = form.cleaned_data['department_name']
-
-    # Get the SNMP version through brute-force
-    # If the function returns -1 that means that either the IP address is wrong or 
-    #   the printer is off and the exception is raised.
-    # If the function returns -2 the some unexpected error occurred and the exception is raised.
-    # SNMP versions are either 1, 2, or 3.
-    version = determine_snmp_version(ip_address)
-    if version == -1:
-        raise PrinterOffException
-    elif version == -2:
-        raise PrinterNotAddedException
-
-    # Get the printer models through the SNMP data
-    # If the function return is -2 then some unexpected error occurred and the exception is raised.
-    # If the function return is -3 then that means that the printer doesn't have usable SNMP data
-    #   so either the printer is too old or the firmware needs to be updated.
-    printer_model_name = determine_printer_model(ip_address, version)
-    if printer_model_name == -2:
-        raise PrinterNotAddedException
-    elif printer_model_name == -3:
-        raise NoSNMPDataException
-
-    # If both the version and printer model didn't raise any exceptions, then the printer
-    #   will be added to the database.
-    Printer.objects.create(
-        printer_name=printer_name,
-        printer_model_name=printer_model_name,
-        printer_location=printer_location,
-        ip_address=ip_address,
-        department_name=department_name,
-        snmp_version=version
-    )
+        printer (Printer): The new :model:`app.Printer`, in the ``'probing'`` state until the background thread ends.
+    """
+    printer = form.save(commit=False)
+    printer.probe_state = Printer.PROBING
+    printer.probe_updated = timezone.now()
+    printer.save()
+    bump_dashboard_version()
 
-    # Calls the 'updatetonerdata' management command to have toner data saved on the database
-    #   for the printer that was just added.
-    extra_data = f'-n {printer_name} -i {ip_address}'
-    call_command('updatetonerdata', extra_data)
+    start_printer_probe(printer)
+    return printer
+
+def report_printer_probes(request):
+    """
+    Show the result of the printers added in this session whose background probe ended since the last page load.
+
+    The ids of the printers being added are kept in the session. Printers that couldn't be added are deleted and
+    their error is shown with the ``messages`` framework, like it was when the printer was added in the request.
+    """
+    printer_ids = request.session.get('probing_printers')
+    if not printer_ids:
+        return
+
+    still_probing = list()
+    for printer in Printer.objects.filter(pk__in=printer_ids):
+        if printer.probe_state == Printer.PROBING:
+            still_probing.append(printer.pk)
+        elif printer.probe_state == Printer.FAILED:
+            messages.error(request, printer.probe_error)
+            printer.delete()
+            bump_dashboard_version()
+
+    request.session['probing_printers'] = still_probing
 
 def toner_level_cleanup(all_toner_levels):
     """
@@ -210,12 +448,3 @@ def toner_level_cleanup(all_toner_levels):
             level = obj.level
     
     return new_all_toner_levels
-
-class PrinterOffException(Exception):
-    pass
-
-class PrinterNotAddedException(Exception):
-    pass
-
-class NoSNMPDataException(Exception):
-    pass
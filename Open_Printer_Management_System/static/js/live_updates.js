@@ -0,0 +1,40 @@
+// Keeps the printer cards up to date with the Server-Sent Events stream (see app/events.py) instead of reloading
+//   the page. After every poll the server sends the cards that changed, and they are replaced in place.
+// When the project isn't running with an ASGI server the stream doesn't exist and the page works like before.
+(function () {
+  var dashboard = document.getElementById('dashboard');
+  if (!dashboard || !dashboard.dataset.eventsUrl || !window.EventSource) {
+    return;
+  }
+
+  var lastUpdated = document.getElementById('last-updated');
+  var source = new EventSource(dashboard.dataset.eventsUrl);
+
+  source.addEventListener('open', function () {
+    window.liveUpdatesConnected = true;
+  });
+
+  source.addEventListener('error', function () {
+    window.liveUpdatesConnected = false;
+  });
+
+  source.addEventListener('levels', function (event) {
+    var data = JSON.parse(event.data);
+
+    Object.keys(data.printers).forEach(function (printerId) {
+      var card = dashboard.querySelector('[data-printer-id="' + printerId + '"]');
+      if (card) {
+        card.outerHTML = data.printers[printerId].html;
+      }
+    });
+
+    if (lastUpdated && data.last_updated) {
+      lastUpdated.textContent = data.last_updated;
+    }
+  });
+
+  // Printers were added, deleted, or moved to another department.
+  source.addEventListener('reload', function () {
+    window.location.reload();
+  });
+})();
@@ -0,0 +1,79 @@
+// Starts a toner refresh in the background instead of waiting for it in the request, shows its progress
+//   on the "Refresh Toner Data" link, and reloads the page when it is done so the new levels are shown
+//   (unless the live updates already showed them, see live_updates.js).
+(function () {
+  var link = document.getElementById('refresh-toner-link');
+  if (!link || !window.fetch) {
+    return;
+  }
+
+  var originalText = link.textContent;
+  var jsonHeaders = {'Accept': 'application/json'};
+
+  function statusUrl(jobId) {
+    return link.dataset.statusUrl.replace(/0$/, jobId);
+  }
+
+  function showProgress(job) {
+    var text = 'Refreshing ' + job.printers_done + '/' + job.printers_total;
+    if (job.printers_failed) {
+      text += ' (' + job.printers_failed + ' not answering)';
+    }
+    link.textContent = text;
+  }
+
+  function watch(jobId) {
+    fetch(statusUrl(jobId), {headers: jsonHeaders})
+      .then(function (response) { return response.json(); })
+      .then(function (job) {
+        if (job.active) {
+          showProgress(job);
+          setTimeout(function () { watch(jobId); }, 2000);
+        } else if (job.status === 'failed') {
+          link.textContent = originalText;
+          link.title = 'The last refresh failed: ' + job.error;
+        } else if (window.liveUpdatesConnected) {
+          link.textContent = originalText;
+        } else {
+          window.location.reload();
+        }
+      })
+      .catch(function () {
+        setTimeout(function () { watch(jobId); }, 5000);
+      });
+  }
+
+  link.addEventListener('click', function (event) {
+    event.preventDefault();
+    link.textContent = 'Refreshing...';
+
+    fetch(link.href, {headers: jsonHeaders})
+      .then(function (response) { return response.json(); })
+      .then(function (job) { watch(job.id); })
+      .catch(function () { window.location = link.href; });
+  });
+
+  // A refresh started before the page was loaded (by another user or in another tab).
+  if (link.dataset.jobId) {
+    watch(link.dataset.jobId);
+  }
+})();
+
+// Printers that were just added are checked in the background, reload until they are ready.
+// With the live updates their cards change when they are ready, and the page is only reloaded to show the
+//   error of the printers that couldn't be added.
+(function () {
+  function checkProbing() {
+    if (!window.liveUpdatesConnected) {
+      window.location.reload();
+    } else if (document.querySelector('[data-probing]')) {
+      setTimeout(checkProbing, 3000);
+    } else if (document.querySelector('[data-probe-failed]')) {
+      window.location.reload();
+    }
+  }
+
+  if (document.querySelector('[data-probing]')) {
+    setTimeout(checkProbing, 3000);
+  }
+})();
@@ -0,0 +1,43 @@
+// Shows/hides the location, IP address, and model of the printer cards without a request to the server.
+// Every switch has a data-hides attribute with the class of the card data it controls. The choice is kept in
+//   localStorage so it is the same on the next page load.
+(function () {
+  var dashboard = document.getElementById('dashboard');
+  var form = document.getElementById('toggles_form');
+  if (!dashboard || !form) {
+    return;
+  }
+
+  function storageKey(input) {
+    return 'opms-toggle-' + input.id;
+  }
+
+  function apply(input) {
+    dashboard.classList.toggle('hide-' + input.dataset.hides, !input.checked);
+  }
+
+  Array.prototype.forEach.call(form.querySelectorAll('input[data-hides]'), function (input) {
+    var saved = null;
+    try {
+      saved = window.localStorage.getItem(storageKey(input));
+    } catch (error) {
+      // localStorage isn't available (private browsing), the initial values are used.
+    }
+    if (saved !== null) {
+      input.checked = saved === 'true';
+    }
+    apply(input);
+
+    input.addEventListener('change', function () {
+      apply(input);
+      try {
+        window.localStorage.setItem(storageKey(input), input.checked);
+      } catch (error) {}
+    });
+  });
+
+  // The switches aren't sent to the server anymore.
+  form.addEventListener('submit', function (event) {
+    event.preventDefault();
+  });
+})();
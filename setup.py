@@ -15,7 +15,9 @@ setup(
     install_requires=[
         'django>=3.0,<4.0',
         'easysnmp>=0.2.5,<0.3.0',
-        'gunicorn>=20.0,<21'
+        'gunicorn>=20.0,<21',
+        'uvicorn>=0.13,<0.17',
+        'numpy>=1.19'
     ],
     classifiers=[
         'Development Status :: 5 - Production/Stable',
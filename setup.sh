@@ -155,15 +155,7 @@ get_timedelta_user_input() {
     echo -e "\n    Examples:"
     echo "            Hours:   1                OR                Hours:   0"
     echo "            Minutes: 0                OR                Minutes: 30"
-    echo -e "      Every hour on the hour                Every 30th minute (1:00, 1:30, 2:00...)\n"
-
-    echo "    Please note that if entering a minute value that isn't equally divisible by 60 and/or an"
-    echo "     hour value that isn't equally divisible by 24, the toner update job will also be ran at"
-    echo -e "     the 0th minute (every hour on the hour) and/or at midnight respectively.\n"
-    echo "    Examples: "
-    echo "           Every 18 minutes (1:00, 1:18, 1:36, 1:54, 2:00...)        OR     Every 45 minutes (1:00, 1:45, 2:00, 2:45...)"
-    echo "           Every 7 hours (00:00, 7:00, 14:00, 21:00, 00:00...)       OR     Every 15 hours (00:00, 15:00, 00:00, 15:00 ...)"
-    echo -e "           Every 7 hours and 18 minutes (21:00, 21:18, 21:36, 21:54, 00:00, 00:18 ... 7:00, 7:18 ... 14:00, 14:18 ...)\n"
+    echo -e "           Every hour                             Every 30 minutes\n"
 
     echo -e "\nPlease enter a number next to 'Hours: ' and 'Minutes: '. The minimum time value is every 5 minutes."
 
@@ -287,27 +279,41 @@ new_static_data="STATICFILES_DIRS = [\n    os.path.join(BASE_DIR, 'static'),\n]\
 sed -i -e "s~${original_static_data}~${new_static_data}~g" Open_Printer_Management_System/Open_Printer_Management_System/settings.py
 
 # Create crontab file
-crontab_text=""
-if [[ $timedelta_minutes -eq 0 || $timedelta_minutes == "0" ]]; then
-    crontab_text="${crontab_text}0 "
-else
-    crontab_text="${crontab_text}*/${timedelta_minutes} "
-fi
-
-if [[ $timedelta_hours -eq 0 || $timedelta_hours -eq 1 || $timedelta_hours == "0" || $timedelta_hours == "1" ]]; then
-    crontab_text="${crontab_text}* "
-else
-    crontab_text="${crontab_text}*/${timedelta_hours} "
-fi
-
-crontab_text="${crontab_text}* * * cd ${current_directory} && ./updatetonerdata.sh"
+# Summarize the toner history into hourly/daily rollups and delete the old history every hour.
+mkdir -p $current_directory/logs
+crontab_text="5 * * * * cd ${current_directory}/Open_Printer_Management_System && ${current_directory}/venv/bin/python manage.py rolluptonerdata >> ${current_directory}/logs/rolluptonerdata.log 2>&1"
 
-echo "${crontab_text}" > $current_directory/crontab_updatetonerdata
+echo -e "${crontab_text}" > $current_directory/crontab_updatetonerdata
 
 # Activate crontab
 crontab -u $username $current_directory/crontab_updatetonerdata
 
 
+# Create the toner poller service file
+# The poller runs all the time and polls every printer every TIMEDELTA (from settings.py), replacing the
+#   old cron job that started updatetonerdata.sh.
+poller_service_file_text=\
+"[Unit]
+Description=Open Printer Management System toner poller
+After=network.target
+
+[Service]
+User=$username
+WorkingDirectory=$current_directory/Open_Printer_Management_System
+ExecStart=$current_directory/venv/bin/python -u manage.py runpoller
+Restart=on-failure
+KillSignal=SIGTERM
+TimeoutStopSec=45
+
+[Install]
+WantedBy=multi-user.target
+"
+echo "${poller_service_file_text}" | sudo tee /etc/systemd/system/runpoller.service
+
+# Start and enable the toner poller
+sudo systemctl daemon-reload && sudo systemctl start runpoller && sudo systemctl enable runpoller
+
+
 # Create Gunicorn socket file
 gunicorn_socket_file_text=\
 "[Unit]
@@ -337,8 +343,9 @@ WorkingDirectory=$current_directory/Open_Printer_Management_System
 ExecStart=$current_directory/venv/bin/gunicorn \\
           --access-logfile - \\
           --workers 3 \\
+          --worker-class uvicorn.workers.UvicornWorker \\
           --bind unix:/run/gunicorn.sock \\
-          Open_Printer_Management_System.wsgi:application
+          Open_Printer_Management_System.asgi:application
 
 [Install]
 WantedBy=multi-user.target
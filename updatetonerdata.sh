@@ -1,7 +1,10 @@
 #!/bin/bash
 
-seconds=0
+# One-off toner update. The installer runs the `runpoller` service instead of this script, but it can still be
+#   used from cron. A run that goes long makes the next one exit instead of both polling at the same time.
+
 cron_log_file=${PWD}/logs/updatetonerdata.log
+lock_file=${PWD}/logs/updatetonerdata.lock
 
 if [[ ! -d "${PWD}/logs/" ]]; then
     mkdir "${PWD}/logs/"
@@ -11,6 +14,15 @@ if [[ ! -f $cron_log_file ]]; then
     touch $cron_log_file
 fi
 
+exec 9> ${lock_file}
+if ! flock -n 9; then
+    echo "$(date) The previous update is still running, skipping this one." >> ${cron_log_file}
+    exit 0
+fi
+
+# Bash counts the seconds since SECONDS was set.
+SECONDS=0
+
 echo "Starting" >> ${cron_log_file}
 date >> ${cron_log_file}
 
@@ -19,5 +31,5 @@ cd Open_Printer_Management_System
 python manage.py updatetonerdata >> ${cron_log_file} 2>&1
 
 echo "Finished." >> ${cron_log_file}
-duration=$seconds
-echo "$(($duration / 60)) minutes and $(($duration % 60)) seconds elapsed.\n" >> ${cron_log_file}
+duration=$SECONDS
+echo -e "$(($duration / 60)) minutes and $(($duration % 60)) seconds elapsed.\n" >> ${cron_log_file}